@@ -0,0 +1,114 @@
+import asyncio
+import itertools
+import logging
+from typing import List, Optional, Protocol, Tuple
+
+from askmevllm.config import ENGINE, MAX_BATCH_ITEMS, MODEL
+from askmevllm.engine import (
+    FakeBackend,
+    InferenceBackend,
+    RequestOutput,
+    SamplingParams,
+    VLLMBackend,
+    _convert_request_output,
+)
+
+
+class AsyncInferenceBackend(Protocol):
+    model: str
+
+    async def generate_one(self, prompt: str, params: SamplingParams) -> RequestOutput:
+        ...
+
+
+class AsyncVLLMBackend(VLLMBackend):
+    """Streams requests into vLLM's AsyncLLMEngine, which batches them
+    continuously on its own; every request is awaited separately."""
+
+    def __init__(self, engine, model: str = MODEL):
+        super().__init__(None, model=model)
+        self.engine = engine
+        self._request_ids = itertools.count()
+
+    @classmethod
+    def from_pretrained(cls, model: str = MODEL, **kwargs) -> "AsyncVLLMBackend":
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
+
+        engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(model=model, **kwargs))
+        return cls(engine, model=model)
+
+    def llm_engine(self):
+        return self.engine.engine
+
+    def generate(self, prompts, sampling_params):
+        raise TypeError("AsyncVLLMBackend only supports generate_one")
+
+    async def generate_one(self, prompt: str, params: SamplingParams) -> RequestOutput:
+        final = None
+        async for output in self.engine.generate(
+            prompt, self.to_vllm_params(params), str(next(self._request_ids))
+        ):
+            final = output
+        return _convert_request_output(final)
+
+
+class BatchingAsyncBackend:
+    """Async front for a synchronous backend.
+
+    Requests awaited at about the same time are collected into one
+    `generate` call, which runs in a worker thread so the event loop keeps
+    preparing and parsing other batches meanwhile. One call runs at a time,
+    like a single engine.
+    """
+
+    def __init__(
+        self,
+        backend: InferenceBackend,
+        max_batch_size: int = MAX_BATCH_ITEMS,
+        max_wait: float = 0.002,
+    ):
+        self.backend = backend
+        self.model = backend.model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.calls = 0
+        self._queue: List[Tuple[str, SamplingParams, asyncio.Future]] = []
+        self._drain_task: Optional[asyncio.Task] = None
+
+    async def generate_one(self, prompt: str, params: SamplingParams) -> RequestOutput:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((prompt, params, future))
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        while self._queue:
+            # Give requests submitted in the same tick a chance to join.
+            await asyncio.sleep(self.max_wait)
+            batch = self._queue[: self.max_batch_size]
+            del self._queue[: self.max_batch_size]
+            self.calls += 1
+            try:
+                outputs = await asyncio.to_thread(
+                    self.backend.generate,
+                    [prompt for prompt, _, _ in batch],
+                    [params for _, params, _ in batch],
+                )
+            except Exception as e:
+                logging.error(f"Engine call for {len(batch)} requests failed: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+
+def create_async_backend(kind: str = ENGINE, **kwargs) -> AsyncInferenceBackend:
+    if kind == "vllm":
+        return AsyncVLLMBackend.from_pretrained(**kwargs)
+    if kind == "fake":
+        return BatchingAsyncBackend(FakeBackend(**kwargs))
+    raise ValueError(f"Unknown engine: {kind}")
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set
+
+from tqdm import tqdm
+
+from askmevllm.async_engine import AsyncInferenceBackend
+from askmevllm.config import ASYNC_MAX_IN_FLIGHT, OUTPUT_FORMAT, OUTPUT_PATH
+from askmevllm.engine import GenerationRequest, group_order
+from askmevllm.export import export_dataset
+from askmevllm.metrics import BatchTimer, metrics
+from askmevllm.models import dataset
+from askmevllm.pipeline import PipelineStage, build_pipeline_stages
+from askmevllm.scheduler import log_batch_stats
+
+
+async def _timed_generate(llm: AsyncInferenceBackend, request: GenerationRequest):
+    start = time.perf_counter()
+    output = await llm.generate_one(request.prompt, request.sampling_params)
+    return output, time.perf_counter() - start
+
+
+async def _run_batch(
+    stage: PipelineStage,
+    items: List,
+    requests: List[GenerationRequest],
+    timer: BatchTimer,
+    llm: AsyncInferenceBackend,
+    in_flight: Dict[str, int],
+    bar: tqdm,
+):
+    # Submit in paragraph-grouped order so prefix-sharing prompts arrive
+    # together; gather still returns outputs in the order of `order`.
+    order = group_order(requests)
+    with timer.phase("generate"):
+        timed = await asyncio.gather(
+            *(_timed_generate(llm, requests[i]) for i in order), return_exceptions=True
+        )
+    # A request that raised is left out; its item fails and is retried (see
+    # askmevllm.retry), the rest of the batch is kept.
+    kept_requests, results = [], []
+    timer.latencies = []
+    for i in sorted(range(len(order)), key=order.__getitem__):
+        result = timed[i]
+        if isinstance(result, BaseException):
+            logging.error(f"{stage.name} request failed: {result}")
+            continue
+        output, latency = result
+        kept_requests.append(requests[order[i]])
+        results.append(output)
+        timer.latencies.append(latency)
+    timer.outputs = results
+
+    in_flight[stage.name] -= len(requests)
+    with timer.phase("parse"):
+        stage.finish(items, kept_requests, results)
+    metrics.record_batch(stage.name, len(items), timer)
+    stage.finished_at = time.time()
+    stage.processed += len(items)
+    bar.update(len(items))
+
+
+async def run_async_pipeline(
+    stages: List[PipelineStage],
+    llm: AsyncInferenceBackend,
+    queue_size: int,
+    max_in_flight: int = ASYNC_MAX_IN_FLIGHT,
+) -> Dict[str, float]:
+    """Keeps up to `max_in_flight` requests per stage outstanding at the
+    engine. Batches are built and their results parsed on the event loop
+    while the engine works on other batches, so CPU-side work overlaps
+    generation instead of alternating with it."""
+    bars = {
+        stage.name: tqdm(desc=stage.desc, total=len(stage.inbox) if stage.name == "stage_1" else None)
+        for stage in reversed(stages)
+    }
+    in_flight = {stage.name: 0 for stage in stages}
+    tasks: Set[asyncio.Task] = set()
+    start_time = time.time()
+
+    while True:
+        for stage in stages:
+            while stage.inbox and in_flight[stage.name] < max_in_flight:
+                # Same backpressure as run_pipeline.
+                if stage.outbox is not None and len(stage.outbox) >= queue_size:
+                    break
+                items = stage.batcher.next_batch(stage.inbox)
+                if not items:
+                    break
+                if stage.started_at is None:
+                    stage.started_at = time.time()
+                timer = BatchTimer()
+                with timer.phase("build"):
+                    requests = stage.build(items)
+                in_flight[stage.name] += len(requests)
+                tasks.add(
+                    asyncio.create_task(
+                        _run_batch(
+                            stage, items, requests, timer, llm, in_flight, bars[stage.name]
+                        )
+                    )
+                )
+
+        if not tasks:
+            logging.info("All pipeline queues drained. Finishing process.")
+            break
+
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            # Surface failures instead of silently dropping the batch.
+            task.result()
+
+    for bar in bars.values():
+        bar.close()
+
+    times = {f"{stage.name}_time": stage.elapsed() for stage in reversed(stages)}
+    times["total_time"] = time.time() - start_time
+    return times
+
+
+def process_all_paragraphs_async(
+    batch_size,
+    llm: AsyncInferenceBackend,
+    queue_size: Optional[int] = None,
+    max_in_flight: int = ASYNC_MAX_IN_FLIGHT,
+):
+    logging.info("Starting async generation")
+    queue_size = queue_size or 4 * batch_size
+    stages = build_pipeline_stages(batch_size)
+    times = asyncio.run(run_async_pipeline(stages, llm, queue_size, max_in_flight))
+    logging.info(f"Process completed in {times}")
+    log_batch_stats({stage.name: stage.batcher for stage in reversed(stages)})
+
+    export_dataset(dataset, OUTPUT_PATH, OUTPUT_FORMAT)
+
+    return times
@@ -0,0 +1,392 @@
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from askmevllm.config import (
+    BENCHMARK_DIR,
+    BENCHMARK_SCALES,
+    BENCHMARK_STAGE_PARAGRAPHS,
+    CSV_CHUNKSIZE,
+    DATASET_STORAGE,
+    LOGGING_LEVEL,
+    SEED,
+)
+
+SECTION_NAMES = [
+    "Introduction",
+    "History",
+    "Geography",
+    "Early life",
+    "Career",
+    "Reception",
+    "Legacy",
+    "See also",
+]
+SYLLABLES = ["ka", "lo", "mi", "ser", "tan", "vel", "dra", "por", "quin", "ath", "bel", "nor"]
+
+
+def synthetic_vocabulary(size: int = 5000, seed: int = SEED) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 4, size=size)
+    picks = rng.integers(0, len(SYLLABLES), size=(size, 3))
+    words = {"".join(SYLLABLES[j] for j in row[:n]) for row, n in zip(picks, lengths)}
+    words.update(str(year) for year in range(1800, 2024))
+    # object dtype so slices share the word objects instead of copying them
+    return np.array(sorted(words), dtype=object)
+
+
+def synthetic_corpus_frames(
+    rows: int, seed: int = SEED, chunk_rows: int = CSV_CHUNKSIZE
+) -> Iterator[pd.DataFrame]:
+    """Yields chunks of a corpus with the wiki_text_cleaned_v1.csv schema.
+
+    Pages hold 1-24 paragraphs under a few sections, word counts are
+    log-normal (median about 55, like cleaned Wikipedia paragraphs), about
+    a third of the raw texts carry citation markers and 3% are is_bad.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = synthetic_vocabulary(seed=seed)
+
+    page_sizes = rng.integers(1, 25, size=rows // 12 + 1)
+    while page_sizes.sum() < rows:
+        page_sizes = np.concatenate([page_sizes, rng.integers(1, 25, size=rows // 12 + 1)])
+    pages = np.repeat(np.arange(len(page_sizes)), page_sizes)[:rows]
+    page_starts = np.concatenate([[0], np.cumsum(page_sizes)[:-1]])
+    positions = np.arange(rows) - page_starts[pages]
+
+    for start in range(0, rows, chunk_rows):
+        end = min(start + chunk_rows, rows)
+        n = end - start
+        page = pages[start:end]
+        position = positions[start:end]
+        word_counts = np.clip(rng.lognormal(4.0, 0.7, size=n).astype(np.int64), 3, 1000)
+        words = vocabulary[rng.integers(0, len(vocabulary), size=int(word_counts.sum()))]
+        offsets = np.concatenate([[0], np.cumsum(word_counts)])
+        text_cleaned = [
+            " ".join(words[offsets[i] : offsets[i + 1]]).capitalize() + "."
+            for i in range(n)
+        ]
+        citations = rng.random(n) < 0.3
+        text = [
+            f"{t[:-1]}[{k}]." if cited else t
+            for t, cited, k in zip(text_cleaned, citations, rng.integers(1, 99, size=n))
+        ]
+
+        section = (page * 7 + position // 4) % len(SECTION_NAMES)
+        section_name = np.array(SECTION_NAMES, dtype=object)[section]
+        subsection = np.where(rng.random(n) < 0.3, (position % 3) + 1, 0)
+        subsection_name = [f"Part {k}" if k else None for k in subsection]
+        subsubsection_name = [
+            f"Detail {k}" if k and d else None
+            for k, d in zip(subsection, rng.random(n) < 0.1)
+        ]
+        section_hierarchy = [
+            " > ".join(part for part in parts if part)
+            for parts in zip(section_name, subsection_name, subsubsection_name)
+        ]
+
+        yield pd.DataFrame(
+            {
+                "id": np.arange(start + 1, end + 1),
+                "page_name": [f"Synthetic page {p}" for p in page],
+                "section_name": section_name,
+                "subsection_name": subsection_name,
+                "subsubsection_name": subsubsection_name,
+                "text": text,
+                "section_hierarchy": section_hierarchy,
+                "text_cleaned": text_cleaned,
+                "word_count": word_counts,
+                "is_bad": rng.random(n) < 0.03,
+            }
+        )
+
+
+def synthetic_corpus(directory: str, rows: int, seed: int = SEED) -> str:
+    """Path of the synthetic corpus with `rows` paragraphs, written on first use."""
+    path = os.path.join(directory, f"wiki_synthetic_{rows}_{seed}.csv")
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    logging.info(f"Writing synthetic corpus of {rows} paragraphs to {path}")
+    tmp_path = f"{path}.tmp"
+    for i, chunk in enumerate(synthetic_corpus_frames(rows, seed)):
+        chunk.to_csv(tmp_path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def measure(
+    phase: str, fn: Callable[[], Any], trace_memory: bool = False
+) -> Tuple[Any, Dict[str, Any]]:
+    """Runs fn once; returns its result and a record of wall time and memory.
+
+    peak_rss_mb is the process high-water mark after the phase, so it only
+    grows over a run. traced_peak_mb is the phase's own peak of Python
+    allocations, and only measured with trace_memory since tracing slows
+    everything down.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+        seconds = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] / 1024**2 if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, {
+        "phase": phase,
+        "seconds": seconds,
+        "peak_rss_mb": _peak_rss_mb(),
+        "traced_peak_mb": traced_peak,
+    }
+
+
+def run_scale(
+    rows: int,
+    directory: str,
+    stage_paragraphs: Optional[int],
+    batch_size: int,
+    trace_memory: bool = False,
+    seed: int = SEED,
+) -> List[Dict[str, Any]]:
+    """Benchmarks one corpus size. Runs in a fresh process (see run_benchmarks)
+    because it fills the process-wide dataset."""
+    logging.basicConfig(level=LOGGING_LEVEL)
+    from askmevllm.engine import FakeBackend
+    from askmevllm.export import export_dataset
+    from askmevllm.helpers import (
+        create_author_if_not_exists,
+        load_csv_data_all,
+        load_csv_data_rand_n,
+    )
+    from askmevllm.main import run_stages_s2s
+    from askmevllm.metrics import metrics
+    from askmevllm.models import dataset, flatten_dataset
+    from askmevllm.scheduler import make_batchers
+
+    path = synthetic_corpus(directory, rows, seed)
+    records = []
+
+    def record(phase, fn, count):
+        result, entry = measure(phase, fn, trace_memory)
+        entry["rows"] = count(result) if callable(count) else count
+        records.append(entry)
+        logging.info(f"{rows} rows, {phase}: {entry}")
+        return result
+
+    record("load_csv_data_all", lambda: load_csv_data_all(path, overwrite=True), rows)
+    sample = min(stage_paragraphs or rows, rows)
+    # the reservoir sample reads the whole file, so its rate is per row read
+    record(
+        "load_csv_data_rand_n",
+        lambda: load_csv_data_rand_n(path, sample, overwrite=True, seed=seed),
+        rows,
+    )
+
+    times = record(
+        "stages", lambda: run_stages_s2s(make_batchers(batch_size), FakeBackend()), sample
+    )
+    # One record per stage loop too; memory is only known for all four.
+    for stage, summary in metrics.summary().items():
+        records.append(
+            {
+                "phase": stage,
+                "seconds": times[f"{stage}_time"],
+                "rows": summary["items"],
+                "peak_rss_mb": None,
+                "traced_peak_mb": None,
+            }
+        )
+
+    def lookup_authors():
+        # the hit path: every stage prompt resolves to an existing template author
+        prompts = [a.prompt for a in dataset.authors]
+        models = [a.model for a in dataset.authors]
+        for i in range(rows):
+            create_author_if_not_exists(prompts[i % len(prompts)], models[i % len(models)])
+
+    def create_authors():
+        for i in range(sample):
+            create_author_if_not_exists(f"Synthetic template {i}: {{paragraph}}", "bench-model")
+
+    record("create_author_if_not_exists[existing]", lookup_authors, rows)
+    record("create_author_if_not_exists[new]", create_authors, sample)
+
+    record("flatten_dataset", lambda: flatten_dataset(dataset), len)
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "output.csv")
+        record("export_dataset", lambda: export_dataset(dataset, output, "csv"), len(dataset.ratings))
+
+    for entry in records:
+        entry["scale"] = rows
+        entry["rows_per_second"] = entry["rows"] / entry["seconds"] if entry["seconds"] else None
+    return records
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    scales: List[int] = BENCHMARK_SCALES,
+    directory: str = BENCHMARK_DIR,
+    results_path: Optional[str] = None,
+    stage_paragraphs: Optional[int] = BENCHMARK_STAGE_PARAGRAPHS,
+    batch_size: int = 64,
+    trace_memory: bool = False,
+    seed: int = SEED,
+) -> List[Dict[str, Any]]:
+    """Runs every scale in its own process and appends the records to
+    `results_path` (JSON lines, one record per scale and phase)."""
+    results_path = results_path or os.path.join(directory, "results.jsonl")
+    run = {
+        "run_id": uuid.uuid4().hex[:12],
+        "time": time.time(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage": DATASET_STORAGE,
+        "batch_size": batch_size,
+        "stage_paragraphs": stage_paragraphs,
+    }
+    # Progress bars would swamp the log at these sizes.
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    records = []
+    for rows in scales:
+        with ProcessPoolExecutor(1, mp_context=mp.get_context("spawn")) as executor:
+            scale_records = executor.submit(
+                run_scale, rows, directory, stage_paragraphs, batch_size, trace_memory, seed
+            ).result()
+        records.extend({**run, **entry} for entry in scale_records)
+
+    directory = os.path.dirname(results_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(results_path, "a", encoding="utf-8") as f:
+        for entry in records:
+            f.write(json.dumps(entry) + "\n")
+    logging.info(f"Wrote {len(records)} benchmark records to {results_path}")
+    return records
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_results(
+    current: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float = 0.2
+) -> List[Dict[str, Any]]:
+    """Pairs records on (scale, stage sample, phase), using the latest
+    baseline record for each, and flags phases that got more than
+    `tolerance` slower or heavier."""
+
+    def key(entry):
+        return entry["scale"], entry.get("stage_paragraphs"), entry["phase"]
+
+    latest = {}
+    for entry in sorted(baseline, key=lambda e: e["time"]):
+        latest[key(entry)] = entry
+
+    rows = []
+    for entry in current:
+        base = latest.get(key(entry))
+        if base is None:
+            continue
+        time_ratio = entry["seconds"] / base["seconds"] if base["seconds"] else None
+        memory_ratio = (
+            entry["peak_rss_mb"] / base["peak_rss_mb"]
+            if entry["peak_rss_mb"] and base["peak_rss_mb"]
+            else None
+        )
+        rows.append(
+            {
+                "scale": entry["scale"],
+                "phase": entry["phase"],
+                "seconds": entry["seconds"],
+                "baseline_seconds": base["seconds"],
+                "time_ratio": time_ratio,
+                "memory_ratio": memory_ratio,
+                "regression": any(
+                    ratio is not None and ratio > 1 + tolerance
+                    for ratio in (time_ratio, memory_ratio)
+                ),
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading, the stage loops, authors and export on synthetic corpora"
+    )
+    parser.add_argument("--scales", type=int, nargs="+", default=BENCHMARK_SCALES)
+    parser.add_argument("--dir", default=BENCHMARK_DIR, help="Where corpora and results are kept")
+    parser.add_argument("--results", default=None, help="Defaults to DIR/results.jsonl")
+    parser.add_argument(
+        "--stage-paragraphs",
+        type=int,
+        default=BENCHMARK_STAGE_PARAGRAPHS,
+        help="Paragraphs sampled into the stage loops (0 runs the whole corpus)",
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--trace-memory", action="store_true", help="Also trace per-phase Python allocations")
+    parser.add_argument("--baseline", default=None, help="results.jsonl to compare this run against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOGGING_LEVEL)
+    # read before this run's records are appended, in case it is the same file
+    baseline = load_results(args.baseline) if args.baseline else None
+    records = run_benchmarks(
+        args.scales,
+        args.dir,
+        args.results,
+        args.stage_paragraphs or None,
+        args.batch_size,
+        args.trace_memory,
+    )
+    table = pd.DataFrame(records)[["scale", "phase", "rows", "seconds", "rows_per_second", "peak_rss_mb"]]
+    print(table.to_string(index=False))
+
+    if baseline is not None:
+        comparison = compare_results(records, baseline, args.tolerance)
+        print(pd.DataFrame(comparison).to_string(index=False))
+        if any(row["regression"] for row in comparison):
+            logging.error("Benchmark regressions beyond tolerance")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+from typing import Dict, List
+
+from askmevllm.engine import (
+    CompletionOutput,
+    InferenceBackend,
+    PromptTokenIds,
+    RequestOutput,
+    SamplingParams,
+    SamplingParamsArg,
+    expand_sampling_params,
+)
+from askmevllm.helpers import generate_hash
+
+
+class CompletionCache:
+    """SQLite-backed prompt -> completion store with LRU eviction by size."""
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024**3):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)"
+        )
+        self._conn.commit()
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, RequestOutput]:
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # Stay well below SQLite's bound-parameter limit.
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM completions WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = _decode_output(value)
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE completions SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, entries: Dict[str, RequestOutput]):
+        if not entries:
+            return
+        with self._lock:
+            now = time.time()
+            for key, output in entries.items():
+                value = json.dumps(asdict(output))
+                size = len(value)
+                previous = self._conn.execute(
+                    "SELECT size FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+                if previous:
+                    self.total_bytes -= previous[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, size, now),
+                )
+                self.total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Evict down to 90% so we don't evict again on the very next insert.
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT key, size FROM completions ORDER BY last_access ASC"
+        )
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+        logging.info(f"Evicted {len(evicted)} entries from the completion cache")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _decode_output(value: str) -> RequestOutput:
+    data = json.loads(value)
+    data["outputs"] = [CompletionOutput(**o) for o in data["outputs"]]
+    return RequestOutput(**data)
+
+
+class CachedBackend:
+    """Serves repeated (model, prompt, sampling params) requests from a
+    CompletionCache and only sends misses to the wrapped backend."""
+
+    def __init__(self, backend: InferenceBackend, cache: CompletionCache):
+        self.backend = backend
+        self.cache = cache
+        self.model = backend.model
+
+    def generate(
+        self,
+        prompts: List[str],
+        sampling_params: SamplingParamsArg,
+        prompt_token_ids: PromptTokenIds = None,
+    ) -> List[RequestOutput]:
+        if not prompts:
+            return []
+        params = expand_sampling_params(prompts, sampling_params)
+        keys = [generate_hash(self.model, prompt, p) for prompt, p in zip(prompts, params)]
+        cached = self.cache.get_many(keys)
+
+        miss_indices = []
+        seen = set()
+        for i, key in enumerate(keys):
+            if key not in cached and key not in seen:
+                miss_indices.append(i)
+                seen.add(key)
+
+        if miss_indices:
+            miss_params: SamplingParamsArg = [params[i] for i in miss_indices]
+            if isinstance(sampling_params, SamplingParams):
+                miss_params = sampling_params
+            miss_prompts = [prompts[i] for i in miss_indices]
+            if prompt_token_ids is not None:
+                outputs = self.backend.generate(
+                    miss_prompts,
+                    miss_params,
+                    prompt_token_ids=[prompt_token_ids[i] for i in miss_indices],
+                )
+            else:
+                outputs = self.backend.generate(miss_prompts, miss_params)
+            fresh = {keys[i]: output for i, output in zip(miss_indices, outputs)}
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    async def generate_one(self, prompt: str, params: SamplingParams) -> RequestOutput:
+        # For async backends (see askmevllm.async_engine). SQLite calls block,
+        # so they run off the event loop.
+        key = generate_hash(self.model, prompt, params)
+        cached = await asyncio.to_thread(self.cache.get_many, [key])
+        if key in cached:
+            return cached[key]
+        output = await self.backend.generate_one(prompt, params)
+        await asyncio.to_thread(self.cache.put_many, {key: output})
+        return output
@@ -0,0 +1,65 @@
+import math
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+from askmevllm.engine import RequestOutput, SamplingParams
+
+CLASSIFY_TOP_LOGPROBS = 20
+# What tokenizers write for a leading space or newline in their raw token
+# strings: byte-level BPE (GPT-2, Llama 3) and SentencePiece (Llama 2).
+TOKEN_SPACE_MARKERS = str.maketrans({"\u0120": " ", "\u010a": "\n", "\u2581": " "})
+
+
+@dataclass
+class LabelScore:
+    # label with the highest probability, None when no label was seen at all
+    label: Optional[str]
+    confidence: float
+    # probability of every label, renormalized over the label set
+    probabilities: Dict[str, float]
+
+
+def classification_params(top_logprobs: int = CLASSIFY_TOP_LOGPROBS) -> SamplingParams:
+    """One greedy decode step that reports the top next-token logprobs."""
+    return SamplingParams(max_tokens=1, temperature=0.0, logprobs=top_logprobs)
+
+
+def _normalize_token(token: str) -> str:
+    return token.translate(TOKEN_SPACE_MARKERS).strip().lower()
+
+
+def score_labels(
+    output: RequestOutput,
+    labels: Sequence[str],
+    aliases: Optional[Dict[str, str]] = None,
+) -> LabelScore:
+    """Score single-token labels from the first step's top logprobs.
+
+    Tokens that differ from a label, or from one of its `aliases` (e.g.
+    "Yes" for "Y"), only by case, surrounding whitespace or a tokenizer's
+    space marker ("Y", " Y", "ĠY", "y") are pooled into it, and the pooled
+    probabilities are renormalized over the label set. Labels outside the
+    top-k get zero mass; without logprobs the generated text itself decides
+    with full confidence.
+    """
+    completion = output.outputs[0]
+    masses = {label: 0.0 for label in labels}
+    by_token = {_normalize_token(alias): label for alias, label in (aliases or {}).items()}
+    by_token.update({_normalize_token(label): label for label in labels})
+
+    if completion.logprobs:
+        for token, logprob in completion.logprobs[0].items():
+            label = by_token.get(_normalize_token(token))
+            if label is not None:
+                masses[label] += math.exp(logprob)
+    else:
+        label = by_token.get(_normalize_token(completion.text))
+        if label is not None:
+            masses[label] = 1.0
+
+    total = sum(masses.values())
+    if total <= 0:
+        return LabelScore(None, 0.0, {label: 0.0 for label in labels})
+    probabilities = {label: mass / total for label, mass in masses.items()}
+    best = max(labels, key=probabilities.__getitem__)
+    return LabelScore(best, probabilities[best], probabilities)
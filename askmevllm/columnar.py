@@ -0,0 +1,556 @@
+import math
+import operator
+from array import array
+from dataclasses import asdict, fields
+from typing import Any, Dict, Iterator, List, Optional
+
+from askmevllm.models import (
+    Answer,
+    Dataset,
+    IdAllocator,
+    Paragraph,
+    PendingQueue,
+    Question,
+    Rating,
+    RetryTracker,
+)
+
+INT_NULL = -(2**63)
+
+
+class IntColumn:
+    def __init__(self):
+        self.values = array("q")
+
+    def append(self, value):
+        self.values.append(INT_NULL if value is None else int(value))
+
+    def get(self, row: int):
+        value = self.values[row]
+        return None if value == INT_NULL else value
+
+    def set(self, row: int, value):
+        self.values[row] = INT_NULL if value is None else int(value)
+
+    def clear(self):
+        self.values = array("q")
+
+    def to_list(self) -> List[Any]:
+        return [None if v == INT_NULL else v for v in self.values]
+
+
+class BoolColumn:
+    def __init__(self):
+        self.values = array("b")
+
+    def append(self, value):
+        self.values.append(-1 if value is None else int(bool(value)))
+
+    def get(self, row: int):
+        value = self.values[row]
+        return None if value < 0 else bool(value)
+
+    def set(self, row: int, value):
+        self.values[row] = -1 if value is None else int(bool(value))
+
+    def clear(self):
+        self.values = array("b")
+
+    def to_list(self) -> List[Any]:
+        return [None if v < 0 else bool(v) for v in self.values]
+
+
+class FloatColumn:
+    def __init__(self):
+        self.values = array("d")
+
+    def append(self, value):
+        self.values.append(math.nan if value is None else float(value))
+
+    def get(self, row: int):
+        value = self.values[row]
+        return None if math.isnan(value) else value
+
+    def set(self, row: int, value):
+        self.values[row] = math.nan if value is None else float(value)
+
+    def clear(self):
+        self.values = array("d")
+
+    def to_list(self) -> List[Any]:
+        return [None if math.isnan(v) else v for v in self.values]
+
+
+class StringColumn:
+    """UTF-8 bytes in one buffer addressed by (start, length) integer arrays."""
+
+    def __init__(self):
+        self.clear()
+
+    def append(self, value):
+        self.starts.append(len(self.data))
+        if value is None:
+            self.lengths.append(-1)
+            return
+        encoded = str(value).encode("utf-8")
+        self.data += encoded
+        self.lengths.append(len(encoded))
+
+    def get(self, row: int):
+        length = self.lengths[row]
+        if length < 0:
+            return None
+        start = self.starts[row]
+        return self.data[start : start + length].decode("utf-8")
+
+    def set(self, row: int, value):
+        # Overwritten bytes are not reclaimed; text columns are effectively
+        # write-once in this pipeline.
+        if value is None:
+            self.lengths[row] = -1
+            return
+        encoded = str(value).encode("utf-8")
+        self.starts[row] = len(self.data)
+        self.data += encoded
+        self.lengths[row] = len(encoded)
+
+    def clear(self):
+        self.data = bytearray()
+        self.starts = array("Q")
+        self.lengths = array("q")
+
+    def to_list(self) -> List[Any]:
+        return [self.get(row) for row in range(len(self.lengths))]
+
+
+class CategoryColumn:
+    """Dictionary-encoded strings for low-cardinality columns."""
+
+    def __init__(self):
+        self.clear()
+
+    def _code(self, value) -> int:
+        if value is None:
+            return -1
+        code = self.codes_by_value.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(value)
+            self.codes_by_value[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self._code(value))
+
+    def get(self, row: int):
+        code = self.codes[row]
+        return None if code < 0 else self.categories[code]
+
+    def set(self, row: int, value):
+        self.codes[row] = self._code(value)
+
+    def clear(self):
+        self.codes = array("i")
+        self.categories: List[Any] = []
+        self.codes_by_value: Dict[Any, int] = {}
+
+    def to_list(self) -> List[Any]:
+        categories = self.categories
+        return [None if c < 0 else categories[c] for c in self.codes]
+
+
+def _normalize_key(key):
+    # numpy integer ids coming from pandas rows
+    try:
+        return operator.index(key)
+    except TypeError:
+        return key
+
+
+class IdIndex:
+    """id -> row map; dense integer array for compact id ranges, dict beyond."""
+
+    DENSE_SLACK = 1 << 16
+
+    def __init__(self):
+        self.clear()
+
+    def set(self, key: int, row: int):
+        key = _normalize_key(key)
+        if isinstance(key, int) and 0 <= key < len(self.dense) + self.DENSE_SLACK:
+            if key >= len(self.dense):
+                self.dense.extend([-1] * (key + 1 - len(self.dense)))
+            self.dense[key] = row
+        else:
+            self.sparse[key] = row
+
+    def get(self, key, default: int = -1) -> int:
+        key = _normalize_key(key)
+        if isinstance(key, int) and 0 <= key < len(self.dense):
+            row = self.dense[key]
+            if row >= 0:
+                return row
+        return self.sparse.get(key, default)
+
+    def clear(self):
+        self.dense = array("q")
+        self.sparse: Dict[Any, int] = {}
+
+
+class ChildIndex:
+    """parent id -> child rows in insertion order, as linked integer arrays."""
+
+    def __init__(self):
+        self.clear()
+
+    def add(self, parent_id: int, child_row: int):
+        while len(self.next) <= child_row:
+            self.next.append(-1)
+        tail = self.tails.get(parent_id)
+        if tail < 0:
+            self.heads.set(parent_id, child_row)
+        else:
+            self.next[tail] = child_row
+        self.tails.set(parent_id, child_row)
+
+    def rows(self, parent_id: int) -> List[int]:
+        rows = []
+        row = self.heads.get(parent_id)
+        while row >= 0:
+            rows.append(row)
+            row = self.next[row]
+        return rows
+
+    def clear(self):
+        self.heads = IdIndex()
+        self.tails = IdIndex()
+        self.next = array("q")
+
+
+class Row:
+    """Read/write view of one table row with the attributes of its dataclass."""
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table: "ColumnarTable", row: int):
+        object.__setattr__(self, "_table", table)
+        object.__setattr__(self, "_row", row)
+
+    def __getattr__(self, name):
+        column = self._table.columns.get(name)
+        if column is None:
+            raise AttributeError(name)
+        return self._table.get(self._row, name)
+
+    def __setattr__(self, name, value):
+        if name not in self._table.columns:
+            raise AttributeError(name)
+        self._table.set(self._row, name, value)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Row)
+            and other._table is self._table
+            and other._row == self._row
+        )
+
+    def __hash__(self):
+        return hash((id(self._table), self._row))
+
+    def __repr__(self):
+        return repr(self.to_object())
+
+    def to_object(self):
+        return self._table.materialize(self._row)
+
+
+class ColumnarTable:
+    def __init__(
+        self,
+        row_type,
+        columns: Dict[str, Any],
+        fallbacks: Optional[Dict[str, str]] = None,
+    ):
+        self.row_type = row_type
+        self.columns = columns
+        # column -> column whose value is reused when both are equal, e.g.
+        # Paragraph.text is only stored when it differs from text_cleaned.
+        self.fallbacks = fallbacks or {}
+        self.size = 0
+        self.id_index = IdIndex()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, obj) -> int:
+        row = self.size
+        for name, column in self.columns.items():
+            value = getattr(obj, name)
+            fallback = self.fallbacks.get(name)
+            if fallback is not None and value == getattr(obj, fallback):
+                value = None
+            column.append(value)
+        self.id_index.set(obj.id, row)
+        self.size += 1
+        return row
+
+    def get(self, row: int, name: str):
+        value = self.columns[name].get(row)
+        fallback = self.fallbacks.get(name)
+        if value is None and fallback is not None:
+            return self.columns[fallback].get(row)
+        return value
+
+    def set(self, row: int, name: str, value):
+        if name == "id":
+            self.id_index.set(value, row)
+        self.columns[name].set(row, value)
+
+    def row(self, row: int) -> Row:
+        return Row(self, row)
+
+    def row_for_id(self, key) -> Optional[Row]:
+        row = self.id_index.get(key)
+        return None if row < 0 else Row(self, row)
+
+    def materialize(self, row: int):
+        return self.row_type(**{name: self.get(row, name) for name in self.columns})
+
+    def column(self, name: str) -> List[Any]:
+        values = self.columns[name].to_list()
+        fallback = self.fallbacks.get(name)
+        if fallback is not None:
+            values = [
+                v if v is not None else f
+                for v, f in zip(values, self.columns[fallback].to_list())
+            ]
+        return values
+
+    def to_frame(self, columns: Optional[List[str]] = None):
+        import pandas as pd
+
+        names = list(self.columns) if columns is None else columns
+        return pd.DataFrame({name: self.column(name) for name in names})
+
+    def clear(self):
+        for column in self.columns.values():
+            column.clear()
+        self.id_index.clear()
+        self.size = 0
+
+
+class TableView:
+    """The list-like face of a table used by Dataset.paragraphs and friends."""
+
+    def __init__(self, table: ColumnarTable):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __iter__(self) -> Iterator[Row]:
+        for row in range(len(self.table)):
+            yield Row(self.table, row)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self.table, row) for row in range(len(self.table))[index]]
+        if index < 0:
+            index += len(self.table)
+        if not 0 <= index < len(self.table):
+            raise IndexError(index)
+        return Row(self.table, index)
+
+
+class IdView:
+    """The dict-like face of a table used by Dataset.*_dict lookups."""
+
+    def __init__(self, table: ColumnarTable):
+        self.table = table
+
+    def __getitem__(self, key) -> Row:
+        row = self.table.row_for_id(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __contains__(self, key) -> bool:
+        return self.table.id_index.get(key) >= 0
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def get(self, key, default=None):
+        row = self.table.row_for_id(key)
+        return default if row is None else row
+
+    def values(self) -> Iterator[Row]:
+        return iter(TableView(self.table))
+
+
+def _columns_for(row_type, categories=(), strings=()) -> Dict[str, Any]:
+    columns = {}
+    for f in fields(row_type):
+        if f.name in categories:
+            columns[f.name] = CategoryColumn()
+        elif f.name in strings or f.type in (str, Optional[str]):
+            columns[f.name] = StringColumn()
+        elif f.type in (bool, "bool"):
+            columns[f.name] = BoolColumn()
+        elif f.type in (float, Optional[float]):
+            columns[f.name] = FloatColumn()
+        else:
+            columns[f.name] = IntColumn()
+    return columns
+
+
+def paragraph_table() -> ColumnarTable:
+    return ColumnarTable(
+        Paragraph,
+        _columns_for(
+            Paragraph,
+            categories=(
+                "page_name",
+                "section_name",
+                "subsection_name",
+                "subsubsection_name",
+                "section_hierarchy",
+                "skip_reason",
+            ),
+            strings=("text", "text_cleaned"),
+        ),
+        fallbacks={"text": "text_cleaned"},
+    )
+
+
+def question_table() -> ColumnarTable:
+    return ColumnarTable(
+        Question,
+        _columns_for(
+            Question,
+            categories=("scope", "context", "timestamp", "turns"),
+            strings=("text",),
+        ),
+    )
+
+
+def answer_table() -> ColumnarTable:
+    return ColumnarTable(
+        Answer,
+        _columns_for(Answer, categories=("setting", "timestamp"), strings=("text",)),
+    )
+
+
+def rating_table() -> ColumnarTable:
+    return ColumnarTable(
+        Rating,
+        _columns_for(Rating, categories=("timestamp",), strings=("text",)),
+    )
+
+
+class ColumnarDataset(Dataset):
+    """Dataset with paragraphs, questions, answers and ratings held in
+    columnar tables. Entities are returned as Row views, so flag updates such
+    as `question.processed = True` write straight through to the columns.
+    Authors stay as objects since there are only a handful of them."""
+
+    def __init__(self):
+        self.paragraph_table = paragraph_table()
+        self.question_table = question_table()
+        self.answer_table = answer_table()
+        self.rating_table = rating_table()
+
+        self.paragraphs = TableView(self.paragraph_table)
+        self.questions = TableView(self.question_table)
+        self.answers = TableView(self.answer_table)
+        self.ratings = TableView(self.rating_table)
+        self.paragraph_dict = IdView(self.paragraph_table)
+        self.question_dict = IdView(self.question_table)
+        self.answer_dict = IdView(self.answer_table)
+        self.rating_dict = IdView(self.rating_table)
+
+        self.questions_by_paragraph = ChildIndex()
+        self.answers_by_question = ChildIndex()
+        self.ratings_by_answer = ChildIndex()
+
+        self.authors = []
+        self.author_dict = {}
+        self.author_by_hash = {}
+
+        self.pending_paragraphs = PendingQueue(lambda p: p.processed)
+        self.pending_filter = PendingQueue(lambda q: q.filtered)
+        self.pending_answer = PendingQueue(lambda q: q.processed)
+        self.pending_rating = PendingQueue(lambda a: a.processed)
+        self.pending_rationale = PendingQueue(lambda r: r.text is not None)
+
+        self.journal = None
+        self.journal_buffer = []
+        self.ids = IdAllocator(on_reserve=self.log_id_block)
+        self.retries = RetryTracker(on_event=self.log_journal)
+
+    def __repr__(self):
+        return (
+            f"ColumnarDataset(paragraphs={len(self.paragraphs)}, "
+            f"questions={len(self.questions)}, answers={len(self.answers)}, "
+            f"ratings={len(self.ratings)}, authors={len(self.authors)})"
+        )
+
+    def build_lookup_dicts(self):
+        self.author_dict = {a.id: a for a in self.authors}
+        self.author_by_hash = {a.hash: a for a in self.authors}
+        self.build_pending_queues()
+
+    def clear_paragraphs(self):
+        self.paragraph_table.clear()
+        self.pending_paragraphs.clear()
+
+    def add_paragraph(self, paragraph: Paragraph):
+        row = self.paragraph_table.append(paragraph)
+        if not paragraph.processed and paragraph.skip_reason is None:
+            self.pending_paragraphs.push(self.paragraph_table.row(row))
+        if self.journal is not None:
+            self.log_journal("paragraph", data=asdict(paragraph))
+
+    def add_questions(self, questions: List[Question]):
+        for question in questions:
+            row = self.question_table.append(question)
+            self.questions_by_paragraph.add(question.paragraph_id, row)
+            self._enqueue_question(self.question_table.row(row))
+            if self.journal is not None:
+                self.log_journal("question", data=asdict(question))
+
+    def add_answers(self, answers: List[Answer]):
+        for answer in answers:
+            row = self.answer_table.append(answer)
+            self.answers_by_question.add(answer.question_id, row)
+            if not answer.processed:
+                self.pending_rating.push(self.answer_table.row(row))
+            if self.journal is not None:
+                self.log_journal("answer", data=asdict(answer))
+
+    def add_ratings(self, ratings: List[Rating]):
+        for rating in ratings:
+            row = self.rating_table.append(rating)
+            self.ratings_by_answer.add(rating.answer_id, row)
+            if rating.text is None:
+                self.pending_rationale.push(self.rating_table.row(row))
+            if self.journal is not None:
+                self.log_journal("rating", data=asdict(rating))
+
+    def get_questions_for_paragraph(self, paragraph_id: int) -> List[Row]:
+        return [
+            self.question_table.row(row)
+            for row in self.questions_by_paragraph.rows(paragraph_id)
+        ]
+
+    def get_answers_for_question(self, question_id: int) -> List[Row]:
+        return [
+            self.answer_table.row(row)
+            for row in self.answers_by_question.rows(question_id)
+        ]
+
+    def get_ratings_for_answer(self, answer_id: int) -> List[Row]:
+        return [
+            self.rating_table.row(row)
+            for row in self.ratings_by_answer.rows(answer_id)
+        ]
@@ -1,68 +1,127 @@
 from datetime import datetime
 import logging
-from typing import List
+from typing import List, Sequence, Union
 
-from vllm import SamplingParams
+from askmevllm.engine import (
+    GenerationRequest,
+    InferenceBackend,
+    RequestOutput,
+    SamplingParams,
+    retry_sampling_params,
+)
+from askmevllm.metrics import generate_timed, metrics
 from askmevllm.models import Answer, Question, dataset
-from askmevllm.dataset.common import generate_fact_with_context
-from askmevllm.helpers import create_author_if_not_exists
-from askmevllm.config import MODEL, TEMPERATURE
+from askmevllm.dataset.common import CONTEXT_PREFIX_TEMPLATE, fact_with_context, render_prompt
+from askmevllm.helpers import create_template_author
+from askmevllm.config import ANSWER_SETTINGS, MODEL, TEMPERATURE
 
 
-def generate_answers(questions: List[Question], setting: str, llm):
-    try:
-        answers = []
-        prompts = []
-
-        for question in questions:
-            # Process prompt template
-            prompt_template = "{PROMPT_PREFIX}{CONTEXT_PROMPT}Answer the following question in a succinct manner: {QUESTION}\n{PROMPT_SUFFIX}"
-
-            if setting == "ic":
-                paragraph = dataset.get_paragraph(question.paragraph_id)
-                _, fact = generate_fact_with_context(paragraph)
-                context_prompt = f"Using this fact: {fact} \n\n "
-            elif setting == "zs":
-                context_prompt = ""
-            else:
-                raise Exception("Invalid setting")
-
-            prompt = prompt_template.format(
-                CONTEXT_PROMPT=context_prompt,
-                QUESTION=question.text,
-                PROMPT_PREFIX="",
-                PROMPT_SUFFIX="",
+ANSWER_PROMPT_TEMPLATE = "{PROMPT_PREFIX}{CONTEXT_PROMPT}Answer the following question in a succinct manner: {QUESTION}\n{PROMPT_SUFFIX}"
+ANSWER_MAX_TOKENS = 200
+CONTEXT_PROMPT_TEMPLATES = {
+    "ic": CONTEXT_PREFIX_TEMPLATE,
+    "zs": "",
+}
+
+
+def answer_prompt_template(setting: str) -> str:
+    if setting not in CONTEXT_PROMPT_TEMPLATES:
+        raise Exception("Invalid setting")
+    return ANSWER_PROMPT_TEMPLATE.replace(
+        "{CONTEXT_PROMPT}", CONTEXT_PROMPT_TEMPLATES[setting]
+    )
+
+
+def build_answer_requests(
+    questions: List[Question], setting: str
+) -> List[GenerationRequest]:
+    sampling_params = SamplingParams(max_tokens=ANSWER_MAX_TOKENS, temperature=TEMPERATURE)
+    prompt_template = answer_prompt_template(setting)
+    requests = []
+    author_id = None
+
+    for question in questions:
+        variables = dict(QUESTION=question.text, PROMPT_PREFIX="", PROMPT_SUFFIX="")
+        if setting == "ic":
+            paragraph = dataset.get_paragraph(question.paragraph_id)
+            _, variables["FACT"] = fact_with_context(paragraph)
+
+        prompt = render_prompt(prompt_template, variables)
+        if author_id is None:
+            author_id = create_template_author(prompt_template, variables, MODEL)
+        attempt = dataset.retries.attempt("stage_3", question.id)
+        requests.append(
+            GenerationRequest(
+                prompt,
+                retry_sampling_params(sampling_params, attempt),
+                key=(question.id, author_id, setting),
+                group=question.paragraph_id,
             )
-            author_id = create_author_if_not_exists(prompt, MODEL)
-            sampling_params = SamplingParams(max_tokens=200, temperature=TEMPERATURE)
-
-            # Collect all prompts to process in batch
-            prompts.append((prompt, question.id, author_id))
-
-        # Generate answers in batch
-        batch_prompts = [p[0] for p in prompts]
-        outputs = llm.generate(batch_prompts, sampling_params)
-
-        for i, output in enumerate(outputs):
-            answer_text = output.outputs[0].text.strip()
-            if answer_text:
-                prompt_data = prompts[i]
-                answer = Answer(
-                    id=len(dataset.answers) + 1,
-                    question_id=prompt_data[1],
-                    author_id=prompt_data[2],
-                    setting=setting,
-                    timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    text=answer_text,
-                )
-                logging.debug(f"Generated answer: {answer.text}")
-                answers.append(answer)
-            else:
-                logging.error(
-                    "Empty answer generated for question_id: {prompt_data[1]}"
-                )
-
-        return answers
+        )
+
+    return requests
+
+
+def missing_answer_settings(
+    question: Question, settings: Sequence[str] = ANSWER_SETTINGS
+) -> List[str]:
+    answered = {answer.setting for answer in dataset.get_answers_for_question(question.id)}
+    return [setting for setting in settings if setting not in answered]
+
+
+def build_answer_requests_for_settings(
+    questions: List[Question], settings: Sequence[str] = ANSWER_SETTINGS
+) -> List[GenerationRequest]:
+    # One request list for every setting; the setting travels in each key, so
+    # all of them can go to the engine in a single call. A question being
+    # retried only asks again for the settings it has no answer for.
+    requests = []
+    for setting in settings:
+        pending = [q for q in questions if setting in missing_answer_settings(q, settings)]
+        if pending:
+            requests.extend(build_answer_requests(pending, setting))
+    return requests
+
+
+def parse_answer_outputs(
+    requests: List[GenerationRequest], outputs: List[RequestOutput]
+) -> List[Answer]:
+    answers = []
+    for request, output in zip(requests, outputs):
+        question_id, author_id, setting = request.key
+        answer_text = output.outputs[0].text.strip()
+        if answer_text:
+            answer = Answer(
+                id=dataset.ids.allocate("answer"),
+                question_id=question_id,
+                author_id=author_id,
+                setting=setting,
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                text=answer_text,
+            )
+            logging.debug(f"Generated answer: {answer.text}")
+            answers.append(answer)
+        else:
+            logging.error(f"Empty answer generated for question_id: {question_id}")
+            metrics.parse_failure("stage_3", "empty_answer")
+
+    return answers
+
+
+def generate_answers(
+    questions: List[Question],
+    setting: Union[str, Sequence[str]],
+    llm: InferenceBackend,
+):
+    settings = [setting] if isinstance(setting, str) else setting
+    try:
+        return generate_timed(
+            "stage_3",
+            questions,
+            llm,
+            lambda: build_answer_requests_for_settings(questions, settings),
+            parse_answer_outputs,
+        )
 
     except Exception as e:
         logging.error(f"An error occurred at generate_answers: {e}")
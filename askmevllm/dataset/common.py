@@ -1,5 +1,19 @@
+import string
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from askmevllm.config import CONTEXT_CACHE_MAX_PARAGRAPHS
 from askmevllm.models import Paragraph
 
+CHARS_PER_TOKEN = 4
+
+# Shared opening of every prompt that carries the paragraph fact. Keeping it
+# byte-identical across stages (PROMPT_LAYOUT = "context_first") lets the
+# engine's prefix cache reuse the fact's KV blocks between them.
+CONTEXT_PREFIX_TEMPLATE = "Using this fact: {FACT} \n\n "
 
 def generate_fact_with_context(paragraph: Paragraph):
     if paragraph.subsubsection_name and paragraph.subsection_name:
@@ -9,3 +23,139 @@ def generate_fact_with_context(paragraph: Paragraph):
     else:
         context = f"In an article about '{paragraph.page_name}', section '{paragraph.section_name}'"
     return context, f"{context} mentioned: \n {paragraph.text_cleaned}"
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+
+@dataclass
+class ParagraphContext:
+    # the paragraph fields the strings below were rendered from
+    source: Tuple
+    context: str
+    fact: str
+    # fact token ids, filled in on first use when the cache has a tokenizer
+    fact_token_ids: Optional[List[int]] = None
+
+
+def _source(paragraph: Paragraph) -> Tuple:
+    return (
+        paragraph.page_name,
+        paragraph.section_name,
+        paragraph.subsection_name,
+        paragraph.subsubsection_name,
+        paragraph.text_cleaned,
+    )
+
+
+class ParagraphContextCache:
+    """Per-paragraph context and fact, rendered once and shared by every
+    stage that prompts with them.
+
+    Holds at most `max_paragraphs` entries, evicting the least recently
+    used. An entry is re-rendered when any paragraph field it was built
+    from has changed. With a `tokenizer` (text -> token ids) the fact's
+    token ids are cached too; otherwise its token count is estimated.
+    """
+
+    def __init__(
+        self,
+        max_paragraphs: int = CONTEXT_CACHE_MAX_PARAGRAPHS,
+        tokenizer: Optional[Callable[[str], List[int]]] = None,
+    ):
+        self.max_paragraphs = max_paragraphs
+        self.tokenizer = tokenizer
+        self.entries: "OrderedDict[int, ParagraphContext]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, paragraph: Paragraph) -> ParagraphContext:
+        source = _source(paragraph)
+        with self.lock:
+            entry = self.entries.get(paragraph.id)
+            if entry is not None and entry.source == source:
+                self.entries.move_to_end(paragraph.id)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self.invalidations += 1
+            self.misses += 1
+
+        context, fact = generate_fact_with_context(paragraph)
+        entry = ParagraphContext(source, context, fact)
+        with self.lock:
+            self.entries[paragraph.id] = entry
+            self.entries.move_to_end(paragraph.id)
+            while len(self.entries) > self.max_paragraphs:
+                self.entries.popitem(last=False)
+        return entry
+
+    def fact_tokens(self, paragraph: Paragraph) -> int:
+        entry = self.get(paragraph)
+        if self.tokenizer is None:
+            return estimate_tokens(entry.fact)
+        if entry.fact_token_ids is None:
+            entry.fact_token_ids = self.tokenizer(entry.fact)
+        return len(entry.fact_token_ids)
+
+    def invalidate(self, paragraph_id: Optional[int] = None):
+        """Drops one paragraph's entry, or every entry."""
+        with self.lock:
+            if paragraph_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(paragraph_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+# Process-wide cache; see fact_with_context.
+paragraph_contexts = ParagraphContextCache()
+
+
+def fact_with_context(paragraph: Paragraph) -> Tuple[str, str]:
+    """generate_fact_with_context, served from paragraph_contexts."""
+    entry = paragraph_contexts.get(paragraph)
+    return entry.context, entry.fact
+
+
+class PromptTemplate:
+    """A str.format template parsed once; render() joins its literal parts
+    with the given values, which is several times faster than re-parsing
+    the template with format() for every item. Templates with format specs
+    or conversions are left to format()."""
+
+    def __init__(self, template: str):
+        self.template = template
+        parsed = list(string.Formatter().parse(template))
+        self.parts = [(literal, field) for literal, field, _, _ in parsed]
+        self.plain = all(not spec and not conversion for _, _, spec, conversion in parsed)
+
+    def render(self, variables: Dict[str, object]) -> str:
+        if not self.plain:
+            return self.template.format(**variables)
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(variables[field]))
+        return "".join(out)
+
+
+@lru_cache(maxsize=None)
+def compile_template(template: str) -> PromptTemplate:
+    return PromptTemplate(template)
+
+
+def render_prompt(template: str, variables: Dict[str, object]) -> str:
+    return compile_template(template).render(variables)
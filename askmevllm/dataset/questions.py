@@ -5,106 +5,320 @@ import json
 import traceback
 from typing import List, Optional
 
-from vllm import LLM, SamplingParams
-from outlines.serve.vllm import JSONLogitsProcessor
 from pydantic import BaseModel
+from askmevllm.engine import (
+    GenerationRequest,
+    InferenceBackend,
+    RequestOutput,
+    SamplingParams,
+    generate_requests,
+    retry_sampling_params,
+)
+from askmevllm.metrics import generate_timed, metrics
 from askmevllm.models import Question, Paragraph, dataset
-from askmevllm.dataset.common import generate_fact_with_context
-from askmevllm.helpers import create_author_if_not_exists
-from askmevllm.config import NUMQUESTIONS, TEMPERATURE
+from askmevllm.dataset.common import CONTEXT_PREFIX_TEMPLATE, fact_with_context, render_prompt
+from askmevllm.helpers import create_template_author
+from askmevllm.classify import classification_params, score_labels
+from askmevllm.config import (
+    ANSWERABLE_THRESHOLD,
+    FILTER_MODE,
+    NUMQUESTIONS,
+    PROMPT_LAYOUT,
+    QUESTION_ITEM_MAX_TOKENS,
+    QUESTION_MODE,
+    TEMPERATURE,
+)
+
+
+QUESTION_PROMPT_TEMPLATE = "{PROMPT_PREFIX}Generate {NUM_QUESTIONS} short answer questions about the facts mentioned in the following paragraph. The questions should be self-contained; meaning you avoid using references such as 'it', 'the game', 'the person', etc., but should directly include the name of the referenced item instead. Remember to include relevant context in the question. Return a ordered list. \n\nParagraph: {PARAGRAPH}\n{PROMPT_SUFFIX}"
+GUIDED_QUESTION_PROMPT_TEMPLATE = QUESTION_PROMPT_TEMPLATE.replace(
+    "Return a ordered list.", 'Return them as a JSON object with a "questions" list.'
+)
+QUESTION_MAX_TOKENS = 500
+# Bracket, key and per-item quoting overhead of the guided JSON list
+GUIDED_LIST_OVERHEAD_TOKENS = 8
+FILTER_MAX_TOKENS = 10
+ANSWERABLE_LABELS = ("Y", "N")
+# Whole-word answers pooled into the labels; the original prompts asked for YES/NO
+ANSWERABLE_LABEL_ALIASES = {"Yes": "Y", "No": "N"}
+# Prefilled in "stop" mode so the model starts on the first item, no preamble
+FIRST_ITEM_PREFILL = "1."
+NUMBERED_ITEM = re.compile(r"^\s*(\d+)[.)]\s*(.*)$")
+
+
+def question_list_schema(k: int) -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "questions": {
+                "type": "array",
+                "items": {"type": "string"},
+                "minItems": k,
+                "maxItems": k,
+            }
+        },
+        "required": ["questions"],
+    }
+
+
+def question_max_tokens(k: int = NUMQUESTIONS, mode: str = QUESTION_MODE) -> int:
+    if mode == "free":
+        return QUESTION_MAX_TOKENS
+    if mode == "guided":
+        return k * (QUESTION_ITEM_MAX_TOKENS + 2) + GUIDED_LIST_OVERHEAD_TOKENS
+    return k * QUESTION_ITEM_MAX_TOKENS
+
+
+def question_sampling_params(k: int = NUMQUESTIONS, mode: str = QUESTION_MODE) -> SamplingParams:
+    max_tokens = question_max_tokens(k, mode)
+    if mode == "free":
+        return SamplingParams(max_tokens=max_tokens, temperature=TEMPERATURE)
+    if mode == "stop":
+        # Ends the completion as soon as the model starts on item k + 1.
+        return SamplingParams(
+            max_tokens=max_tokens, temperature=TEMPERATURE, stop=[f"\n{k + 1}."]
+        )
+    if mode == "guided":
+        return SamplingParams(
+            max_tokens=max_tokens, temperature=TEMPERATURE, guided_json=question_list_schema(k)
+        )
+    raise ValueError(f"Unknown question mode: {mode}")
+
+
+def build_question_requests(
+    paragraphs: List[Paragraph], k: int = NUMQUESTIONS, mode: str = QUESTION_MODE
+) -> List[GenerationRequest]:
+    sampling_params = question_sampling_params(k, mode)
+    if mode == "guided":
+        template = GUIDED_QUESTION_PROMPT_TEMPLATE
+    elif mode == "stop":
+        template = QUESTION_PROMPT_TEMPLATE + FIRST_ITEM_PREFILL
+    else:
+        template = QUESTION_PROMPT_TEMPLATE
+    requests = []
+    author_id = None
+    for paragraph in paragraphs:
+        context, fact = fact_with_context(paragraph)
+        variables = dict(PARAGRAPH=fact, PROMPT_PREFIX="", PROMPT_SUFFIX="", NUM_QUESTIONS=k)
+        prompt = render_prompt(template, variables)
+        if author_id is None:
+            author_id = create_template_author(template, variables, "llama3-70B-instruct")
+        attempt = dataset.retries.attempt("stage_1", paragraph.id)
+        requests.append(
+            GenerationRequest(
+                prompt,
+                retry_sampling_params(sampling_params, attempt),
+                key=(paragraph, context, author_id, mode, k),
+                group=paragraph.id,
+            )
+        )
+    return requests
 
 
-def generate_questions_single_turn(
-    paragraphs: List[Paragraph], llm, k: int = NUMQUESTIONS
-) -> List[List[Question]]:
+def _is_preamble(items: List[List]) -> bool:
+    """Whether the first item only introduces the list, e.g. "Here are four
+    questions:" written after the prefilled "1.", with the list proper then
+    starting again at 1."""
+    if len(items) < 2 or items[0][1].endswith("?"):
+        return False
+    return items[0][1].endswith(":") or items[1][0] == 1
+
+
+def parse_numbered_list(text: str) -> List[str]:
+    """Items of a numbered list ("1." or "1)", any number of digits).
+
+    An unnumbered line continues the item above it while that item is still
+    open: no blank line in between and no closing "?" yet. Other unnumbered
+    text, such as closing remarks after the last item, is dropped, and so
+    is a leading item that only introduces the list.
+    """
+    items = []  # [number, text]
+    open_item = False
+    for line in text.split("\n"):
+        match = NUMBERED_ITEM.match(line)
+        if match:
+            items.append([int(match.group(1)), match.group(2).strip()])
+            open_item = True
+        elif open_item and line.strip() and not items[-1][1].endswith("?"):
+            items[-1][1] = f"{items[-1][1]} {line.strip()}".strip()
+        else:
+            open_item = False
+    if _is_preamble(items):
+        items = items[1:]
+    return [text for _, text in items if text]
+
+
+def parse_question_list_json(text: str) -> List[str]:
+    """The "questions" list of a guided output. A completion cut off by the
+    token budget still yields every string that was closed."""
     try:
-        prompts = []
-        for paragraph in paragraphs:
-            prompt_template = "{PROMPT_PREFIX}Generate {NUM_QUESTIONS} short answer questions about the facts mentioned in the following paragraph. The questions should be self-contained; meaning you avoid using references such as 'it', 'the game', 'the person', etc., but should directly include the name of the referenced item instead. Remember to include relevant context in the question. Return a ordered list. \n\nParagraph: {PARAGRAPH}\n{PROMPT_SUFFIX}"
-            context, fact = generate_fact_with_context(paragraph)
-            prompt = prompt_template.format(
-                PARAGRAPH=fact, PROMPT_PREFIX="", PROMPT_SUFFIX="", NUM_QUESTIONS=k
+        questions = json.loads(text)["questions"]
+        return [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+    except (ValueError, KeyError, TypeError):
+        pass
+    _, _, rest = text.partition('"questions"')
+    questions = []
+    for literal in re.findall(r'"((?:[^"\\]|\\.)*)"', rest):
+        try:
+            question = json.loads(f'"{literal}"').strip()
+        except ValueError:
+            continue
+        if question:
+            questions.append(question)
+    return questions
+
+
+def extract_questions(text: str, mode: str, k: int) -> List[str]:
+    if mode == "guided":
+        return parse_question_list_json(text)[:k]
+    if mode == "stop":
+        # the prefilled "1." is part of the prompt, not the completion
+        return parse_numbered_list(FIRST_ITEM_PREFILL + text)[:k]
+    # free text: only lines starting with a digit and "." count, as before
+    return [
+        re.sub(r"^\d\.", "", line).strip()
+        for line in text.split("\n")
+        if re.match(r"^[0-9]\.", line)
+    ]
+
+
+def parse_question_outputs(
+    requests: List[GenerationRequest], outputs: List[RequestOutput]
+) -> List[Question]:
+    all_question_objects = []
+
+    for request, output in zip(requests, outputs):
+        paragraph, context, author_id, mode, k = request.key
+        generated_text = output.outputs[0].text.strip()
+        logging.debug(f"Generated questions: {generated_text}")
+
+        new_questions = extract_questions(generated_text, mode, k)
+        if not new_questions:
+            metrics.parse_failure("stage_1", "no_numbered_questions")
+        elif mode != "free" and len(new_questions) < k:
+            metrics.parse_failure("stage_1", "fewer_than_k_questions")
+
+        question_objects = [
+            Question(
+                id=dataset.ids.allocate("question"),
+                paragraph_id=paragraph.id,
+                scope="single-paragraph",
+                text=q,
+                context=context,
+                author_id=author_id,
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                upvote=0,
+                downvote=0,
+                turns="single",
             )
-            prompts.append(prompt)
+            for q in new_questions
+        ]
+        all_question_objects.extend(question_objects)
 
-        author_id = create_author_if_not_exists(prompts[0], "llama3-70B-instruct")
+    return all_question_objects
 
-        logging.debug("Generating questions for paragraphs")
 
-        sampling_params = SamplingParams(max_tokens=500, temperature=TEMPERATURE)
-        outputs = llm.generate(prompts, sampling_params)
-        all_question_objects = []
-
-        for paragraph, output in zip(paragraphs, outputs):
-            generated_text = output.outputs[0].text.strip()
-            logging.debug(f"Generated questions: {generated_text}")
-
-            new_questions = [
-                re.sub(r"^\d\.", "", x).strip()
-                for x in generated_text.split("\n")
-                if re.match(r"^[0-9]\.", x)
-            ]
-
-            question_objects = [
-                Question(
-                    id=len(dataset.questions) + 1,
-                    paragraph_id=paragraph.id,
-                    scope="single-paragraph",
-                    text=q,
-                    context=context,
-                    author_id=author_id,
-                    timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    upvote=0,
-                    downvote=0,
-                    turns="single",
-                )
-                for q in new_questions
-            ]
-            all_question_objects.extend(question_objects)
-
-        return all_question_objects
+def generate_questions_single_turn(
+    paragraphs: List[Paragraph],
+    llm: InferenceBackend,
+    k: int = NUMQUESTIONS,
+    mode: str = QUESTION_MODE,
+) -> List[Question]:
+    try:
+        logging.debug("Generating questions for paragraphs")
+        return generate_timed(
+            "stage_1",
+            paragraphs,
+            llm,
+            lambda: build_question_requests(paragraphs, k, mode),
+            parse_question_outputs,
+        )
 
     except Exception as e:
-        logging.error(str(e))
+        # The paragraphs get no questions and are retried (see askmevllm.retry).
+        logging.error(f"An error occurred at generate_questions_single_turn: {e}")
         logging.error(traceback.format_exc())
-        raise Exception("Error generating questions for paragraphs") from e
-
+        return None
 
-def filter_questions(questions: List[Question], llm) -> List[Question]:
-    updated_questions = []
-    all_question_texts = []
-    all_facts = []
-    question_map = {}
 
+def build_filter_requests(questions: List[Question]) -> List[GenerationRequest]:
+    facts = []
     for q in questions:
         paragraph = dataset.get_paragraph(q.paragraph_id)
+        _, fact = fact_with_context(paragraph)
+        facts.append(fact)
+
+    texts = [q.text for q in questions]
+    # one params object for both settings, so the engine converts it once
+    sampling_params = answerable_sampling_params()
+    ic_requests = build_answerable_requests(texts, facts, sampling_params=sampling_params)
+    zs_requests = build_answerable_requests(texts, sampling_params=sampling_params)
+    for request in ic_requests:
+        request.group = questions[request.key].paragraph_id
+        request.key = (questions[request.key], "ic")
+    for request in zs_requests:
+        request.key = (questions[request.key], "zs")
+    requests = ic_requests + zs_requests
+    # retry params depend only on the attempt, so share them between items too
+    params_by_attempt = {0: sampling_params}
+    for request in requests:
+        attempt = dataset.retries.attempt("stage_2", request.key[0].id)
+        if attempt not in params_by_attempt:
+            params_by_attempt[attempt] = retry_sampling_params(sampling_params, attempt)
+        request.sampling_params = params_by_attempt[attempt]
+    return requests
+
+
+def apply_filter_outputs(
+    questions: List[Question],
+    requests: List[GenerationRequest],
+    outputs: List[RequestOutput],
+) -> List[Question]:
+    # A requested verdict stays None when its output is missing or holds no
+    # verdict, which is what the retry queue looks for.
+    scores = {}
+    for request in requests:
+        q, setting = request.key
+        scores.setdefault(id(q), {})[setting] = None
+    for request, score in zip(requests, score_answerable_outputs(outputs)):
+        q, setting = request.key
+        scores[id(q)][setting] = score
 
-        context, fact = generate_fact_with_context(paragraph)
-
-        all_question_texts.append(q.text)
-        all_facts.append(fact)
-        question_map[q.text] = q
-
-    # Process all questions at once for IC
-    ic_results = is_answerable_guided_choice(all_question_texts, llm, all_facts)
-
-    # Process all questions at once for ZS
-    zs_results = is_answerable_guided_choice(all_question_texts, llm)
-
-    for q_text, ic_result, zs_result in zip(all_question_texts, ic_results, zs_results):
-        q = question_map[q_text]
-        logging.debug(f"Checking if answerable: {q_text}")
+    updated_questions = []
+    for q in questions:
+        # Empty questions never reach the engine and count as unanswerable.
+        results = scores.get(id(q), {})
+        q.answerable_ic_confidence = results.get("ic", 0.0)
+        q.answerable_zs_confidence = results.get("zs", 0.0)
+        ic_result = (q.answerable_ic_confidence or 0.0) >= ANSWERABLE_THRESHOLD
+        zs_result = (q.answerable_zs_confidence or 0.0) >= ANSWERABLE_THRESHOLD
+        logging.debug(f"Checking if answerable: {q.text}")
         logging.debug(f"Answerable in IC: {ic_result}, Answerable in ZS: {zs_result}")
-        if not ic_result or not zs_result:
-            q.rejected = True
+        # Settled again on every retry, so a later verdict replaces this one.
+        q.rejected = not (ic_result and zs_result)
         q.is_answerable_ic = ic_result
         q.is_answerable_zs = zs_result
-        q.filtered = True
         updated_questions.append(q)
 
     return updated_questions
 
 
+def filter_questions(questions: List[Question], llm: InferenceBackend) -> List[Question]:
+    # IC and ZS requests go out together; each key carries its setting.
+    try:
+        return generate_timed(
+            "stage_2",
+            questions,
+            llm,
+            lambda: build_filter_requests(questions),
+            lambda requests, outputs: apply_filter_outputs(questions, requests, outputs),
+        )
+
+    except Exception as e:
+        logging.error(f"An error occurred at filter_questions: {e}")
+        return None
+
+
 def is_answerable(question, fact, llm):
     if not question.strip():
         logging.debug("No question seen in is_answerable: ", question.strip())
@@ -130,51 +344,98 @@ class YesNoOutput(BaseModel):
     text: str
 
 
-def is_answerable_guided_choice(
-    questions: List[str], llm: LLM, facts: Optional[List[str]] = None
-) -> List[bool]:
-    if not questions:
-        logging.debug("No questions seen in is_answerable")
-        return []
-
+def answerable_sampling_params(mode: str = FILTER_MODE) -> SamplingParams:
+    if mode == "logprobs":
+        # Y/N is read off the first token's logprobs; no decoding FSM needed.
+        return classification_params()
+    if mode == "guided":
+        return SamplingParams(
+            max_tokens=FILTER_MAX_TOKENS,
+            temperature=TEMPERATURE,
+            guided_json=YesNoOutput,
+            guided_vocabulary=["Y", "N"],
+        )
+    raise ValueError(f"Unknown filter mode: {mode}")
+
+
+def build_answerable_requests(
+    questions: List[str],
+    facts: Optional[List[str]] = None,
+    mode: str = FILTER_MODE,
+    sampling_params: Optional[SamplingParams] = None,
+) -> List[GenerationRequest]:
     if facts is None:
         facts = [""] * len(questions)
     elif len(facts) != len(questions):
         raise ValueError("The number of facts must match the number of questions")
 
-    prompts = []
-    for question, fact in zip(questions, facts):
+    if sampling_params is None:
+        sampling_params = answerable_sampling_params(mode)
+    requests = []
+    for i, (question, fact) in enumerate(zip(questions, facts)):
         if not question.strip():
             logging.debug(f"Empty question seen in is_answerable: {question.strip()}")
             continue
 
         if not fact:
             prompt = f"Is the following question: \n\n {question} \n\n a valid question without additional context? \n\n Reply 'Y' and 'N' only."
+        elif PROMPT_LAYOUT == "context_first":
+            prompt = CONTEXT_PREFIX_TEMPLATE.format(FACT=fact) + f"Is the following question: \n\n {question} \n\n answerable using only the fact above? \n\n Reply 'Y' and 'N' only."
         else:
             prompt = f"Is the following question: \n\n {question} \n\n answerable using only the following fact? \n\n Fact: {fact} \n\n Reply 'Y' and 'N' only."
-        prompts.append(prompt)
+        requests.append(GenerationRequest(prompt, sampling_params, key=i))
+    return requests
+
+
+def parse_answerable_verdict(output: RequestOutput) -> Optional[bool]:
+    try:
+        answer = json.loads(output.outputs[0].text.strip())
+        if answer["text"] == "N":
+            return False
+        elif answer["text"] == "Y":
+            return True
+        logging.info(f"Question Malformed: {answer}")
+        metrics.parse_failure("stage_2", "unexpected_verdict")
+    except Exception as e:
+        logging.error(f"Error processing answer: {e}")
+        metrics.parse_failure("stage_2", "invalid_json")
+    return None
 
-    logits_processor = JSONLogitsProcessor(schema=YesNoOutput, llm=llm.llm_engine)
-    logits_processor.fsm.vocabulary = ["Y", "N"]
-    sampling_params = SamplingParams(
-        max_tokens=10, temperature=TEMPERATURE, logits_processors=[logits_processor]
-    )
 
-    outputs = llm.generate(prompts, sampling_params)
+def parse_answerable_outputs(outputs: List[RequestOutput]) -> List[bool]:
+    return [bool(parse_answerable_verdict(output)) for output in outputs]
 
-    results = []
+
+def score_answerable_outputs(outputs: List[RequestOutput]) -> List[Optional[float]]:
+    """Probability of "Y" per output: from the first-token logprobs when the
+    engine returned them, otherwise 1.0 or 0.0 from the guided JSON verdict.
+    None when the output held no verdict at all."""
+    scores = []
     for output in outputs:
-        try:
-            answer = json.loads(output.outputs[0].text.strip())
-            if answer["text"] == "N":
-                results.append(False)
-            elif answer["text"] == "Y":
-                results.append(True)
+        if output.outputs[0].logprobs:
+            score = score_labels(output, ANSWERABLE_LABELS, ANSWERABLE_LABEL_ALIASES)
+            if score.label is None:
+                metrics.parse_failure("stage_2", "no_label_in_logprobs")
+                scores.append(None)
             else:
-                logging.info(f"Question Malformed: {answer}")
-                results.append(False)
-        except Exception as e:
-            logging.error(f"Error processing answer: {e}")
-            results.append(False)
+                scores.append(score.probabilities["Y"])
+        else:
+            verdict = parse_answerable_verdict(output)
+            scores.append(None if verdict is None else float(verdict))
+    return scores
+
+
+def is_answerable_guided_choice(
+    questions: List[str], llm: InferenceBackend, facts: Optional[List[str]] = None
+) -> List[bool]:
+    if not questions:
+        logging.debug("No questions seen in is_answerable")
+        return []
+
+    requests = build_answerable_requests(questions, facts, mode="guided")
+    outputs = generate_requests(llm, requests)
 
+    results = [False] * len(questions)
+    for request, result in zip(requests, parse_answerable_outputs(outputs)):
+        results[request.key] = result
     return results
@@ -3,70 +3,201 @@ from typing import List
 import logging
 import re
 
-from vllm import SamplingParams
+from askmevllm.engine import (
+    GenerationRequest,
+    InferenceBackend,
+    RequestOutput,
+    SamplingParams,
+    retry_sampling_params,
+)
+from askmevllm.metrics import generate_timed, metrics
 from askmevllm.models import Answer, Rating, dataset
-from askmevllm.dataset.common import generate_fact_with_context
-from askmevllm.helpers import create_author_if_not_exists
-from askmevllm.config import MODEL
+from askmevllm.dataset.common import CONTEXT_PREFIX_TEMPLATE, fact_with_context, render_prompt
+from askmevllm.helpers import create_template_author
+from askmevllm.classify import classification_params, score_labels
+from askmevllm.config import MODEL, PROMPT_LAYOUT, RATING_MODE
 
 
-def generate_answer_ratings(answers: List[Answer], llm):
-    try:
-        ratings = []
-        prompts = []
-
-        prompt_template = "{PROMPT_PREFIX}Based on this fact: \n\n `{REFERENCE}` \n\n Rate the following answer to the question - Question: `{QUESTION}` \n\n Answer: `{ANSWER}`; give a number from 0-5 where 0 is 'No answer or completely irrelevant', 1 is 'Significantly incorrect or incomplete', 2 is 'Partially correct; major inaccuracies or omissions', 3 is 'Correct but lacks depth; minimal detail', 4 is 'Mostly correct; minor errors, includes relevant details', 5 is 'Fully accurate and detailed; clear and comprehensive'. Your answer should follow the form `Answer:<number> \n Rationale:<justify your judgment in a paragraph>`. \n{PROMPT_SUFFIX}"
-
-        for answer in answers:
-            question = dataset.get_question(answer.question_id)
-            paragraph = dataset.get_paragraph(question.paragraph_id)
-            _, reference = generate_fact_with_context(paragraph)
-
-            prompt = prompt_template.format(
-                REFERENCE=reference,
-                QUESTION=question.text,
-                ANSWER=answer.text,
-                PROMPT_PREFIX="",
-                PROMPT_SUFFIX="",
+DEFAULT_RATING_PROMPT_TEMPLATE = "{PROMPT_PREFIX}Based on this fact: \n\n `{REFERENCE}` \n\n Rate the following answer to the question - Question: `{QUESTION}` \n\n Answer: `{ANSWER}`; give a number from 0-5 where 0 is 'No answer or completely irrelevant', 1 is 'Significantly incorrect or incomplete', 2 is 'Partially correct; major inaccuracies or omissions', 3 is 'Correct but lacks depth; minimal detail', 4 is 'Mostly correct; minor errors, includes relevant details', 5 is 'Fully accurate and detailed; clear and comprehensive'. Your answer should follow the form `Answer:<number> \n Rationale:<justify your judgment in a paragraph>`. \n{PROMPT_SUFFIX}"
+# Fact and rubric first, so only the question and answer differ between prompts.
+CONTEXT_FIRST_RATING_PROMPT_TEMPLATE = "{PROMPT_PREFIX}" + CONTEXT_PREFIX_TEMPLATE.replace("{FACT}", "{REFERENCE}") + "Rate the following answer to the question using the fact above; give a number from 0-5 where 0 is 'No answer or completely irrelevant', 1 is 'Significantly incorrect or incomplete', 2 is 'Partially correct; major inaccuracies or omissions', 3 is 'Correct but lacks depth; minimal detail', 4 is 'Mostly correct; minor errors, includes relevant details', 5 is 'Fully accurate and detailed; clear and comprehensive'. Your answer should follow the form `Answer:<number> \n Rationale:<justify your judgment in a paragraph>`. \n\n Question: `{QUESTION}` \n\n Answer: `{ANSWER}` \n{PROMPT_SUFFIX}"
+RATING_PROMPT_TEMPLATE = (
+    CONTEXT_FIRST_RATING_PROMPT_TEMPLATE
+    if PROMPT_LAYOUT == "context_first"
+    else DEFAULT_RATING_PROMPT_TEMPLATE
+)
+RATING_MAX_TOKENS = 100
+RATING_LABELS = tuple("012345")
+# Prefilled after the prompt so the score is the very next token.
+SCORE_PREFILL = "Answer:"
+RATIONALE_PREFILL = " \n Rationale:"
+
+
+def _rating_prompt(answer: Answer):
+    question = dataset.get_question(answer.question_id)
+    paragraph = dataset.get_paragraph(question.paragraph_id)
+    _, reference = fact_with_context(paragraph)
+
+    variables = dict(
+        REFERENCE=reference,
+        QUESTION=question.text,
+        ANSWER=answer.text,
+        PROMPT_PREFIX="",
+        PROMPT_SUFFIX="",
+    )
+    return render_prompt(RATING_PROMPT_TEMPLATE, variables), variables, question.paragraph_id
+
+
+def build_rating_requests(
+    answers: List[Answer], mode: str = RATING_MODE
+) -> List[GenerationRequest]:
+    if mode == "free":
+        sampling_params = SamplingParams(max_tokens=RATING_MAX_TOKENS, temperature=0.7)
+        template = RATING_PROMPT_TEMPLATE
+    elif mode in ("score_first", "score_only"):
+        # The score is read off the first token's logprobs over 0-5, so every
+        # output yields a rating and only one token is decoded.
+        sampling_params = classification_params()
+        template = RATING_PROMPT_TEMPLATE + SCORE_PREFILL
+    else:
+        raise ValueError(f"Unknown rating mode: {mode}")
+    requests = []
+    author_id = None
+
+    for answer in answers:
+        prompt, variables, paragraph_id = _rating_prompt(answer)
+        if mode != "free":
+            prompt += SCORE_PREFILL
+
+        if author_id is None:
+            author_id = create_template_author(template, variables, MODEL)
+        attempt = dataset.retries.attempt("stage_4", answer.id)
+        requests.append(
+            GenerationRequest(
+                prompt,
+                retry_sampling_params(sampling_params, attempt),
+                key=(answer, author_id, mode),
+                group=paragraph_id,
+            )
+        )
+
+    return requests
+
+
+def parse_rating_outputs(
+    requests: List[GenerationRequest], outputs: List[RequestOutput]
+) -> List[Rating]:
+    if requests and requests[0].key[2] != "free":
+        return parse_score_outputs(requests, outputs)
+
+    ratings = []
+    for request, output in zip(requests, outputs):
+        answer, author_id, _ = request.key
+        rating_raw = output.outputs[0].text.strip()
+
+        if re.search(r"Rationale:", rating_raw, re.I) and re.search(r"[0-5]", rating_raw):
+            score = int(re.search(r"[0-5]", rating_raw).group())
+            rationale = "".join(rating_raw.split("Rationale:", re.I)[1:]).strip()
+
+            logging.debug(f"Score: {score}, Rationale: {rationale}")
+
+            rating = Rating(
+                id=dataset.ids.allocate("rating"),
+                text=rationale,
+                value=score,
+                answer_id=answer.id,
+                author_id=author_id,
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            logging.debug(
+                f"Generated rating: {rating.value} for answer: {answer.text} with rationale: {rating.text}"
             )
+            ratings.append(rating)
+        else:
+            logging.error(f"Invalid rating generated for answer_id: {answer.id}")
+            metrics.parse_failure("stage_4", "no_score_or_rationale")
 
-            author_id = create_author_if_not_exists(prompt, MODEL)
-            prompts.append((prompt, answer.id, author_id))
-
-        batch_prompts = [p[0] for p in prompts]
-        sampling_params = SamplingParams(max_tokens=100, temperature=0.7)
-        outputs = llm.generate(batch_prompts, sampling_params)
-
-        for i, output in enumerate(outputs):
-            rating_raw = output.outputs[0].text.strip()
-            prompt_data = prompts[i]
-
-            if re.search(r"Rationale:", rating_raw, re.I) and re.search(
-                r"[0-5]", rating_raw
-            ):
-                score = int(re.search(r"[0-5]", rating_raw).group())
-                rationale = "".join(rating_raw.split("Rationale:", re.I)[1:]).strip()
-
-                logging.debug(f"Score: {score}, Rationale: {rationale}")
-
-                rating = Rating(
-                    id=len(dataset.ratings) + 1,
-                    text=rationale,
-                    value=score,
-                    answer_id=prompt_data[1],
-                    author_id=prompt_data[2],
-                    timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                )
-                logging.debug(
-                    f"Generated rating: {rating.value} for answer: {answer.text} with rationale: {rating.text}"
-                )
-                ratings.append(rating)
-            else:
-                logging.error(
-                    f"Invalid rating generated for answer_id: {prompt_data[1]}"
-                )
-
-        return ratings
+    return ratings
+
+
+def parse_score_outputs(
+    requests: List[GenerationRequest], outputs: List[RequestOutput]
+) -> List[Rating]:
+    ratings = []
+    for request, output in zip(requests, outputs):
+        answer, author_id, mode = request.key
+        score = score_labels(output, RATING_LABELS)
+        if score.label is None:
+            logging.error(f"No score among the top logprobs for answer_id: {answer.id}")
+            metrics.parse_failure("stage_4", "no_score_in_logprobs")
+            continue
+        ratings.append(
+            Rating(
+                id=dataset.ids.allocate("rating"),
+                # None queues the rating for its rationale continuation
+                text=None if mode == "score_first" else "",
+                value=int(score.label),
+                answer_id=answer.id,
+                author_id=author_id,
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                confidence=score.confidence,
+            )
+        )
+    return ratings
+
+
+def build_rationale_requests(ratings: List[Rating]) -> List[GenerationRequest]:
+    """Continues each score-first rating prompt after its score, so the
+    engine can reuse the cached prompt and only the rationale is decoded."""
+    sampling_params = SamplingParams(max_tokens=RATING_MAX_TOKENS, temperature=0.7)
+    requests = []
+    for rating in ratings:
+        prompt, _, paragraph_id = _rating_prompt(dataset.get_answer(rating.answer_id))
+        prompt += f"{SCORE_PREFILL} {rating.value}{RATIONALE_PREFILL}"
+        attempt = dataset.retries.attempt("stage_5", rating.id)
+        requests.append(
+            GenerationRequest(
+                prompt,
+                retry_sampling_params(sampling_params, attempt),
+                key=rating,
+                group=paragraph_id,
+            )
+        )
+    return requests
+
+
+def parse_rationale_outputs(
+    requests: List[GenerationRequest], outputs: List[RequestOutput]
+) -> List[Rating]:
+    ratings = []
+    for request, output in zip(requests, outputs):
+        rating = request.key
+        rationale = output.outputs[0].text.strip()
+        if not rationale:
+            # left pending for the retry queue
+            metrics.parse_failure("stage_5", "empty_rationale")
+            continue
+        rating.text = rationale
+        ratings.append(rating)
+    return ratings
+
+
+def generate_rating_rationales(ratings: List[Rating], llm: InferenceBackend):
+    try:
+        return generate_timed(
+            "stage_5", ratings, llm, lambda: build_rationale_requests(ratings), parse_rationale_outputs
+        )
+
+    except Exception as e:
+        logging.error(f"An error occurred at generate_rating_rationales: {e}")
+        return None
+
+
+def generate_answer_ratings(answers: List[Answer], llm: InferenceBackend):
+    try:
+        return generate_timed(
+            "stage_4", answers, llm, lambda: build_rating_requests(answers), parse_rating_outputs
+        )
 
     except Exception as e:
         logging.error(f"An error occurred at generate_answer_ratings: {e}")
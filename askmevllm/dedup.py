@@ -0,0 +1,194 @@
+import logging
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from askmevllm.config import (
+    ANSWER_SETTINGS,
+    DEDUP_BANDS,
+    DEDUP_NUM_PERM,
+    DEDUP_SCOPE,
+    DEDUP_SHINGLE_CHARS,
+    DEDUP_THRESHOLD,
+    RATING_MODE,
+    SEED,
+)
+from askmevllm.models import Question, dataset
+
+# Mersenne prime for the universal hashes; shingle hashes are reduced below
+# it so a * h + b stays inside uint64.
+MERSENNE_PRIME = (1 << 31) - 1
+
+NON_WORD = re.compile(r"[^\w\s]+")
+SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    return SPACES.sub(" ", NON_WORD.sub(" ", text.lower())).strip()
+
+
+def shingle_hashes(text: str, size: int = DEDUP_SHINGLE_CHARS) -> np.ndarray:
+    """Sorted, distinct CRC32s of every character `size`-gram of the
+    normalized text; a text shorter than `size` is a single shingle."""
+    normalized = normalize_question(text)
+    grams = {normalized[i : i + size] for i in range(max(len(normalized) - size + 1, 1))}
+    return np.unique(
+        np.fromiter(
+            (zlib.crc32(g.encode("utf-8")) % MERSENNE_PRIME for g in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+    )
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    shared = len(np.intersect1d(a, b, assume_unique=True))
+    return shared / (len(a) + len(b) - shared)
+
+
+class MinHasher:
+    """MinHash signatures over `num_perm` seeded universal hashes, so equal
+    texts get equal signatures in every process and every run."""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        return ((self.a * shingles + self.b) % MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+class QuestionIndex:
+    """LSH index of canonical questions.
+
+    MinHash signatures are cut into `bands` bands; questions sharing a band
+    within a scope are candidates, and a candidate whose shingles have an
+    exact Jaccard similarity of at least `threshold` is a duplicate. Only
+    the shingles and bucket entries are kept per question.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_perm: int = DEDUP_NUM_PERM,
+        bands: int = DEDUP_BANDS,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        self.buckets: Dict[Tuple[Hashable, int, bytes], List[int]] = defaultdict(list)
+        self.shingles: Dict[int, np.ndarray] = {}
+
+    def _band_keys(self, scope: Hashable, signature: np.ndarray):
+        for band, rows in enumerate(np.split(signature, self.bands)):
+            yield scope, band, rows.tobytes()
+
+    def find(self, scope: Hashable, shingles: np.ndarray, signature: np.ndarray) -> Optional[int]:
+        """The most similar indexed question in `scope` above the threshold."""
+        best_id, best_similarity = None, self.threshold
+        seen = set()
+        for key in self._band_keys(scope, signature):
+            for candidate in self.buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = jaccard(self.shingles[candidate], shingles)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = candidate, similarity
+        return best_id
+
+    def add(self, scope: Hashable, question_id: int, shingles: np.ndarray, signature: np.ndarray):
+        self.shingles[question_id] = shingles.astype(np.uint32)
+        for key in self._band_keys(scope, signature):
+            self.buckets[key].append(question_id)
+
+
+class QuestionDeduplicator:
+    """Links near-duplicate questions to the first question like them.
+
+    `scope` is "page" (only questions about paragraphs of the same page are
+    compared), "global", or None to turn deduplication off. The index is
+    built from the dataset's canonical questions on first use, so a resumed
+    run keeps matching against the questions it already has.
+    """
+
+    def __init__(self, scope: Optional[str] = DEDUP_SCOPE, index: Optional[QuestionIndex] = None):
+        if scope not in ("page", "global", None):
+            raise ValueError(f"Unknown dedup scope: {scope}")
+        self.scope = scope
+        self.index = index
+
+    def _scope_key(self, question: Question) -> Hashable:
+        if self.scope == "page":
+            return dataset.paragraph_dict[question.paragraph_id].page_name
+        return None
+
+    def _build_index(self, exclude: set):
+        self.index = QuestionIndex()
+        for question in dataset.questions:
+            if question.duplicate_of is None and question.id not in exclude:
+                shingles = shingle_hashes(question.text)
+                self.index.add(
+                    self._scope_key(question),
+                    question.id,
+                    shingles,
+                    self.index.hasher.signature(shingles),
+                )
+
+    def deduplicate(self, questions: List[Question]) -> List[Question]:
+        """Marks the duplicates among freshly added `questions` (see
+        Dataset.mark_questions_duplicate) and returns the stored rest."""
+        if self.scope is None or not questions:
+            return questions
+        # Mark the stored entities: with columnar storage the questions
+        # handed to add_questions are detached copies of its rows.
+        questions = [dataset.question_dict[q.id] for q in questions]
+        if self.index is None:
+            self._build_index({q.id for q in questions})
+
+        canonical, duplicates = [], []
+        for question in questions:
+            scope = self._scope_key(question)
+            shingles = shingle_hashes(question.text)
+            signature = self.index.hasher.signature(shingles)
+            match = self.index.find(scope, shingles, signature)
+            if match is None:
+                self.index.add(scope, question.id, shingles, signature)
+                canonical.append(question)
+            else:
+                duplicates.append((question, match))
+        if duplicates:
+            dataset.mark_questions_duplicate(duplicates)
+        return canonical
+
+
+def llm_calls_per_question() -> int:
+    """Engine requests a question costs past stage 1: an IC and a ZS filter
+    verdict, then per answer setting an answer, a rating and, in score-first
+    mode, its rationale."""
+    per_answer = 3 if RATING_MODE == "score_first" else 2
+    return 2 + per_answer * len(ANSWER_SETTINGS)
+
+
+def dedup_summary() -> Dict[str, int]:
+    duplicates = sum(1 for q in dataset.questions if q.duplicate_of is not None)
+    return {
+        "questions": len(dataset.questions),
+        "duplicates": duplicates,
+        "llm_calls_avoided": duplicates * llm_calls_per_question(),
+    }
+
+
+def log_dedup_summary():
+    if question_deduplicator.scope is not None:
+        logging.info(f"Question dedup ({question_deduplicator.scope}): {dedup_summary()}")
+
+
+# Process-wide deduplicator; stage 1 runs every new batch of questions through it.
+question_deduplicator = QuestionDeduplicator()
@@ -0,0 +1,491 @@
+import hashlib
+import json
+import math
+import random
+import re
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Protocol, Sequence, Tuple, Union
+
+from askmevllm.config import (
+    ENGINE,
+    GROUP_REQUESTS_BY_PARAGRAPH,
+    MODEL,
+    RETRY_MAX_TEMPERATURE,
+    RETRY_TEMPERATURE_STEP,
+    SEED,
+    TOKENIZER,
+)
+
+
+@dataclass
+class SamplingParams:
+    max_tokens: int = 16
+    temperature: float = 0.0
+    seed: Optional[int] = None
+    stop: Optional[List[str]] = None
+    logprobs: Optional[int] = None
+    # Pydantic model the output must conform to, optionally restricted to a
+    # small vocabulary (see is_answerable_guided_choice).
+    guided_json: Optional[Any] = None
+    guided_vocabulary: Optional[List[str]] = None
+
+
+def sampling_params_fingerprint(params: SamplingParams) -> str:
+    values = asdict(params)
+    schema = params.guided_json
+    if schema is not None:
+        if hasattr(schema, "model_json_schema"):
+            schema = schema.model_json_schema()
+        values["guided_json"] = schema if isinstance(schema, (dict, str)) else repr(schema)
+    return json.dumps(values, sort_keys=True, default=repr)
+
+
+@dataclass
+class CompletionOutput:
+    text: str
+    token_ids: List[int] = field(default_factory=list)
+    logprobs: Optional[List[Dict[str, float]]] = None
+    finish_reason: Optional[str] = None
+
+
+@dataclass
+class RequestOutput:
+    prompt: str
+    outputs: List[CompletionOutput]
+    prompt_token_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class GenerationRequest:
+    prompt: str
+    sampling_params: SamplingParams
+    # Opaque routing data the producing stage uses to map the output back.
+    key: Any = None
+    # Requests sharing a group (the source paragraph) share a prompt prefix
+    # and are submitted next to each other.
+    group: Any = None
+    # Set when the prompt was tokenized ahead of the engine call (see
+    # askmevllm.workers); the engine then skips tokenizing it.
+    prompt_token_ids: Optional[List[int]] = None
+
+
+SamplingParamsArg = Union[SamplingParams, Sequence[SamplingParams]]
+# Per prompt, its token ids or None to let the engine tokenize it.
+PromptTokenIds = Optional[Sequence[Optional[List[int]]]]
+
+
+class InferenceBackend(Protocol):
+    model: str
+
+    def generate(
+        self,
+        prompts: List[str],
+        sampling_params: SamplingParamsArg,
+        prompt_token_ids: PromptTokenIds = None,
+    ) -> List[RequestOutput]: ...
+
+
+def expand_sampling_params(
+    prompts: List[str], sampling_params: SamplingParamsArg
+) -> List[SamplingParams]:
+    if isinstance(sampling_params, SamplingParams):
+        return [sampling_params] * len(prompts)
+    sampling_params = list(sampling_params)
+    if len(sampling_params) != len(prompts):
+        raise ValueError("The number of sampling params must match the number of prompts")
+    return sampling_params
+
+
+def retry_sampling_params(params: SamplingParams, attempt: int) -> SamplingParams:
+    """Params for an item's `attempt`-th retry: a fresh seed and a higher
+    temperature, so it doesn't reproduce the failed output (or hit it in the
+    completion cache). Attempt 0 returns `params` unchanged."""
+    if attempt == 0:
+        return params
+    return replace(
+        params,
+        seed=(params.seed if params.seed is not None else SEED) + attempt,
+        temperature=min(
+            params.temperature + attempt * RETRY_TEMPERATURE_STEP,
+            max(params.temperature, RETRY_MAX_TEMPERATURE),
+        ),
+    )
+
+
+def group_order(requests: List[GenerationRequest]) -> List[int]:
+    """Request indices with each group kept together, groups in order of
+    first appearance; ungrouped requests keep their place."""
+    first_seen: Dict[Any, int] = {}
+    ranks = []
+    for i, request in enumerate(requests):
+        if request.group is None:
+            ranks.append(i)
+        else:
+            ranks.append(first_seen.setdefault(request.group, i))
+    return sorted(range(len(requests)), key=lambda i: (ranks[i], i))
+
+
+def generate_requests(
+    llm: "InferenceBackend",
+    requests: List[GenerationRequest],
+    group_by_prefix: bool = GROUP_REQUESTS_BY_PARAGRAPH,
+) -> List[RequestOutput]:
+    if not requests:
+        return []
+    order = group_order(requests) if group_by_prefix else list(range(len(requests)))
+    prompts = [requests[i].prompt for i in order]
+    params = [requests[i].sampling_params for i in order]
+    if all(p is params[0] for p in params):
+        sampling_params = params[0]
+    else:
+        sampling_params = params
+    token_ids = [requests[i].prompt_token_ids for i in order]
+    if any(ids is not None for ids in token_ids):
+        outputs = llm.generate(prompts, sampling_params, prompt_token_ids=token_ids)
+    else:
+        outputs = llm.generate(prompts, sampling_params)
+
+    results: List[RequestOutput] = [None] * len(requests)
+    for i, output in zip(order, outputs):
+        results[i] = output
+    return results
+
+
+class VLLMBackend:
+    def __init__(self, llm, model: str = MODEL):
+        self.llm = llm
+        self.model = model
+
+    @classmethod
+    def from_pretrained(cls, model: str = MODEL, **kwargs) -> "VLLMBackend":
+        from vllm import LLM
+
+        return cls(LLM(model, **kwargs), model=model)
+
+    def llm_engine(self):
+        return self.llm.llm_engine
+
+    def _json_logits_processor(self, schema, vocabulary):
+        from outlines.serve.vllm import JSONLogitsProcessor
+
+        logits_processor = JSONLogitsProcessor(schema=schema, llm=self.llm_engine())
+        if vocabulary is not None:
+            logits_processor.fsm.vocabulary = list(vocabulary)
+        return logits_processor
+
+    def to_vllm_params(self, params: SamplingParams, processors: Optional[Dict[Any, Any]] = None):
+        """`processors` shares one guided-decoding processor per schema and
+        vocabulary across the params of a batch; building one compiles the
+        schema's regex guide, which is costly."""
+        from vllm import SamplingParams as VLLMSamplingParams
+
+        logits_processors = None
+        if params.guided_json is not None:
+            key = _guided_key(params)
+            processor = processors.get(key) if processors is not None else None
+            if processor is None:
+                processor = self._json_logits_processor(params.guided_json, params.guided_vocabulary)
+                if processors is not None:
+                    processors[key] = processor
+            logits_processors = [processor]
+        return VLLMSamplingParams(
+            max_tokens=params.max_tokens,
+            temperature=params.temperature,
+            seed=params.seed,
+            stop=params.stop,
+            logprobs=params.logprobs,
+            logits_processors=logits_processors,
+        )
+
+    def generate(
+        self,
+        prompts: List[str],
+        sampling_params: SamplingParamsArg,
+        prompt_token_ids: PromptTokenIds = None,
+    ) -> List[RequestOutput]:
+        if not prompts:
+            return []
+        if isinstance(sampling_params, SamplingParams):
+            vllm_params = self.to_vllm_params(sampling_params)
+        else:
+            # Requests mostly share a few params objects; convert each once.
+            converted: Dict[int, Any] = {}
+            processors: Dict[Any, Any] = {}
+            vllm_params = []
+            for p in expand_sampling_params(prompts, sampling_params):
+                if id(p) not in converted:
+                    converted[id(p)] = self.to_vllm_params(p, processors)
+                vllm_params.append(converted[id(p)])
+        inputs = prompts
+        if prompt_token_ids is not None:
+            inputs = [
+                prompt if ids is None else {"prompt_token_ids": ids}
+                for prompt, ids in zip(prompts, prompt_token_ids)
+            ]
+        outputs = self.llm.generate(inputs, vllm_params, use_tqdm=False)
+        results = [_convert_request_output(output) for output in outputs]
+        for prompt, result in zip(prompts, results):
+            # vLLM leaves the text of a pre-tokenized prompt empty
+            result.prompt = result.prompt or prompt
+        return results
+
+
+def _guided_key(params: SamplingParams) -> Tuple[Any, Optional[Tuple[str, ...]]]:
+    schema = params.guided_json
+    if isinstance(schema, dict):
+        schema = json.dumps(schema, sort_keys=True)
+    vocabulary = tuple(params.guided_vocabulary) if params.guided_vocabulary else None
+    return schema, vocabulary
+
+
+def _convert_request_output(output) -> RequestOutput:
+    return RequestOutput(
+        prompt=output.prompt,
+        prompt_token_ids=list(output.prompt_token_ids or []),
+        outputs=[
+            CompletionOutput(
+                text=completion.text,
+                token_ids=list(completion.token_ids),
+                logprobs=_convert_logprobs(completion.logprobs),
+                finish_reason=completion.finish_reason,
+            )
+            for completion in output.outputs
+        ],
+    )
+
+
+def _convert_logprobs(logprobs) -> Optional[List[Dict[str, float]]]:
+    if logprobs is None:
+        return None
+    return [
+        {
+            # an undecoded token must not read as a digit label (see classify)
+            (lp.decoded_token if lp.decoded_token is not None else f"<token {token_id}>"): lp.logprob
+            for token_id, lp in step.items()
+        }
+        for step in logprobs
+    ]
+
+
+def tokenize_text(text: str) -> List[str]:
+    return re.findall(r"\S+\s*", text)
+
+
+def fake_token_id(token: str) -> int:
+    return int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class Tokenizer(Protocol):
+    def encode(self, text: str) -> List[int]: ...
+
+
+class FakeTokenizer:
+    """FakeBackend's whitespace tokenizer; needs no model files."""
+
+    def encode(self, text: str) -> List[int]:
+        return [fake_token_id(token) for token in tokenize_text(text)]
+
+
+class HFTokenizer:
+    """A Hugging Face tokenizer, encoding prompts the way vLLM does."""
+
+    def __init__(self, name: str = MODEL):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+
+    def encode(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text)
+
+
+def create_tokenizer(kind: Optional[str] = TOKENIZER, engine: str = ENGINE) -> Optional[Tokenizer]:
+    """None disables pre-tokenization; "auto" matches the engine; "fake" or
+    a Hugging Face tokenizer name picks one explicitly."""
+    if kind is None:
+        return None
+    if kind == "auto":
+        kind = "fake" if engine == "fake" else MODEL
+    if kind == "fake":
+        return FakeTokenizer()
+    return HFTokenizer(kind)
+
+
+FakeLogprobs = List[Dict[str, float]]
+FakeResponse = Union[
+    str,
+    Callable[
+        [re.Match, str, SamplingParams, random.Random],
+        Union[str, Tuple[str, FakeLogprobs]],
+    ],
+]
+
+
+def _fake_questions(match, prompt, params, rng):
+    k = int(match.group(1))
+    paragraph = prompt.rsplit("mentioned:", 1)[-1].split()
+
+    def subject():
+        # a different span of the paragraph per question, as a model would ask
+        if not paragraph:
+            return "the paragraph"
+        start = rng.randrange(max(len(paragraph) - 5, 1))
+        return " ".join(paragraph[start : start + 6])
+
+    # Runs past item k like a real model would; stop strings cut it off.
+    questions = [
+        f"What does the text say about {subject()} (detail {rng.randint(1, 99)})?"
+        for _ in range(k + 2)
+    ]
+    if params.guided_json is not None:
+        return json.dumps({"questions": questions[:k]})
+    text = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+    if prompt.endswith("1."):
+        # continue after the prefilled first item number
+        return text[len("1.") :]
+    return text
+
+
+def _fake_yes_no(match, prompt, params, rng):
+    verdict = "Y" if rng.random() < 0.85 else "N"
+    if params.guided_json is not None:
+        return json.dumps({"text": verdict})
+    if params.logprobs:
+        p_yes = rng.uniform(0.5, 0.99) if verdict == "Y" else rng.uniform(0.01, 0.5)
+        return verdict, [{"Y": math.log(p_yes), "N": math.log(1 - p_yes)}]
+    return verdict
+
+
+def _fake_rating(match, prompt, params, rng):
+    score = rng.randint(0, 5)
+    rationale = "The answer is consistent with the reference fact."
+    if prompt.endswith("Rationale:"):
+        # continuation of a score-first rating
+        return f" {rationale}"
+    if not prompt.endswith("Answer:"):
+        return f"Answer: {score} \n Rationale: {rationale}"
+    text = f" {score} \n Rationale: {rationale}"
+    if params.logprobs:
+        weights = [rng.random() for _ in range(6)]
+        weights[score] += 2.0
+        total = sum(weights)
+        return text, [{str(s): math.log(w / total) for s, w in enumerate(weights)}]
+    return text
+
+
+def _fake_answer(match, prompt, params, rng):
+    words = prompt.split()
+    return " ".join(rng.choice(words) for _ in range(min(len(words), 40)))
+
+
+DEFAULT_FAKE_RULES: List[Tuple[str, FakeResponse]] = [
+    (r"Generate (\d+) short answer questions", _fake_questions),
+    (r"Reply 'Y' and 'N' only", _fake_yes_no),
+    (r"Rate the following answer", _fake_rating),
+    (r".*", _fake_answer),
+]
+
+
+class FakeBackend:
+    """CPU stand-in for VLLMBackend.
+
+    Responses come from the first matching (regex, response) rule, where a
+    response is a str.format template over the match groups or a callable
+    returning the text, or the text and its per-token top logprobs.
+    Latency is simulated per batch as prefill over all prompt tokens plus one
+    decode step per token of the longest completion.
+    """
+
+    def __init__(
+        self,
+        model: str = "fake-engine",
+        rules: Optional[List[Tuple[str, FakeResponse]]] = None,
+        prefill_latency: float = 0.0,
+        decode_latency: float = 0.0,
+        seed: int = SEED,
+    ):
+        self.model = model
+        self.rules = [
+            (re.compile(pattern, re.S), response)
+            for pattern, response in (rules or DEFAULT_FAKE_RULES)
+        ]
+        self.prefill_latency = prefill_latency
+        self.decode_latency = decode_latency
+        self.seed = seed
+
+    def respond(
+        self, prompt: str, params: SamplingParams
+    ) -> Union[str, Tuple[str, FakeLogprobs]]:
+        rng = random.Random(f"{self.seed}:{params.seed}:{params.temperature}:{prompt}")
+        for pattern, response in self.rules:
+            match = pattern.search(prompt)
+            if match is None:
+                continue
+            if callable(response):
+                return response(match, prompt, params, rng)
+            return response.format(*match.groups(), **match.groupdict())
+        return ""
+
+    def complete(
+        self, prompt: str, params: SamplingParams, prompt_token_ids: Optional[List[int]] = None
+    ) -> RequestOutput:
+        text = self.respond(prompt, params)
+        logprobs = None
+        if isinstance(text, tuple):
+            text, logprobs = text
+        for stop in params.stop or []:
+            if stop in text:
+                text = text[: text.index(stop)]
+        tokens = tokenize_text(text)
+        finish_reason = "stop" if len(tokens) <= params.max_tokens else "length"
+        tokens = tokens[: params.max_tokens]
+        if params.logprobs:
+            # Tokens without given alternatives are reported as certain.
+            logprobs = list(logprobs or [])[: len(tokens)]
+            logprobs += [{token: 0.0} for token in tokens[len(logprobs) :]]
+        else:
+            logprobs = None
+        return RequestOutput(
+            prompt=prompt,
+            prompt_token_ids=(
+                prompt_token_ids
+                if prompt_token_ids is not None
+                else [fake_token_id(t) for t in tokenize_text(prompt)]
+            ),
+            outputs=[
+                CompletionOutput(
+                    text="".join(tokens),
+                    token_ids=[fake_token_id(t) for t in tokens],
+                    logprobs=logprobs,
+                    finish_reason=finish_reason,
+                )
+            ],
+        )
+
+    def generate(
+        self,
+        prompts: List[str],
+        sampling_params: SamplingParamsArg,
+        prompt_token_ids: PromptTokenIds = None,
+    ) -> List[RequestOutput]:
+        token_ids = prompt_token_ids or [None] * len(prompts)
+        outputs = [
+            self.complete(prompt, params, ids)
+            for prompt, params, ids in zip(
+                prompts, expand_sampling_params(prompts, sampling_params), token_ids
+            )
+        ]
+        prompt_tokens = sum(len(o.prompt_token_ids) for o in outputs)
+        decode_steps = max((len(o.outputs[0].token_ids) for o in outputs), default=0)
+        delay = self.prefill_latency * prompt_tokens + self.decode_latency * decode_steps
+        if delay > 0:
+            time.sleep(delay)
+        return outputs
+
+
+def create_backend(kind: str = ENGINE, **kwargs) -> InferenceBackend:
+    if kind == "vllm":
+        return VLLMBackend.from_pretrained(**kwargs)
+    if kind == "fake":
+        return FakeBackend(**kwargs)
+    raise ValueError(f"Unknown engine: {kind}")
@@ -0,0 +1,181 @@
+import logging
+import os
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from askmevllm.columnar import ColumnarDataset
+from askmevllm.config import EXPORT_CHUNK_ROWS
+from askmevllm.models import Dataset
+
+# entity attribute -> output column, in the order flatten_dataset emits them
+PARAGRAPH_COLUMNS = {
+    "id": "paragraph_id",
+    "page_name": "page_name",
+    "section_name": "section_name",
+    "subsection_name": "subsection_name",
+    "subsubsection_name": "subsubsection_name",
+    "text": "paragraph_text",
+    "word_count": "word_count",
+    "is_bad": "is_bad",
+    "within_page_order": "within_page_order",
+    "processed": "paragraph_processed",
+    "original_entry_id": "original_entry_id",
+    "skip_reason": "skip_reason",
+}
+QUESTION_COLUMNS = {
+    "id": "question_id",
+    "scope": "question_scope",
+    "context": "question_context",
+    "text": "question_text",
+    "author_id": "author_id",
+    "timestamp": "timestamp",
+    "upvote": "upvote",
+    "downvote": "downvote",
+    "turns": "turns",
+    "filtered": "filtered",
+    "is_answerable_zs": "is_answerable_zs",
+    "is_answerable_ic": "is_answerable_ic",
+    "rejected": "rejected",
+    "processed": "question_processed",
+    "answerable_ic_confidence": "answerable_ic_confidence",
+    "answerable_zs_confidence": "answerable_zs_confidence",
+    "duplicate_of": "duplicate_of_question_id",
+}
+ANSWER_COLUMNS = {
+    "id": "answer_id",
+    "setting": "answer_setting",
+    "timestamp": "answer_timestamp",
+    "text": "answer_text",
+    "processed": "answer_processed",
+}
+RATING_COLUMNS = {
+    "id": "rating_id",
+    "text": "rating_text",
+    "value": "rating_value",
+    "confidence": "rating_confidence",
+    "timestamp": "rating_timestamp",
+}
+
+
+def entity_frame(dataset: Dataset, kind: str, columns: Dict[str, str], keys=()) -> pd.DataFrame:
+    """One row per entity with the export columns plus any join keys."""
+    attributes = list(columns) + [k for k in keys if k not in columns]
+    if isinstance(dataset, ColumnarDataset):
+        return getattr(dataset, f"{kind}_table").to_frame(attributes)
+    items = getattr(dataset, f"{kind}s")
+    return pd.DataFrame({name: [getattr(item, name) for item in items] for name in attributes})
+
+
+def build_join_index(
+    paragraphs: pd.DataFrame,
+    questions: pd.DataFrame,
+    answers: pd.DataFrame,
+    ratings: pd.DataFrame,
+) -> pd.DataFrame:
+    """Row positions (-1 when absent) of paragraph/question/answer/rating for
+    every output row, with the same left-join shape as flatten_dataset."""
+
+    def positions(frame, key, name):
+        return pd.DataFrame({key: frame[key].to_numpy(), name: np.arange(len(frame))})
+
+    answer_rating = positions(answers, "id", "a").rename(columns={"id": "answer_id"})
+    answer_rating["question_id"] = answers["question_id"].to_numpy()
+    answer_rating = answer_rating.merge(
+        positions(ratings, "answer_id", "r"), on="answer_id", how="left"
+    )
+
+    question_answer = positions(questions, "id", "q").rename(columns={"id": "question_id"})
+    question_answer["paragraph_id"] = questions["paragraph_id"].to_numpy()
+    question_answer = question_answer.merge(
+        answer_rating[["question_id", "a", "r"]], on="question_id", how="left"
+    )
+
+    index = positions(paragraphs, "id", "p").rename(columns={"id": "paragraph_id"})
+    index = index.merge(
+        question_answer[["paragraph_id", "q", "a", "r"]], on="paragraph_id", how="left"
+    )
+    return index[["p", "q", "a", "r"]].fillna(-1).astype("int64")
+
+
+def _pad(frame: pd.DataFrame, columns: Dict[str, str]) -> pd.DataFrame:
+    # Append an all-null row so that position -1 (no match) can be taken too.
+    padding = pd.DataFrame([[None] * len(columns)], columns=list(columns))
+    return pd.concat([frame[list(columns)], padding], ignore_index=True).rename(
+        columns=columns
+    )
+
+
+def _take(padded: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+    positions = np.where(positions < 0, len(padded) - 1, positions)
+    return padded.take(positions).reset_index(drop=True)
+
+
+def iter_flattened_chunks(
+    dataset: Dataset, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    paragraphs = entity_frame(dataset, "paragraph", PARAGRAPH_COLUMNS)
+    questions = entity_frame(dataset, "question", QUESTION_COLUMNS, keys=["paragraph_id"])
+    answers = entity_frame(dataset, "answer", ANSWER_COLUMNS, keys=["question_id"])
+    ratings = entity_frame(dataset, "rating", RATING_COLUMNS, keys=["answer_id"])
+    index = build_join_index(paragraphs, questions, answers, ratings)
+
+    padded = [
+        (_pad(paragraphs, PARAGRAPH_COLUMNS), "p"),
+        (_pad(questions, QUESTION_COLUMNS), "q"),
+        (_pad(answers, ANSWER_COLUMNS), "a"),
+        (_pad(ratings, RATING_COLUMNS), "r"),
+    ]
+    # Always yield at least one (possibly empty) chunk so writers emit a header.
+    for start in range(0, max(len(index), 1), chunk_rows):
+        chunk = index.iloc[start : start + chunk_rows]
+        yield pd.concat(
+            [_take(frame, chunk[key].to_numpy()) for frame, key in padded], axis=1
+        )
+
+
+def export_dataset(
+    dataset: Dataset,
+    path: str,
+    format: str = "csv",
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+    compression: Optional[str] = None,
+) -> List[str]:
+    """Write the flattened dataset chunk by chunk.
+
+    csv goes to the single file `path` (compression inferred from its suffix
+    unless given); jsonl and parquet write one shard per chunk into the
+    directory `path`. Returns the files written.
+    """
+    written = []
+    if format == "csv":
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        for i, chunk in enumerate(iter_flattened_chunks(dataset, chunk_rows)):
+            chunk.to_csv(
+                path,
+                index=False,
+                mode="w" if i == 0 else "a",
+                header=i == 0,
+                compression=compression or "infer",
+            )
+        written.append(path)
+    elif format in ("jsonl", "parquet"):
+        os.makedirs(path, exist_ok=True)
+        for i, chunk in enumerate(iter_flattened_chunks(dataset, chunk_rows)):
+            if format == "jsonl":
+                shard = os.path.join(path, f"part-{i:05d}.jsonl.gz")
+                chunk.to_json(
+                    shard, orient="records", lines=True, compression=compression or "gzip"
+                )
+            else:
+                shard = os.path.join(path, f"part-{i:05d}.parquet")
+                chunk.to_parquet(shard, index=False, compression=compression or "zstd")
+            written.append(shard)
+    else:
+        raise ValueError(f"Unknown export format: {format}")
+
+    logging.info(f"Exported dataset to {len(written)} file(s) under {path}")
+    return written
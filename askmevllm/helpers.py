@@ -1,44 +1,132 @@
 import hashlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 import logging
 from tqdm import tqdm
+from askmevllm.config import CSV_CHUNKSIZE, SCREEN_SKIPPED_PATH, SEED
+from askmevllm.engine import sampling_params_fingerprint
+from askmevllm.llm import generate_prompts_from_template
 from askmevllm.models import Paragraph, Author, dataset
-
-
-def load_csv_data_all(file, overwrite=False):
+from askmevllm.screening import ParagraphScreen, log_screening_report, make_screen, screen_frame
+
+
+CSV_DTYPES = {
+    "id": "int64",
+    "page_name": "string",
+    "section_name": "string",
+    "subsection_name": "string",
+    "subsubsection_name": "string",
+    "text": "string",
+    "section_hierarchy": "string",
+    "text_cleaned": "string",
+    "word_count": "Int64",
+    "is_bad": "boolean",
+}
+
+
+def iter_csv_chunks(file, chunksize: int = CSV_CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    # within_page_order is numbered over the whole file, so the running
+    # per-page counts are carried from one chunk to the next.
+    page_counts: Dict[Any, int] = {}
+    for chunk in pd.read_csv(
+        file, usecols=list(CSV_DTYPES), dtype=CSV_DTYPES, chunksize=chunksize
+    ):
+        pages = chunk["page_name"].fillna("")
+        offsets = pages.map(page_counts).fillna(0).astype("int64")
+        chunk["within_page_order"] = (
+            pages.groupby(pages, sort=False).cumcount().astype("int64") + offsets
+        )
+        for page, size in pages.value_counts(sort=False).items():
+            page_counts[page] = page_counts.get(page, 0) + size
+        yield chunk
+
+
+def paragraphs_from_frame(df: pd.DataFrame) -> List[Paragraph]:
+    def column(name):
+        values = df[name].astype(object)
+        return values.where(df[name].notna(), None).tolist()
+
+    ids = df["id"].tolist()
+    skip_reasons = (
+        df["skip_reason"].tolist() if "skip_reason" in df else [None] * len(df)
+    )
+    return [
+        Paragraph(
+            id=original_id,
+            page_name=page_name,
+            section_name=section_name,
+            subsection_name=subsection_name,
+            subsubsection_name=subsubsection_name,
+            text=text,
+            section_hierarchy=section_hierarchy,
+            text_cleaned=text_cleaned,
+            word_count=word_count,
+            is_bad=is_bad,
+            within_page_order=within_page_order,
+            processed=False,
+            original_entry_id=original_id,
+            skip_reason=skip_reason,
+        )
+        for (
+            original_id,
+            page_name,
+            section_name,
+            subsection_name,
+            subsubsection_name,
+            text,
+            section_hierarchy,
+            text_cleaned,
+            word_count,
+            is_bad,
+            within_page_order,
+            skip_reason,
+        ) in zip(
+            ids,
+            column("page_name"),
+            column("section_name"),
+            column("subsection_name"),
+            column("subsubsection_name"),
+            column("text"),
+            column("section_hierarchy"),
+            column("text_cleaned"),
+            column("word_count"),
+            column("is_bad"),
+            df["within_page_order"].tolist(),
+            skip_reasons,
+        )
+    ]
+
+
+def sort_by_text_length(df: pd.DataFrame) -> pd.DataFrame:
+    order = df["text"].str.len().fillna(0).to_numpy().argsort(kind="stable")[::-1]
+    return df.iloc[order]
+
+
+def load_paragraphs(paragraphs: List[Paragraph], overwrite: bool):
+    if overwrite:
+        dataset.clear_paragraphs()
+        logging.info("Existing entries in the dataset have been removed.")
+    dataset.add_paragraphs(paragraphs)
+    dataset.commit_journal()
+    logging.info(f"Successfully loaded {len(paragraphs)} entries into the local dataset.")
+
+
+def load_csv_data_all(file, overwrite=False, chunksize: int = CSV_CHUNKSIZE):
     try:
-        df = pd.read_csv(file)
-        df["within_page_order"] = df.groupby("page_name").cumcount()
-        df = df.where(pd.notnull(df), None)
-        df = df.rename(columns={"id": "original_entry_id"})
-
-        df["text_length"] = df["text"].str.len()
-        df = df.sort_values("text_length", ascending=False).drop("text_length", axis=1)
-        if overwrite:
-            dataset.paragraphs.clear()
-            dataset.paragraph_dict.clear()
-            logging.info("Existing entries in the dataset have been removed.")
-
-        for _, row in tqdm(df.iterrows(), total=len(df), desc="Loading data"):
-            paragraph = Paragraph(
-                id=row["original_entry_id"],
-                page_name=row["page_name"],
-                section_name=row["section_name"],
-                subsection_name=row["subsection_name"],
-                subsubsection_name=row["subsubsection_name"],
-                text=row["text"],
-                section_hierarchy=row["section_hierarchy"],
-                text_cleaned=row["text_cleaned"],
-                word_count=row["word_count"],
-                is_bad=row["is_bad"],
-                within_page_order=row["within_page_order"],
-                processed=False,
-                original_entry_id=row["original_entry_id"],
-            )
-            dataset.paragraphs.append(paragraph)
-            dataset.paragraph_dict[paragraph.id] = paragraph
-
-        logging.info(f"Successfully loaded {len(df)} entries into the local dataset.")
+        paragraphs = []
+        lengths = []
+        screen = make_screen()
+        with tqdm(desc="Loading data", unit="rows") as pbar:
+            for chunk in iter_csv_chunks(file, chunksize):
+                paragraphs.extend(paragraphs_from_frame(screen_frame(chunk, screen)))
+                lengths.extend(chunk["text"].str.len().fillna(0).tolist())
+                pbar.update(len(chunk))
+
+        order = sorted(range(len(paragraphs)), key=lengths.__getitem__, reverse=True)
+        load_paragraphs([paragraphs[i] for i in order], overwrite)
+        if screen is not None:
+            log_screening_report(p.skip_reason for p in paragraphs)
 
     except Exception as e:
         logging.error(f"Error loading CSV data: {str(e)}")
@@ -47,43 +135,71 @@ def load_csv_data_all(file, overwrite=False):
         logging.info("Data loading completed.")
 
 
-def load_csv_data_rand_n(file, n, overwrite=False):
+def reservoir_sample_csv(
+    file,
+    n: int,
+    chunksize: int = CSV_CHUNKSIZE,
+    seed: Optional[int] = SEED,
+    screen: Optional[ParagraphScreen] = None,
+) -> Tuple[pd.DataFrame, int]:
+    """Single-pass uniform sample of n rows (Algorithm R, vectorized per chunk).
+
+    Rows failing `screen` never enter the reservoir, so the sample holds n
+    rows that pass whenever the file has that many; the screen records
+    them (see ParagraphScreen.record_skipped). Memory is bounded by
+    one chunk plus the n-row reservoir. Returns the sample and the number
+    of eligible rows seen.
+    """
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    seen = 0
+    with tqdm(desc="Sampling data", unit="rows") as pbar:
+        for chunk in iter_csv_chunks(file, chunksize):
+            pbar.update(len(chunk))
+            if screen is not None:
+                reasons = screen.reasons(chunk)
+                screen.record_skipped(chunk, reasons)
+                chunk = chunk[reasons.isna()]
+            positions = np.arange(seen, seen + len(chunk))
+            # Row t is kept with probability n / (t + 1), replacing slot j.
+            slots = np.where(positions < n, positions, rng.integers(0, positions + 1))
+            keep = slots < n
+            selected = chunk[keep].assign(_slot=slots[keep])
+            selected = selected.drop_duplicates("_slot", keep="last")
+            if reservoir is None:
+                reservoir = selected
+            else:
+                reservoir = pd.concat(
+                    [reservoir[~reservoir["_slot"].isin(selected["_slot"])], selected]
+                )
+            seen += len(chunk)
+
+    if reservoir is None:
+        return pd.DataFrame(columns=list(CSV_DTYPES) + ["within_page_order"]), 0
+    return reservoir.drop(columns="_slot"), seen
+
+
+def load_csv_data_rand_n(
+    file,
+    n,
+    overwrite=False,
+    chunksize: int = CSV_CHUNKSIZE,
+    seed: Optional[int] = SEED,
+):
+    # A fixed seed draws the same sample again, so a resumed run's paragraphs
+    # match the journal's. Skipped rows are not loaded, only listed in
+    # SCREEN_SKIPPED_PATH.
     try:
-        df = pd.read_csv(file)
-        df["within_page_order"] = df.groupby("page_name").cumcount()
-        df = df.where(pd.notnull(df), None)
-        df = df.rename(columns={"id": "original_entry_id"})
-        df["text_length"] = df["text"].str.len()
-        df = df.sort_values("text_length", ascending=False).drop("text_length", axis=1)
-
-
-        if len(df) > n:
-            df = df.sample(n=n)
-        if overwrite:
-            dataset.paragraphs.clear()
-            dataset.paragraph_dict.clear()
-            logging.info("Existing entries in the dataset have been removed.")
-
-        for _, row in tqdm(df.iterrows(), total=len(df), desc="Loading data"):
-            paragraph = Paragraph(
-                id=row["original_entry_id"],
-                page_name=row["page_name"],
-                section_name=row["section_name"],
-                subsection_name=row["subsection_name"],
-                subsubsection_name=row["subsubsection_name"],
-                text=row["text"],
-                section_hierarchy=row["section_hierarchy"],
-                text_cleaned=row["text_cleaned"],
-                word_count=row["word_count"],
-                is_bad=row["is_bad"],
-                within_page_order=row["within_page_order"],
-                processed=False,
-                original_entry_id=row["original_entry_id"],
-            )
-            dataset.paragraphs.append(paragraph)
-            dataset.paragraph_dict[paragraph.id] = paragraph
-
-        logging.info(f"Successfully loaded {len(df)} entries into the local dataset.")
+        screen = make_screen(skipped_path=SCREEN_SKIPPED_PATH)
+        df, total = reservoir_sample_csv(file, n, chunksize, seed, screen)
+        if total > n:
+            df = df.sample(frac=1, random_state=seed)
+        else:
+            df = sort_by_text_length(df)
+        load_paragraphs(paragraphs_from_frame(df), overwrite)
+        if screen is not None:
+            log_screening_report(screen.counts.elements())
+            logging.info(f"Skipped paragraphs are listed in {screen.skipped_path}")
 
     except Exception as e:
         logging.error(f"Error loading CSV data: {str(e)}")
@@ -92,20 +208,28 @@ def load_csv_data_rand_n(file, n, overwrite=False):
         logging.info("Data loading completed.")
 
 
-def generate_hash(model: str, prompt: str) -> str:
-    return hashlib.sha256(f"{model}:{prompt}".encode("utf-8")).hexdigest()
+def generate_hash(model: str, prompt: str, sampling_params=None) -> str:
+    if sampling_params is None:
+        return hashlib.sha256(f"{model}:{prompt}".encode("utf-8")).hexdigest()
+    return hashlib.sha256(
+        f"{model}:{sampling_params_fingerprint(sampling_params)}:{prompt}".encode("utf-8")
+    ).hexdigest()
 
 
 def create_author_if_not_exists(prompt: str, model: str) -> int:
+    # `prompt` should be the prompt template (see generate_prompts_from_template)
+    # so that every item rendered from it shares one author.
     hash_value = generate_hash(model, prompt)
-    existing_author = next(
-        (author for author in dataset.authors if author.hash == hash_value), None
-    )
+    existing_author = dataset.get_author_by_hash(hash_value)
     if existing_author:
         return existing_author.id
 
-    author_id = len(dataset.authors) + 1
+    author_id = dataset.ids.allocate("author")
     new_author = Author(id=author_id, model=model, prompt=prompt)
-    dataset.authors.append(new_author)
-    dataset.author_dict[new_author.id] = new_author
+    dataset.add_author(new_author)
     return author_id
+
+
+def create_template_author(template: str, variables: Dict[str, Any], model: str) -> int:
+    _, template_prompt = generate_prompts_from_template(template, variables)
+    return create_author_if_not_exists(template_prompt, model)
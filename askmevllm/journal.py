@@ -0,0 +1,164 @@
+import glob
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from askmevllm.models import Answer, Author, Dataset, Paragraph, Question, Rating
+
+
+def _json_default(value):
+    # numpy scalars coming from pandas rows
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+class Journal:
+    """Append-only JSONL journal of dataset changes, split into segments.
+
+    Every line holds one committed batch, so a line torn by a crash is
+    dropped as a whole on replay instead of leaving a half-applied batch.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 256 * 1024**2, fsync: bool = True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        segments = self.segments()
+        self.segment_index = len(segments) + 1 if segments else 1
+        self._file = None
+
+    def segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "journal-*.jsonl")))
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"journal-{self.segment_index:06d}.jsonl")
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        if self._file is None:
+            self._open_segment()
+        elif self._file.tell() >= self.segment_bytes:
+            self._file.close()
+            self.segment_index += 1
+            self._open_segment()
+        self._file.write(json.dumps(records, default=_json_default) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read_batches(self) -> Iterator[List[Dict[str, Any]]]:
+        for path in self.segments():
+            with open(path, encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(
+                            f"Skipping torn journal batch at {path}:{line_number}"
+                        )
+
+
+def new_run_dir(base: str) -> str:
+    """A fresh journal directory under `base`, named so runs sort by start time."""
+    return os.path.join(base, datetime.now().strftime("run-%Y%m%d-%H%M%S-%f"))
+
+
+def latest_run_dir(base: str) -> Optional[str]:
+    """The newest run directory under `base`, or `base` itself when it holds
+    the segments of a run from before runs got their own directories."""
+    runs = sorted(glob.glob(os.path.join(base, "run-*")))
+    if runs:
+        return runs[-1]
+    if glob.glob(os.path.join(base, "journal-*.jsonl")):
+        return base
+    return None
+
+
+def replay_journal(journal: Journal, dataset: Dataset) -> Dataset:
+    previous_journal, dataset.journal = dataset.journal, None
+    batches = 0
+    try:
+        for batch in journal.read_batches():
+            batches += 1
+            for record in batch:
+                apply_record(dataset, record)
+    finally:
+        dataset.journal = previous_journal
+    dataset.build_pending_queues()
+    logging.info(
+        f"Replayed {batches} journal batches: {len(dataset.paragraphs)} paragraphs, "
+        f"{len(dataset.questions)} questions, {len(dataset.answers)} answers, "
+        f"{len(dataset.ratings)} ratings"
+    )
+    return dataset
+
+
+def apply_record(dataset: Dataset, record: Dict[str, Any]):
+    record_type = record["type"]
+    if record_type in ("author", "question", "answer", "rating"):
+        dataset.ids.observe(record_type, record["data"]["id"])
+
+    if record_type == "paragraph":
+        dataset.add_paragraph(Paragraph(**record["data"]))
+    elif record_type == "author":
+        dataset.add_author(Author(**record["data"]))
+    elif record_type == "question":
+        dataset.add_questions([Question(**record["data"])])
+    elif record_type == "answer":
+        dataset.add_answers([Answer(**record["data"])])
+    elif record_type == "rating":
+        dataset.add_ratings([Rating(**record["data"])])
+    elif record_type == "paragraphs_processed":
+        for paragraph_id in record["ids"]:
+            dataset.paragraph_dict[paragraph_id].processed = True
+            dataset.retries.succeeded("stage_1", paragraph_id)
+    elif record_type == "questions_filtered":
+        for verdict in record["verdicts"]:
+            question_id, is_answerable_ic, is_answerable_zs, rejected = verdict[:4]
+            question = dataset.question_dict[question_id]
+            if len(verdict) > 4:
+                question.answerable_ic_confidence, question.answerable_zs_confidence = verdict[4:6]
+            question.is_answerable_ic = is_answerable_ic
+            question.is_answerable_zs = is_answerable_zs
+            question.rejected = rejected
+            question.filtered = True
+            dataset.retries.succeeded("stage_2", question_id)
+    elif record_type == "questions_duplicate":
+        for question_id, canonical_id in record["pairs"]:
+            question = dataset.question_dict[question_id]
+            question.duplicate_of = canonical_id
+            question.filtered = True
+            question.processed = True
+    elif record_type == "questions_processed":
+        for question_id in record["ids"]:
+            dataset.question_dict[question_id].processed = True
+            dataset.retries.succeeded("stage_3", question_id)
+    elif record_type == "answers_processed":
+        for answer_id in record["ids"]:
+            dataset.answer_dict[answer_id].processed = True
+            dataset.retries.succeeded("stage_4", answer_id)
+    elif record_type == "rating_rationales":
+        for rating_id, text in record["rationales"]:
+            dataset.rating_dict[rating_id].text = text
+            dataset.retries.succeeded("stage_5", rating_id)
+    elif record_type == "retry":
+        dataset.retries.attempts[record["stage"]][record["id"]] = record["attempt"]
+        dataset.retries.retried[record["stage"]] += 1
+    elif record_type == "dead_letter":
+        dataset.retries.attempts[record["stage"]].pop(record["id"], None)
+        dataset.retries.dead_letters.append(
+            {key: value for key, value in record.items() if key != "type"}
+        )
+    elif record_type == "id_block":
+        dataset.ids.observe(record["kind"], record["last_id"])
+    else:
+        raise ValueError(f"Unknown journal record type: {record_type}")
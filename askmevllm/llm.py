@@ -1,6 +1,5 @@
-import os
 import random
-from vllm import SamplingParams, LLM
+from askmevllm.engine import SamplingParams
 from askmevllm.config import MAX_TOKEN, TEMPERATURE, SEED, MODEL
 
 sampling_params = SamplingParams(
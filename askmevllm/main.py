@@ -1,99 +1,141 @@
+import argparse
 import logging
 import os
+import sys
 import time
+import traceback
 from tqdm import tqdm
-from vllm import LLM
-from askmevllm.models import dataset, flatten_dataset
-from askmevllm.config import DATASET_PATH, MODEL, SEED
+from askmevllm.models import dataset
+from askmevllm.config import (
+    COMPLETION_CACHE_MAX_BYTES,
+    COMPLETION_CACHE_PATH,
+    DATASET_PATH,
+    ENABLE_PREFIX_CACHING,
+    ENGINE,
+    JOURNAL_DIR,
+    MODEL,
+    OUTPUT_FORMAT,
+    OUTPUT_PATH,
+    PIPELINE_MODE,
+    PREFIX_CACHE_BLOCK_SIZE,
+    PREFIX_CACHE_METER_BLOCKS,
+    SEED,
+)
+from askmevllm.async_engine import create_async_backend
+from askmevllm.async_pipeline import process_all_paragraphs_async
+from askmevllm.cache import CachedBackend, CompletionCache
+from askmevllm.dedup import log_dedup_summary, question_deduplicator
+from askmevllm.engine import create_backend
+from askmevllm.export import export_dataset
 from askmevllm.helpers import load_csv_data_all, load_csv_data_rand_n
+from askmevllm.journal import Journal, latest_run_dir, new_run_dir, replay_journal
+from askmevllm.metrics import create_metrics_sinks, log_metrics_summary, metrics
+from askmevllm.prefix import PrefixCacheMeter, PrefixMeteredBackend
+from askmevllm.sharded import process_all_paragraphs_sharded
+from askmevllm.dataset.common import paragraph_contexts
 from askmevllm.dataset.questions import generate_questions_single_turn, filter_questions
-from askmevllm.dataset.answers import generate_answers
-from askmevllm.dataset.ratings import generate_answer_ratings
+from askmevllm.dataset.answers import ANSWER_SETTINGS, generate_answers
+from askmevllm.dataset.ratings import generate_answer_ratings, generate_rating_rationales
+from askmevllm.pipeline import process_all_paragraphs_pipelined
+from askmevllm.retry import log_retry_summary, settle_batch
+from askmevllm.scheduler import log_batch_stats, make_batchers
 
 
-def process_all_paragraphs_s2s(batch_size, llm):
+def run_stages_s2s(batchers, llm):
     # Stage 1: Generate Questions
     logging.info("Starting stage 1: Generate Questions")
     stage_1_start_time = time.time()
-    total_paragraphs = len([p for p in dataset.paragraphs if not p.processed])
+    total_paragraphs = len(dataset.pending_paragraphs)
     with tqdm(total=total_paragraphs, desc="Stage 1: Generate Questions") as pbar:
         while True:
-            paragraphs = [p for p in dataset.paragraphs if not p.processed][:batch_size]
+            paragraphs = batchers["stage_1"].next_batch(dataset.pending_paragraphs)
             if not paragraphs:
                 logging.info("No unprocessed paragraphs found. Moving to next stage.")
                 break
             all_questions = generate_questions_single_turn(paragraphs, llm)
             if all_questions:
                 dataset.add_questions(all_questions)
-            for paragraph in paragraphs:
-                paragraph.processed = True
-            pbar.update(len(paragraphs))
+                question_deduplicator.deduplicate(all_questions)
+            pbar.update(len(settle_batch("stage_1", paragraphs)))
     stage_1_end_time = time.time()
 
     # Stage 2: Filter Questions
     logging.info("Starting stage 2: Filter Questions")
     stage_2_start_time = time.time()
-    total_questions = len([q for q in dataset.questions if not q.filtered])
+    total_questions = len(dataset.pending_filter)
     with tqdm(total=total_questions, desc="Stage 2: Filter Questions") as pbar:
         while True:
-            questions = [q for q in dataset.questions if not q.filtered][:batch_size]
+            questions = batchers["stage_2"].next_batch(dataset.pending_filter)
             if not questions:
                 logging.info("No unprocessed questions found. Moving to next stage.")
                 break
             filter_questions(questions, llm)
-            for question in questions:
-                dataset.question_dict[question.id].filtered = True
-            pbar.update(len(questions))
+            pbar.update(len(settle_batch("stage_2", questions)))
     stage_2_end_time = time.time()
 
     # Stage 3: Generate Answers
     logging.info("Starting stage 3: Generate Answers")
     stage_3_start_time = time.time()
-    total_questions = len([q for q in dataset.questions if not q.processed])
+    total_questions = len(dataset.pending_answer)
     with tqdm(total=total_questions, desc="Stage 3: Generate Answers") as pbar:
         while True:
-            questions = [q for q in dataset.questions if not q.processed][:batch_size]
-            print(len([q for q in dataset.questions if not q.processed]))
+            questions = batchers["stage_3"].next_batch(dataset.pending_answer)
             if not questions:
                 logging.info("No unprocessed questions found. Moving to next stage.")
                 break
-            all_answers = generate_answers(questions, setting="ic", llm=llm)
-            all_answers.extend(generate_answers(questions, setting="zs", llm=llm))
+            all_answers = generate_answers(questions, setting=ANSWER_SETTINGS, llm=llm)
             if all_answers:
                 dataset.add_answers(all_answers)
-            for question in questions:
-                question.processed = True
-
-            pbar.update(len(questions))
+            pbar.update(len(settle_batch("stage_3", questions)))
     stage_3_end_time = time.time()
 
     # Stage 4: Generate Ratings
     logging.info("Starting stage 4: Generate Ratings")
     stage_4_start_time = time.time()
-    total_answers = len([a for a in dataset.answers if not a.processed])
+    total_answers = len(dataset.pending_rating)
     with tqdm(total=total_answers, desc="Stage 4: Generate Ratings") as pbar:
         while True:
-            answers = [a for a in dataset.answers if not a.processed][:batch_size]
+            answers = batchers["stage_4"].next_batch(dataset.pending_rating)
             if not answers:
-                logging.info("No unprocessed answers found. Finishing process.")
+                logging.info("No unprocessed answers found. Moving to next stage.")
                 break
             all_ratings = generate_answer_ratings(answers, llm)
-            dataset.add_ratings(all_ratings)
-            for answer in answers:
-                answer.processed = True
-            pbar.update(len(answers))
+            if all_ratings:
+                dataset.add_ratings(all_ratings)
+            pbar.update(len(settle_batch("stage_4", answers)))
     stage_4_end_time = time.time()
 
+    # Stage 5: Generate Rationales (only score-first ratings queue any)
+    logging.info("Starting stage 5: Generate Rationales")
+    stage_5_start_time = time.time()
+    total_ratings = len(dataset.pending_rationale)
+    with tqdm(total=total_ratings, desc="Stage 5: Generate Rationales") as pbar:
+        while True:
+            ratings = batchers["stage_5"].next_batch(dataset.pending_rationale)
+            if not ratings:
+                logging.info("No ratings awaiting a rationale found. Finishing process.")
+                break
+            generate_rating_rationales(ratings, llm)
+            pbar.update(len(settle_batch("stage_5", ratings)))
+    stage_5_end_time = time.time()
+
     times = {
         "stage_1_time": stage_1_end_time - stage_1_start_time,
         "stage_2_time": stage_2_end_time - stage_2_start_time,
         "stage_3_time": stage_3_end_time - stage_3_start_time,
         "stage_4_time": stage_4_end_time - stage_4_start_time,
+        "stage_5_time": stage_5_end_time - stage_5_start_time,
     }
+    return times
+
+
+def process_all_paragraphs_s2s(batch_size, llm):
+    batchers = make_batchers(batch_size)
+    times = run_stages_s2s(batchers, llm)
     logging.info(f"Process completed in {times}")
+    log_batch_stats(batchers)
 
-    df = flatten_dataset(dataset)
-    df.to_csv("output.csv", index=False)
+    export_dataset(dataset, OUTPUT_PATH, OUTPUT_FORMAT)
 
     return times
 
@@ -104,14 +146,123 @@ def start_background_process_s2s(batch_size, llm):
     except Exception as e:
         logging.error("Error in background process:")
         logging.error(str(e))
+        logging.error(traceback.format_exc())
+
+
+def start_background_process_pipelined(batch_size, llm):
+    try:
+        process_all_paragraphs_pipelined(batch_size, llm)
+    except Exception as e:
+        logging.error("Error in background process:")
+        logging.error(str(e))
+        logging.error(traceback.format_exc())
+
+
+def start_background_process_async(batch_size, llm):
+    try:
+        process_all_paragraphs_async(batch_size, llm)
+    except Exception as e:
+        logging.error("Error in background process:")
+        logging.error(str(e))
+        logging.error(traceback.format_exc())
+
+
+def start_background_process_sharded(batch_size, journal_dir) -> bool:
+    """Returns whether the run finished, so main can exit non-zero."""
+    try:
+        process_all_paragraphs_sharded(batch_size, journal_dir)
+        return True
+    except Exception as e:
+        logging.error("Error in background process:")
+        logging.error(str(e))
+        logging.error(traceback.format_exc())
+        return False
 
 
 def main():
-    load_csv_data_rand_n(DATASET_PATH, 64)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Rebuild the dataset from the journal and continue where it stopped",
+    )
+    parser.add_argument(
+        "--journal-dir",
+        help=f"Journal directory (default: a new run directory under {JOURNAL_DIR}, "
+        "or the latest one with --resume)",
+    )
+    args = parser.parse_args()
+
+    journal_dir = args.journal_dir
+    if journal_dir is None:
+        journal_dir = latest_run_dir(JOURNAL_DIR) if args.resume else new_run_dir(JOURNAL_DIR)
+        if journal_dir is None:
+            parser.error(f"No journal to resume under {JOURNAL_DIR}")
+    journal = Journal(journal_dir)
+    if args.resume:
+        replay_journal(journal, dataset)
+    elif journal.segments():
+        parser.error(
+            f"Journal at {journal_dir} already has entries; pass --resume to continue it "
+            "or leave out --journal-dir to start a new run"
+        )
+    logging.info(f"Journaling to {journal_dir}")
+    dataset.journal = journal
+    metrics.sinks = create_metrics_sinks()
+
+    if not dataset.paragraphs:
+        load_csv_data_rand_n(DATASET_PATH, 64)
+
+    if PIPELINE_MODE == "sharded":
+        # Every worker process creates its own engine on its own devices.
+        finished = start_background_process_sharded(64, journal_dir)
+        metrics.close()
+        journal.close()
+        if not finished:
+            sys.exit(1)
+        return
+
+    engine_args = {}
+    if ENGINE == "vllm":
+        os.environ["CUDA_VISIBLE_DEVICES"] = "2,3"
+        engine_args = dict(
+            model=MODEL,
+            tensor_parallel_size=2,
+            seed=SEED,
+            enable_prefix_caching=ENABLE_PREFIX_CACHING,
+        )
+    if PIPELINE_MODE == "async":
+        llm = create_async_backend(ENGINE, **engine_args)
+    else:
+        llm = create_backend(ENGINE, **engine_args)
+    # Metered below the completion cache so only prompts the engine sees count.
+    prefix_meter = None
+    if PREFIX_CACHE_METER_BLOCKS:
+        prefix_meter = PrefixCacheMeter(PREFIX_CACHE_BLOCK_SIZE, PREFIX_CACHE_METER_BLOCKS)
+        llm = PrefixMeteredBackend(llm, prefix_meter)
+    if COMPLETION_CACHE_PATH:
+        llm = CachedBackend(
+            llm, CompletionCache(COMPLETION_CACHE_PATH, COMPLETION_CACHE_MAX_BYTES)
+        )
+
+    if PIPELINE_MODE == "pipelined":
+        start_background_process_pipelined(64, llm)
+    elif PIPELINE_MODE == "async":
+        start_background_process_async(64, llm)
+    else:
+        start_background_process_s2s(64, llm)
 
-    os.environ["CUDA_VISIBLE_DEVICES"] = "2,3"
-    llm = LLM(MODEL, tensor_parallel_size=2, seed=SEED)
-    start_background_process_s2s(64, llm)
+    log_metrics_summary(metrics)
+    log_retry_summary()
+    log_dedup_summary()
+    logging.info(f"Paragraph contexts: {paragraph_contexts.stats()}")
+    metrics.close()
+    if prefix_meter is not None:
+        logging.info(f"Prefix cache (estimated): {prefix_meter.stats()}")
+    if COMPLETION_CACHE_PATH:
+        logging.info(f"Completion cache: {llm.cache.stats()}")
+        llm.cache.close()
+    journal.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import numpy as np
+
+from askmevllm.config import (
+    METRICS_FLUSH_SECONDS,
+    METRICS_JSONL_PATH,
+    METRICS_PROMETHEUS_PATH,
+    METRICS_PROMETHEUS_PORT,
+)
+from askmevllm.engine import GenerationRequest, InferenceBackend, RequestOutput, generate_requests
+
+PHASES = ("build", "generate", "parse")
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+T = TypeVar("T")
+
+
+@dataclass
+class StageMetrics:
+    batches: int = 0
+    items: int = 0
+    requests: int = 0
+    prompt_tokens: int = 0
+    generated_tokens: int = 0
+    seconds: Dict[str, float] = field(default_factory=lambda: {phase: 0.0 for phase in PHASES})
+    parse_failures: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    fill_ratios: List[float] = field(default_factory=list)
+    # one entry per request, in seconds
+    latencies: array = field(default_factory=lambda: array("d"))
+
+    def summary(self) -> Dict[str, Any]:
+        generate_seconds = self.seconds["generate"]
+        latencies = np.frombuffer(self.latencies, dtype=np.float64) if self.latencies else None
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "generated_tokens": self.generated_tokens,
+            "generated_tokens_per_second": (
+                self.generated_tokens / generate_seconds if generate_seconds else 0.0
+            ),
+            "seconds": dict(self.seconds),
+            "mean_fill": float(np.mean(self.fill_ratios)) if self.fill_ratios else None,
+            "latency_seconds": {
+                str(q): float(np.quantile(latencies, q)) if latencies is not None else None
+                for q in LATENCY_QUANTILES
+            },
+            "latency_seconds_sum": float(latencies.sum()) if latencies is not None else 0.0,
+            "latency_count": len(self.latencies),
+            "parse_failures": dict(self.parse_failures),
+        }
+
+
+class BatchTimer:
+    """Collects one batch's phase timings; see MetricsRecorder.batch."""
+
+    def __init__(self):
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.outputs: List[RequestOutput] = []
+        self.latencies: Optional[List[float]] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+
+class MetricsRecorder:
+    """Per-stage counters, fed once per batch, pushed to pluggable sinks.
+
+    Sinks get every batch as an event and the running per-stage summaries
+    on flush, which happens at most every `flush_seconds` and at the end of
+    a run. `labels` (e.g. the shard) are attached to everything emitted.
+    """
+
+    def __init__(
+        self,
+        sinks=None,
+        labels: Optional[Dict[str, Any]] = None,
+        flush_seconds: float = METRICS_FLUSH_SECONDS,
+    ):
+        self.sinks = list(sinks or [])
+        self.labels = dict(labels or {})
+        self.flush_seconds = flush_seconds
+        self.stages: Dict[str, StageMetrics] = defaultdict(StageMetrics)
+        self.lock = threading.Lock()
+        self.last_flush = time.time()
+
+    @contextmanager
+    def batch(self, stage: str, items: int):
+        timer = BatchTimer()
+        yield timer
+        self.record_batch(stage, items, timer)
+
+    def record_batch(self, stage: str, items: int, timer: BatchTimer):
+        prompt_tokens = sum(len(o.prompt_token_ids) for o in timer.outputs)
+        generated_tokens = sum(len(o.outputs[0].token_ids) for o in timer.outputs if o.outputs)
+        # Synchronous engines finish a batch together, so every request in
+        # it sees the whole generate call as its latency.
+        latencies = timer.latencies
+        if latencies is None:
+            latencies = [timer.seconds["generate"]] * len(timer.outputs)
+
+        with self.lock:
+            stage_metrics = self.stages[stage]
+            stage_metrics.batches += 1
+            stage_metrics.items += items
+            stage_metrics.requests += len(timer.outputs)
+            stage_metrics.prompt_tokens += prompt_tokens
+            stage_metrics.generated_tokens += generated_tokens
+            for phase, seconds in timer.seconds.items():
+                stage_metrics.seconds[phase] += seconds
+            stage_metrics.latencies.extend(latencies)
+
+        self.emit(
+            {
+                "event": "batch",
+                "stage": stage,
+                "items": items,
+                "requests": len(timer.outputs),
+                "prompt_tokens": prompt_tokens,
+                "generated_tokens": generated_tokens,
+                "seconds": timer.seconds,
+                "max_latency": max(latencies, default=0.0),
+            }
+        )
+        if time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def record_fill(self, stage: str, fill: float):
+        with self.lock:
+            self.stages[stage].fill_ratios.append(fill)
+
+    def parse_failure(self, stage: str, kind: str, count: int = 1):
+        with self.lock:
+            self.stages[stage].parse_failures[kind] += count
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {stage: m.summary() for stage, m in sorted(self.stages.items())}
+
+    def emit(self, event: Dict[str, Any]):
+        event = {"time": time.time(), **self.labels, **event}
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def flush(self):
+        self.last_flush = time.time()
+        summary = self.summary()
+        for sink in self.sinks:
+            sink.flush(summary, self.labels)
+
+    def close(self):
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+
+class JsonlMetricsSink:
+    """Appends batch events and summaries as JSON lines."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def _write(self, record: Dict[str, Any]):
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def emit(self, event: Dict[str, Any]):
+        self._write(event)
+
+    def flush(self, summary: Dict[str, Dict[str, Any]], labels: Dict[str, Any]):
+        self._write({"time": time.time(), **labels, "event": "summary", "stages": summary})
+
+    def close(self):
+        self.file.close()
+
+
+def _label_text(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def prometheus_text(summary: Dict[str, Dict[str, Any]], labels: Dict[str, Any]) -> str:
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP askme_{name} {help_text}")
+        lines.append(f"# TYPE askme_{name} {kind}")
+        for sample_labels, value, *suffix in samples:
+            if value is not None:
+                lines.append(f"askme_{name}{''.join(suffix)}{_label_text({**labels, **sample_labels})} {value}")
+
+    stages = summary.items()
+    for key, help_text in (
+        ("batches", "Engine batches submitted"),
+        ("items", "Stage items processed"),
+        ("requests", "Engine requests completed"),
+        ("prompt_tokens", "Prompt tokens submitted"),
+        ("generated_tokens", "Tokens generated"),
+    ):
+        metric(f"stage_{key}_total", "counter", help_text,
+               [({"stage": stage}, s[key]) for stage, s in stages])
+    metric("stage_seconds_total", "counter", "Wall time per stage and phase",
+           [({"stage": stage, "phase": phase}, seconds)
+            for stage, s in stages for phase, seconds in s["seconds"].items()])
+    metric("stage_generated_tokens_per_second", "gauge", "Generated tokens per second of generate time",
+           [({"stage": stage}, s["generated_tokens_per_second"]) for stage, s in stages])
+    metric("stage_batch_fill_ratio", "gauge", "Mean fraction of the batch token budget used",
+           [({"stage": stage}, s["mean_fill"]) for stage, s in stages])
+    metric("stage_request_latency_seconds", "summary", "Request latency",
+           [({"stage": stage, "quantile": q}, value)
+            for stage, s in stages for q, value in s["latency_seconds"].items()]
+           + [({"stage": stage}, s["latency_seconds_sum"], "_sum") for stage, s in stages]
+           + [({"stage": stage}, s["latency_count"], "_count") for stage, s in stages])
+    metric("stage_parse_failures_total", "counter", "Outputs that could not be parsed",
+           [({"stage": stage, "kind": kind}, count)
+            for stage, s in stages for kind, count in s["parse_failures"].items()])
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusFileSink:
+    """Rewrites a Prometheus text-format file (e.g. for node_exporter's
+    textfile collector) on every flush."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+
+    def emit(self, event: Dict[str, Any]):
+        pass
+
+    def flush(self, summary: Dict[str, Dict[str, Any]], labels: Dict[str, Any]):
+        # Write then rename so a scrape never sees a half-written file.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text(summary, labels))
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+
+class PrometheusHttpSink:
+    """Serves the latest flushed summary at http://host:port/metrics."""
+
+    def __init__(self, port: int, host: str = "0.0.0.0"):
+        self.text = ""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.text.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(f"Serving metrics on port {self.server.server_port}")
+
+    def emit(self, event: Dict[str, Any]):
+        pass
+
+    def flush(self, summary: Dict[str, Dict[str, Any]], labels: Dict[str, Any]):
+        self.text = prometheus_text(summary, labels)
+
+    def close(self):
+        self.server.shutdown()
+
+
+def generate_timed(
+    stage: str,
+    items: List[Any],
+    llm: InferenceBackend,
+    build: Callable[[], List[GenerationRequest]],
+    parse: Callable[[List[GenerationRequest], List[RequestOutput]], T],
+) -> T:
+    """build -> generate_requests -> parse for one batch, recorded on `metrics`."""
+    with metrics.batch(stage, len(items)) as batch:
+        with batch.phase("build"):
+            requests = build()
+        with batch.phase("generate"):
+            batch.outputs = generate_requests(llm, requests)
+        with batch.phase("parse"):
+            return parse(requests, batch.outputs)
+
+
+def create_metrics_sinks(
+    jsonl_path: Optional[str] = METRICS_JSONL_PATH,
+    prometheus_path: Optional[str] = METRICS_PROMETHEUS_PATH,
+    prometheus_port: Optional[int] = METRICS_PROMETHEUS_PORT,
+) -> list:
+    sinks = []
+    if jsonl_path:
+        sinks.append(JsonlMetricsSink(jsonl_path))
+    if prometheus_path:
+        sinks.append(PrometheusFileSink(prometheus_path))
+    if prometheus_port:
+        sinks.append(PrometheusHttpSink(prometheus_port))
+    return sinks
+
+
+def log_metrics_summary(recorder: "MetricsRecorder"):
+    for stage, summary in recorder.summary().items():
+        logging.info(f"{stage} metrics: {summary}")
+
+
+# Process-wide recorder; runners attach sinks (see main).
+metrics = MetricsRecorder()
@@ -1,9 +1,12 @@
-from collections import defaultdict
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass, field
+from collections import defaultdict, deque
+from typing import Callable, Iterable, List, Dict, Optional, Any
+from dataclasses import asdict, dataclass, field
 import hashlib
+import threading
 import pandas as pd
 
+from askmevllm.config import DATASET_STORAGE, ID_BLOCK_SIZE, MAX_ATTEMPTS, SHARD_ID_SPAN
+
 
 @dataclass
 class Paragraph:
@@ -20,6 +23,8 @@ class Paragraph:
     within_page_order: int = 0
     processed: bool = False
     original_entry_id: Optional[int] = None
+    # why load-time screening kept it out of stage 1, None if it was not
+    skip_reason: Optional[str] = None
 
 
 @dataclass
@@ -55,6 +60,12 @@ class Question:
     is_answerable_ic: bool = True
     rejected: bool = False
     processed: bool = False
+    # P("Y") from the filter, kept so the threshold can be retuned offline
+    answerable_zs_confidence: Optional[float] = None
+    answerable_ic_confidence: Optional[float] = None
+    # id of the earlier question this one near-duplicates (see askmevllm.dedup);
+    # such questions skip filtering, answering and rating
+    duplicate_of: Optional[int] = None
 
 
 @dataclass
@@ -71,11 +82,213 @@ class Answer:
 @dataclass
 class Rating:
     id: int
-    text: str
+    # None while a requested rationale is still to be generated (see RATING_MODE)
+    text: Optional[str]
     value: int
     answer_id: int
     author_id: int
     timestamp: str
+    # probability of `value` among the scores when read from logprobs
+    confidence: Optional[float] = None
+
+
+class PendingQueue:
+    """FIFO of work items for one stage.
+
+    Items that were completed elsewhere are dropped lazily when popped, so
+    len() is an upper bound on the remaining work.
+    """
+
+    def __init__(self, is_done: Callable[[Any], bool]):
+        self.items = deque()
+        self.is_done = is_done
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def push(self, item):
+        self.items.append(item)
+
+    def extend(self, items: Iterable):
+        self.items.extend(items)
+
+    def clear(self):
+        self.items.clear()
+
+    def push_front(self, items: List):
+        self.items.extendleft(reversed(items))
+
+    def pop_batch(self, n: int) -> List:
+        batch = []
+        while self.items and len(batch) < n:
+            item = self.items.popleft()
+            if not self.is_done(item):
+                batch.append(item)
+        return batch
+
+
+ID_KINDS = ("author", "question", "answer", "rating")
+
+
+class LocalIdReserver:
+    """Per-kind high-water marks for a single process."""
+
+    def __init__(self):
+        self.next_ids = {kind: 1 for kind in ID_KINDS}
+
+    def reserve(self, kind: str, size: int) -> int:
+        start = self.next_ids[kind]
+        self.next_ids[kind] = start + size
+        return start
+
+    def observe(self, kind: str, last_id: int):
+        self.next_ids[kind] = max(self.next_ids[kind], last_id + 1)
+
+
+class RangeIdReserver(LocalIdReserver):
+    """High-water marks within range `index` of `span` ids, i.e. ids
+    index * span + 1 to (index + 1) * span.
+
+    Processes holding different ranges never mint the same id and need no
+    shared state, so sharded workers (range shard + 1; the coordinator
+    keeps range 0) write globally unique ids to their journals.
+    """
+
+    def __init__(self, index: int, span: int = SHARD_ID_SPAN):
+        self.first_id = index * span + 1
+        self.last_id = (index + 1) * span
+        self.next_ids = {kind: self.first_id for kind in ID_KINDS}
+
+    def reserve(self, kind: str, size: int) -> int:
+        start = super().reserve(kind, size)
+        if start + size - 1 > self.last_id:
+            raise RuntimeError(f"Id range {self.first_id}-{self.last_id} is used up for {kind}")
+        return start
+
+
+class IdAllocator:
+    """Hands out monotonic ids per entity kind from reserved blocks.
+
+    Each block is taken from the reserver in one step, so concurrent
+    producers only contend once per `block_size` ids. `on_reserve(kind,
+    last_id)` is called for every new block so the reservation can be
+    journaled; ids left unused in a block are skipped, never reissued.
+    Ids are unique within the process; across processes only when each
+    has its own range (see RangeIdReserver).
+    """
+
+    def __init__(
+        self,
+        reserver=None,
+        block_size: int = ID_BLOCK_SIZE,
+        on_reserve: Optional[Callable[[str, int], None]] = None,
+    ):
+        self.reserver = reserver or LocalIdReserver()
+        self.block_size = block_size
+        self.on_reserve = on_reserve
+        # kind -> [next id, end of block (exclusive)]
+        self.blocks: Dict[str, List[int]] = {}
+        self.lock = threading.Lock()
+
+    def allocate(self, kind: str) -> int:
+        return self.allocate_many(kind, 1)[0]
+
+    def allocate_many(self, kind: str, n: int) -> List[int]:
+        ids = []
+        with self.lock:
+            while len(ids) < n:
+                block = self.blocks.get(kind)
+                if block is None or block[0] >= block[1]:
+                    size = max(self.block_size, n - len(ids))
+                    start = self.reserver.reserve(kind, size)
+                    block = self.blocks[kind] = [start, start + size]
+                    if self.on_reserve is not None:
+                        self.on_reserve(kind, start + size - 1)
+                take = min(n - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + take))
+                block[0] += take
+        return ids
+
+    def observe(self, kind: str, last_id: int):
+        """Records that `last_id` is taken, e.g. when replaying a journal."""
+        with self.lock:
+            self.reserver.observe(kind, last_id)
+            block = self.blocks.get(kind)
+            if block is not None and block[0] <= last_id:
+                del self.blocks[kind]
+
+
+# Entity kind each stage works on, i.e. what a retry or dead letter id refers to
+STAGE_ITEM_KINDS = {
+    "stage_1": "paragraph",
+    "stage_2": "question",
+    "stage_3": "question",
+    "stage_4": "answer",
+    "stage_5": "rating",
+}
+
+
+class RetryTracker:
+    """Failed-attempt counts of the items each stage is still retrying.
+
+    An item that fails is retried on its own in a later batch until it has
+    had `max_attempts` attempts; after that it becomes a dead letter and
+    the stage moves on without it. `on_event(record_type, **payload)` is
+    called for every retry and dead letter so both can be journaled.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = MAX_ATTEMPTS,
+        on_event: Optional[Callable[..., None]] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.on_event = on_event
+        self.attempts: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.retried: Dict[str, int] = defaultdict(int)
+        self.dead_letters: List[Dict[str, Any]] = []
+
+    def attempt(self, stage: str, item_id: int) -> int:
+        """Failed attempts so far, i.e. 0 on the first try."""
+        return self.attempts[stage].get(item_id, 0)
+
+    def fail(self, stage: str, item_id: int, reason: str) -> bool:
+        """Counts a failed attempt; returns whether the item gets another."""
+        attempts = self.attempt(stage, item_id) + 1
+        if attempts < self.max_attempts:
+            self.attempts[stage][item_id] = attempts
+            self.retried[stage] += 1
+            if self.on_event is not None:
+                self.on_event("retry", stage=stage, id=item_id, attempt=attempts, reason=reason)
+            return True
+        self.attempts[stage].pop(item_id, None)
+        letter = dict(
+            stage=stage,
+            kind=STAGE_ITEM_KINDS[stage],
+            id=item_id,
+            attempts=attempts,
+            reason=reason,
+        )
+        self.dead_letters.append(letter)
+        if self.on_event is not None:
+            self.on_event("dead_letter", **letter)
+        return False
+
+    def succeeded(self, stage: str, item_id: int):
+        self.attempts[stage].pop(item_id, None)
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        dead = defaultdict(int)
+        for letter in self.dead_letters:
+            dead[letter["stage"]] += 1
+        return {
+            stage: {
+                "retries": self.retried[stage],
+                "retrying": len(self.attempts.get(stage, ())),
+                "dead_letters": dead[stage],
+            }
+            for stage in STAGE_ITEM_KINDS
+        }
 
 
 @dataclass
@@ -91,6 +304,7 @@ class Dataset:
     question_dict: Dict[int, Question] = field(default_factory=dict)
     answer_dict: Dict[int, Answer] = field(default_factory=dict)
     rating_dict: Dict[int, Rating] = field(default_factory=dict)
+    author_by_hash: Dict[str, Author] = field(default_factory=dict)
 
     questions_by_paragraph: Dict[int, List[Question]] = field(
         default_factory=lambda: defaultdict(list)
@@ -102,12 +316,48 @@ class Dataset:
         default_factory=lambda: defaultdict(list)
     )
 
+    # Per-stage work queues: paragraphs awaiting questions, questions awaiting
+    # filtering, filtered questions awaiting answers, answers awaiting ratings.
+    pending_paragraphs: PendingQueue = field(
+        default_factory=lambda: PendingQueue(lambda p: p.processed)
+    )
+    pending_filter: PendingQueue = field(
+        default_factory=lambda: PendingQueue(lambda q: q.filtered)
+    )
+    pending_answer: PendingQueue = field(
+        default_factory=lambda: PendingQueue(lambda q: q.processed)
+    )
+    pending_rating: PendingQueue = field(
+        default_factory=lambda: PendingQueue(lambda a: a.processed)
+    )
+    pending_rationale: PendingQueue = field(
+        default_factory=lambda: PendingQueue(lambda r: r.text is not None)
+    )
+
+    # Optional append-only journal (see askmevllm.journal). Records are
+    # buffered and committed as one unit when a batch is marked done.
+    journal: Optional[Any] = None
+    journal_buffer: List[Dict[str, Any]] = field(default_factory=list)
+
+    # Mints ids for generated entities; blocks it reserves are journaled so
+    # a resumed run never reissues an id.
+    ids: Optional[IdAllocator] = None
+    # Attempt counts of failed items; see requeue_failures.
+    retries: Optional[RetryTracker] = None
+
     def __post_init__(self):
+        if self.ids is None:
+            self.ids = IdAllocator()
+        self.ids.on_reserve = self.log_id_block
+        if self.retries is None:
+            self.retries = RetryTracker()
+        self.retries.on_event = self.log_journal
         self.build_lookup_dicts()
 
     def build_lookup_dicts(self):
         self.paragraph_dict = {p.id: p for p in self.paragraphs}
         self.author_dict = {a.id: a for a in self.authors}
+        self.author_by_hash = {a.hash: a for a in self.authors}
         self.question_dict = {q.id: q for q in self.questions}
         self.answer_dict = {a.id: a for a in self.answers}
         self.rating_dict = {r.id: r for r in self.ratings}
@@ -121,46 +371,185 @@ class Dataset:
         for rating in self.ratings:
             self.ratings_by_answer[rating.answer_id].append(rating)
 
+        self.build_pending_queues()
+
+    def build_pending_queues(self):
+        self.pending_paragraphs.clear()
+        self.pending_filter.clear()
+        self.pending_answer.clear()
+        self.pending_rating.clear()
+        self.pending_rationale.clear()
+        self.pending_paragraphs.extend(
+            p for p in self.paragraphs if not p.processed and p.skip_reason is None
+        )
+        self.pending_filter.extend(q for q in self.questions if not q.filtered)
+        self.pending_answer.extend(
+            q for q in self.questions if q.filtered and not q.processed
+        )
+        self.pending_rating.extend(a for a in self.answers if not a.processed)
+        self.pending_rationale.extend(r for r in self.ratings if r.text is None)
+
+    def clear_paragraphs(self):
+        self.paragraphs.clear()
+        self.paragraph_dict.clear()
+        self.pending_paragraphs.clear()
+
+    def log_journal(self, record_type: str, **payload):
+        if self.journal is not None:
+            self.journal_buffer.append({"type": record_type, **payload})
+
+    def log_id_block(self, kind: str, last_id: int):
+        self.log_journal("id_block", kind=kind, last_id=last_id)
+
+    def commit_journal(self):
+        if self.journal is not None and self.journal_buffer:
+            self.journal.write_batch(self.journal_buffer)
+            self.journal_buffer = []
+
     def add_paragraph(self, paragraph: Paragraph):
         self.paragraphs.append(paragraph)
         self.paragraph_dict[paragraph.id] = paragraph
+        if not paragraph.processed and paragraph.skip_reason is None:
+            self.pending_paragraphs.push(paragraph)
+        if self.journal is not None:
+            self.log_journal("paragraph", data=asdict(paragraph))
 
     def add_author(self, author: Author):
         self.authors.append(author)
         self.author_dict[author.id] = author
+        self.author_by_hash[author.hash] = author
+        if self.journal is not None:
+            data = asdict(author)
+            data.pop("hash")
+            self.log_journal("author", data=data)
 
     def add_question(self, question: Question):
-        self.questions.append(question)
-        self.question_dict[question.id] = question
-        self.questions_by_paragraph[question.paragraph_id].append(question)
+        self.add_questions([question])
 
     def add_answer(self, answer: Answer):
-        self.answers.append(answer)
-        self.answer_dict[answer.id] = answer
-        self.answers_by_question[answer.question_id].append(answer)
+        self.add_answers([answer])
 
     def add_rating(self, rating: Rating):
-        self.ratings.append(rating)
-        self.rating_dict[rating.id] = rating
-        self.ratings_by_answer[rating.answer_id].append(rating)
+        self.add_ratings([rating])
+
+    def add_paragraphs(self, paragraphs: List[Paragraph]):
+        for paragraph in paragraphs:
+            self.add_paragraph(paragraph)
 
     def add_questions(self, questions: List[Question]):
         self.questions.extend(questions)
         for question in questions:
             self.question_dict[question.id] = question
             self.questions_by_paragraph[question.paragraph_id].append(question)
+            self._enqueue_question(question)
+            if self.journal is not None:
+                self.log_journal("question", data=asdict(question))
 
     def add_answers(self, answers: List[Answer]):
         self.answers.extend(answers)
         for answer in answers:
             self.answer_dict[answer.id] = answer
             self.answers_by_question[answer.question_id].append(answer)
+            if not answer.processed:
+                self.pending_rating.push(answer)
+            if self.journal is not None:
+                self.log_journal("answer", data=asdict(answer))
 
     def add_ratings(self, ratings: List[Rating]):
         self.ratings.extend(ratings)
         for rating in ratings:
             self.rating_dict[rating.id] = rating
             self.ratings_by_answer[rating.answer_id].append(rating)
+            if rating.text is None:
+                self.pending_rationale.push(rating)
+            if self.journal is not None:
+                self.log_journal("rating", data=asdict(rating))
+
+    def _enqueue_question(self, question: Question):
+        if not question.filtered:
+            self.pending_filter.push(question)
+        elif not question.processed:
+            self.pending_answer.push(question)
+
+    def mark_paragraphs_processed(self, paragraphs: List[Paragraph]):
+        for paragraph in paragraphs:
+            paragraph.processed = True
+        self.log_journal("paragraphs_processed", ids=[p.id for p in paragraphs])
+        self.commit_journal()
+
+    def mark_questions_filtered(self, questions: List[Question]):
+        for question in questions:
+            question.filtered = True
+            if not question.processed:
+                self.pending_answer.push(question)
+        self.log_journal(
+            "questions_filtered",
+            verdicts=[
+                [
+                    q.id,
+                    q.is_answerable_ic,
+                    q.is_answerable_zs,
+                    q.rejected,
+                    q.answerable_ic_confidence,
+                    q.answerable_zs_confidence,
+                ]
+                for q in questions
+            ],
+        )
+        self.commit_journal()
+
+    def mark_questions_duplicate(self, duplicates: List[tuple]):
+        """Links each (question, canonical question id) pair and takes the
+        question out of the later stages. Committed with its stage 1 batch."""
+        for question, canonical_id in duplicates:
+            question.duplicate_of = canonical_id
+            question.filtered = True
+            question.processed = True
+        self.log_journal(
+            "questions_duplicate", pairs=[[q.id, canonical_id] for q, canonical_id in duplicates]
+        )
+
+    def mark_questions_processed(self, questions: List[Question]):
+        for question in questions:
+            question.processed = True
+        self.log_journal("questions_processed", ids=[q.id for q in questions])
+        self.commit_journal()
+
+    def mark_answers_processed(self, answers: List[Answer]):
+        for answer in answers:
+            answer.processed = True
+        self.log_journal("answers_processed", ids=[a.id for a in answers])
+        self.commit_journal()
+
+    def requeue_failures(
+        self,
+        stage: str,
+        items: List[Any],
+        queue: PendingQueue,
+        failure: Callable[[Any], Optional[str]],
+    ) -> List[Any]:
+        """Settles a finished batch item by item.
+
+        `failure(item)` gives the reason an item failed, or None. Failed
+        items with attempts left are pushed back onto `queue`, so they are
+        retried alone in a later batch. Returns the items to mark done:
+        the successes and the dead letters.
+        """
+        done = []
+        for item in items:
+            reason = failure(item)
+            if reason is None:
+                self.retries.succeeded(stage, item.id)
+                done.append(item)
+            elif self.retries.fail(stage, item.id, reason):
+                queue.push(item)
+            else:
+                done.append(item)
+        return done
+
+    def mark_rationales_generated(self, ratings: List[Rating]):
+        self.log_journal("rating_rationales", rationales=[[r.id, r.text] for r in ratings])
+        self.commit_journal()
 
     def get_paragraph(self, paragraph_id: int) -> Optional[Paragraph]:
         return self.paragraph_dict.get(paragraph_id)
@@ -168,6 +557,9 @@ class Dataset:
     def get_author(self, author_id: int) -> Optional[Author]:
         return self.author_dict.get(author_id)
 
+    def get_author_by_hash(self, hash_value: str) -> Optional[Author]:
+        return self.author_by_hash.get(hash_value)
+
     def get_question(self, question_id: int) -> Optional[Question]:
         return self.question_dict.get(question_id)
 
@@ -187,87 +579,19 @@ class Dataset:
         return self.ratings_by_answer.get(answer_id, [])
 
 
-dataset = Dataset()
+def create_dataset(storage: str = DATASET_STORAGE) -> Dataset:
+    if storage == "columnar":
+        from askmevllm.columnar import ColumnarDataset
 
+        return ColumnarDataset()
+    return Dataset()
 
-def flatten_dataset(dataset: Dataset) -> List[Dict[str, Any]]:
-    flattened_data = []
 
-    for paragraph in dataset.paragraphs:
-        paragraph_data = {
-            "paragraph_id": paragraph.id,
-            "page_name": paragraph.page_name,
-            "section_name": paragraph.section_name,
-            "subsection_name": paragraph.subsection_name,
-            "subsubsection_name": paragraph.subsubsection_name,
-            "paragraph_text": paragraph.text,
-            "word_count": paragraph.word_count,
-            "is_bad": paragraph.is_bad,
-            "within_page_order": paragraph.within_page_order,
-            "paragraph_processed": paragraph.processed,
-            "original_entry_id": paragraph.original_entry_id,
-        }
+dataset = create_dataset()
 
-        questions = dataset.get_questions_for_paragraph(paragraph.id)
-        for question in questions:
-            question_data = {
-                "question_id": question.id,
-                "question_scope": question.scope,
-                "question_context": question.context,
-                "question_text": question.text,
-                "author_id": question.author_id,
-                "timestamp": question.timestamp,
-                "upvote": question.upvote,
-                "downvote": question.downvote,
-                "turns": question.turns,
-                "filtered": question.filtered,
-                "is_answerable_zs": question.is_answerable_zs,
-                "is_answerable_ic": question.is_answerable_ic,
-                "rejected": question.rejected,
-                "question_processed": question.processed,
-            }
 
-            answers = dataset.get_answers_for_question(question.id)
-            for answer in answers:
-                answer_data = {
-                    "answer_id": answer.id,
-                    "answer_setting": answer.setting,
-                    "answer_timestamp": answer.timestamp,
-                    "answer_text": answer.text,
-                    "answer_processed": answer.processed,
-                }
-
-                ratings = dataset.get_ratings_for_answer(answer.id)
-                for rating in ratings:
-                    rating_data = {
-                        "rating_id": rating.id,
-                        "rating_text": rating.text,
-                        "rating_value": rating.value,
-                        "rating_timestamp": rating.timestamp,
-                    }
-
-                    # Combine all data into a single record
-                    record = {
-                        **paragraph_data,
-                        **question_data,
-                        **answer_data,
-                        **rating_data,
-                    }
-                    flattened_data.append(record)
-
-                # If no ratings, still add the record
-                if not ratings:
-                    record = {**paragraph_data, **question_data, **answer_data}
-                    flattened_data.append(record)
-
-            # If no answers, still add the record
-            if not answers:
-                record = {**paragraph_data, **question_data}
-                flattened_data.append(record)
-
-        # If no questions, still add the record
-        if not questions:
-            record = {**paragraph_data}
-            flattened_data.append(record)
-
-    return pd.DataFrame(flattened_data)
+def flatten_dataset(dataset: Dataset) -> pd.DataFrame:
+    # Materializes the whole join; use askmevllm.export for large datasets.
+    from askmevllm.export import iter_flattened_chunks
+
+    return pd.concat(iter_flattened_chunks(dataset), ignore_index=True)
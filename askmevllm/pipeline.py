@@ -0,0 +1,272 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from tqdm import tqdm
+
+from askmevllm.config import OUTPUT_FORMAT, OUTPUT_PATH, PIPELINE_OVERLAP
+from askmevllm.engine import (
+    GenerationRequest,
+    InferenceBackend,
+    RequestOutput,
+    Tokenizer,
+    create_tokenizer,
+    generate_requests,
+)
+from askmevllm.models import (
+    Answer,
+    Paragraph,
+    PendingQueue,
+    Question,
+    Rating,
+    dataset,
+)
+from askmevllm.dataset.common import paragraph_contexts
+from askmevllm.dataset.questions import (
+    apply_filter_outputs,
+    build_filter_requests,
+    build_question_requests,
+    parse_question_outputs,
+)
+from askmevllm.dataset.answers import build_answer_requests_for_settings, parse_answer_outputs
+from askmevllm.dataset.ratings import (
+    build_rating_requests,
+    build_rationale_requests,
+    parse_rating_outputs,
+    parse_rationale_outputs,
+)
+from askmevllm.export import export_dataset
+from askmevllm.dedup import question_deduplicator
+from askmevllm.metrics import BatchTimer, metrics
+from askmevllm.retry import settle_batch
+from askmevllm.scheduler import log_batch_stats, make_batcher
+from askmevllm.workers import EngineWorker, PrepWorkers
+
+
+@dataclass
+class PipelineStage:
+    name: str
+    desc: str
+    inbox: PendingQueue
+    outbox: Optional[PendingQueue]
+    build: Callable[[List[Any]], List[GenerationRequest]]
+    # Records results on the dataset, which enqueues them for the next stage.
+    finish: Callable[[List[Any], List[GenerationRequest], List[RequestOutput]], None]
+    batcher: Any = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    processed: int = 0
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+# Failed items go back to their inbox via settle_batch. When the engine call
+# raised, finish gets no outputs, so every item of the batch counts as failed.
+def _finish_questions(paragraphs: List[Paragraph], requests, outputs):
+    questions = parse_question_outputs(requests, outputs)
+    if questions:
+        dataset.add_questions(questions)
+        question_deduplicator.deduplicate(questions)
+    settle_batch("stage_1", paragraphs)
+
+
+def _finish_filter(questions: List[Question], requests, outputs):
+    apply_filter_outputs(questions, requests, outputs)
+    settle_batch("stage_2", questions)
+
+
+def _finish_answers(questions: List[Question], requests, outputs):
+    answers = parse_answer_outputs(requests, outputs)
+    if answers:
+        dataset.add_answers(answers)
+    settle_batch("stage_3", questions)
+
+
+def _finish_ratings(answers: List[Answer], requests, outputs):
+    ratings = parse_rating_outputs(requests, outputs)
+    dataset.add_ratings(ratings)
+    settle_batch("stage_4", answers)
+
+
+def _finish_rationales(ratings: List[Rating], requests, outputs):
+    parse_rationale_outputs(requests, outputs)
+    settle_batch("stage_5", ratings)
+
+
+def build_pipeline_stages(batch_size: int) -> List[PipelineStage]:
+    paragraphs = dataset.pending_paragraphs
+    to_filter = dataset.pending_filter
+    to_answer = dataset.pending_answer
+    to_rate = dataset.pending_rating
+    to_explain = dataset.pending_rationale
+
+    # Ordered downstream-first so draining work is always scheduled before new
+    # work is admitted; this is what keeps the queues bounded.
+    stages = [
+        PipelineStage("stage_5", "Stage 5: Generate Rationales", to_explain, None,
+                      build_rationale_requests, _finish_rationales),
+        PipelineStage("stage_4", "Stage 4: Generate Ratings", to_rate, to_explain,
+                      build_rating_requests, _finish_ratings),
+        PipelineStage("stage_3", "Stage 3: Generate Answers", to_answer, to_rate,
+                      build_answer_requests_for_settings, _finish_answers),
+        PipelineStage("stage_2", "Stage 2: Filter Questions", to_filter, to_answer,
+                      build_filter_requests, _finish_filter),
+        PipelineStage("stage_1", "Stage 1: Generate Questions", paragraphs, to_filter,
+                      build_question_requests, _finish_questions),
+    ]
+    for stage in stages:
+        stage.batcher = make_batcher(stage.name, batch_size)
+    return stages
+
+
+def _schedule(stages: List[PipelineStage], queue_size: int, workers: Optional[PrepWorkers]):
+    scheduled = []
+    for stage in stages:
+        if not stage.inbox:
+            continue
+        # Backpressure: a stage whose downstream queue is full waits for the
+        # next tick. It may overshoot by one batch worth of fan-out.
+        if stage.outbox is not None and len(stage.outbox) >= queue_size:
+            continue
+        items = stage.batcher.next_batch(stage.inbox)
+        if not items:
+            continue
+        if stage.started_at is None:
+            stage.started_at = time.time()
+        timer = BatchTimer()
+        with timer.phase("build"):
+            requests = stage.build(items)
+            if workers is not None:
+                workers.tokenize(requests)
+        scheduled.append((stage, items, requests, timer))
+    return scheduled
+
+
+def _all_requests(scheduled) -> List[GenerationRequest]:
+    logging.debug(
+        "Submitting mixed batch: "
+        + ", ".join(f"{stage.name}={len(requests)}" for stage, _, requests, _ in scheduled)
+    )
+    return [r for _, _, requests, _ in scheduled for r in requests]
+
+
+def _finish_scheduled(
+    scheduled,
+    outputs: Optional[List[RequestOutput]],
+    generate_seconds: float,
+    bars: Dict[str, tqdm],
+):
+    offset = 0
+    for stage, items, requests, timer in scheduled:
+        stage_outputs = outputs[offset : offset + len(requests)] if outputs is not None else []
+        offset += len(requests)
+        # Every stage in the mixed call is charged the whole call.
+        timer.seconds["generate"] = generate_seconds
+        timer.outputs = stage_outputs
+        with timer.phase("parse"):
+            stage.finish(items, requests, stage_outputs)
+        metrics.record_batch(stage.name, len(items), timer)
+        stage.finished_at = time.time()
+        stage.processed += len(items)
+        bars[stage.name].update(len(items))
+
+
+def _run_alternating(stages, llm, queue_size, bars, workers):
+    while True:
+        scheduled = _schedule(stages, queue_size, workers)
+        if not scheduled:
+            break
+        all_requests = _all_requests(scheduled)
+        generate_start = time.perf_counter()
+        try:
+            outputs = generate_requests(llm, all_requests)
+        except Exception as e:
+            logging.error(f"Engine call for {len(all_requests)} requests failed: {e}")
+            outputs = None
+        _finish_scheduled(scheduled, outputs, time.perf_counter() - generate_start, bars)
+
+
+def _run_overlapped(stages, llm, queue_size, bars, workers):
+    # While the engine generates batch N, batch N + 1 is built and tokenized,
+    # then submitted as soon as N returns, and N is parsed while N + 1
+    # generates. Batch N + 1 is built from what batch N - 1 produced.
+    engine = EngineWorker(llm)
+    in_flight = None
+    try:
+        while True:
+            scheduled = _schedule(stages, queue_size, workers)
+            done = None
+            if in_flight is not None:
+                done_scheduled, future = in_flight
+                done = (done_scheduled, *future.result())
+            in_flight = None
+            if scheduled:
+                in_flight = (scheduled, engine.submit(_all_requests(scheduled)))
+            if done is not None:
+                _finish_scheduled(*done, bars)
+            elif in_flight is None:
+                break
+    finally:
+        engine.close()
+
+
+def run_pipeline(
+    stages: List[PipelineStage],
+    llm: InferenceBackend,
+    queue_size: int,
+    progress: bool = True,
+    overlap: bool = PIPELINE_OVERLAP,
+    tokenizer: Optional[Tokenizer] = None,
+) -> Dict[str, float]:
+    """Runs every stage's batches through the engine as one mixed call per
+    tick. With `overlap`, CPU-side work on neighbouring batches runs while
+    the engine generates; with a `tokenizer`, prompts reach the engine as
+    token ids."""
+    bars = {
+        stage.name: tqdm(
+            desc=stage.desc,
+            total=len(stage.inbox) if stage.name == "stage_1" else None,
+            disable=not progress,
+        )
+        for stage in reversed(stages)
+    }
+    workers = PrepWorkers(tokenizer) if tokenizer is not None else None
+    start_time = time.time()
+
+    try:
+        if overlap:
+            _run_overlapped(stages, llm, queue_size, bars, workers)
+        else:
+            _run_alternating(stages, llm, queue_size, bars, workers)
+    finally:
+        if workers is not None:
+            workers.close()
+    logging.info("All pipeline queues drained. Finishing process.")
+
+    for bar in bars.values():
+        bar.close()
+
+    # Stages overlap, so each stage time is the span from its first batch
+    # being scheduled to its last batch completing.
+    times = {f"{stage.name}_time": stage.elapsed() for stage in reversed(stages)}
+    times["total_time"] = time.time() - start_time
+    return times
+
+
+def process_all_paragraphs_pipelined(batch_size, llm, queue_size: Optional[int] = None):
+    logging.info("Starting pipelined generation")
+    queue_size = queue_size or 4 * batch_size
+    stages = build_pipeline_stages(batch_size)
+    tokenizer = create_tokenizer()
+    paragraph_contexts.tokenizer = tokenizer.encode if tokenizer is not None else None
+    times = run_pipeline(stages, llm, queue_size, tokenizer=tokenizer)
+    logging.info(f"Process completed in {times}")
+    log_batch_stats({stage.name: stage.batcher for stage in reversed(stages)})
+
+    export_dataset(dataset, OUTPUT_PATH, OUTPUT_FORMAT)
+
+    return times
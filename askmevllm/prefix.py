@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+
+from askmevllm.engine import (
+    InferenceBackend,
+    PromptTokenIds,
+    RequestOutput,
+    SamplingParams,
+    SamplingParamsArg,
+)
+
+
+class PrefixCacheMeter:
+    """Estimates how much prompt prefill an automatic prefix cache can skip.
+
+    Mirrors vLLM's block-level prefix caching: prompts are cut into
+    fixed-size token blocks, each identified by a hash of every token up to
+    and including it, and a block is a hit while it is still among the
+    `capacity_blocks` most recently used. Only full blocks are cached.
+    """
+
+    def __init__(self, block_size: int = 16, capacity_blocks: int = 8192):
+        self.block_size = block_size
+        self.capacity_blocks = capacity_blocks
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._blocks: "OrderedDict[bytes, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, token_ids: Sequence[int]) -> int:
+        """Account for one prompt in submission order; returns its cached tokens."""
+        hits = 0
+        with self._lock:
+            digest = hashlib.blake2b(digest_size=16)
+            matching = True
+            for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+                digest.update(repr(token_ids[start : start + self.block_size]).encode())
+                block = digest.digest()
+                if matching and block in self._blocks:
+                    hits += self.block_size
+                else:
+                    matching = False
+                self._blocks[block] = None
+                self._blocks.move_to_end(block)
+            while len(self._blocks) > self.capacity_blocks:
+                self._blocks.popitem(last=False)
+            self.prompts += 1
+            self.prompt_tokens += len(token_ids)
+            self.cached_tokens += hits
+        return hits
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "prompts": self.prompts,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+        }
+
+
+class PrefixMeteredBackend:
+    """Feeds the prompt token ids of every request sent to the wrapped
+    backend through a PrefixCacheMeter, in submission order."""
+
+    def __init__(self, backend: InferenceBackend, meter: PrefixCacheMeter):
+        self.backend = backend
+        self.meter = meter
+        self.model = backend.model
+
+    def generate(
+        self,
+        prompts: List[str],
+        sampling_params: SamplingParamsArg,
+        prompt_token_ids: PromptTokenIds = None,
+    ) -> List[RequestOutput]:
+        if prompt_token_ids is not None:
+            outputs = self.backend.generate(prompts, sampling_params, prompt_token_ids=prompt_token_ids)
+        else:
+            outputs = self.backend.generate(prompts, sampling_params)
+        for output in outputs:
+            self.meter.record(output.prompt_token_ids)
+        return outputs
+
+    async def generate_one(self, prompt: str, params: SamplingParams) -> RequestOutput:
+        # Async backends complete out of order; this records completion order.
+        output = await self.backend.generate_one(prompt, params)
+        self.meter.record(output.prompt_token_ids)
+        return output
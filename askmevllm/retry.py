@@ -0,0 +1,90 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from askmevllm.models import Answer, Paragraph, PendingQueue, Question, Rating, dataset
+from askmevllm.dataset.answers import missing_answer_settings
+
+
+# Whether an item of each stage came out of its batch without a usable
+# result. They look at the dataset rather than the batch's outputs, so an
+# engine call that raised counts as a failure of every item in it.
+def question_failure(paragraph: Paragraph) -> Optional[str]:
+    if dataset.get_questions_for_paragraph(paragraph.id):
+        return None
+    return "no_questions"
+
+
+def filter_failure(question: Question) -> Optional[str]:
+    if question.answerable_ic_confidence is None or question.answerable_zs_confidence is None:
+        return "no_verdict"
+    return None
+
+
+def answer_failure(question: Question) -> Optional[str]:
+    missing = missing_answer_settings(question)
+    return f"no_{'_'.join(missing)}_answer" if missing else None
+
+
+def rating_failure(answer: Answer) -> Optional[str]:
+    if dataset.get_ratings_for_answer(answer.id):
+        return None
+    return "no_rating"
+
+
+def rationale_failure(rating: Rating) -> Optional[str]:
+    return "empty_rationale" if rating.text is None else None
+
+
+def _mark_rationales_generated(ratings: List[Rating]):
+    for rating in ratings:
+        # dead letters keep their score without a rationale
+        if rating.text is None:
+            rating.text = ""
+    dataset.mark_rationales_generated(ratings)
+
+
+STAGE_SETTLEMENT: Dict[
+    str,
+    Tuple[Callable[[], PendingQueue], Callable[[Any], Optional[str]], Callable[[List[Any]], None]],
+] = {
+    "stage_1": (
+        lambda: dataset.pending_paragraphs,
+        question_failure,
+        lambda paragraphs: dataset.mark_paragraphs_processed(paragraphs),
+    ),
+    "stage_2": (
+        lambda: dataset.pending_filter,
+        filter_failure,
+        lambda questions: dataset.mark_questions_filtered(questions),
+    ),
+    "stage_3": (
+        lambda: dataset.pending_answer,
+        answer_failure,
+        lambda questions: dataset.mark_questions_processed(questions),
+    ),
+    "stage_4": (
+        lambda: dataset.pending_rating,
+        rating_failure,
+        lambda answers: dataset.mark_answers_processed(answers),
+    ),
+    "stage_5": (lambda: dataset.pending_rationale, rationale_failure, _mark_rationales_generated),
+}
+
+
+def settle_batch(stage: str, items: List[Any]) -> List[Any]:
+    """Marks a finished batch done, except the items that failed and have
+    attempts left, which go back on the stage's queue to be retried alone
+    (see Dataset.requeue_failures). Returns the items marked done."""
+    queue, failure, mark_done = STAGE_SETTLEMENT[stage]
+    done = dataset.requeue_failures(stage, items, queue(), failure)
+    retried = len(items) - len(done)
+    if retried:
+        logging.info(f"{stage}: {retried} of {len(items)} items failed and were requeued")
+    mark_done(done)
+    return done
+
+
+def log_retry_summary():
+    for stage, summary in dataset.retries.summary().items():
+        if summary["retrying"] or summary["dead_letters"]:
+            logging.info(f"{stage} retries: {summary}")
@@ -0,0 +1,200 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from askmevllm.config import MAX_BATCH_ITEMS, RATING_MODE, STAGE_TOKEN_BUDGETS
+from askmevllm.metrics import metrics
+from askmevllm.models import PendingQueue, dataset
+from askmevllm.dataset.common import estimate_tokens, paragraph_contexts
+from askmevllm.dataset.questions import (
+    FILTER_MAX_TOKENS,
+    QUESTION_PROMPT_TEMPLATE,
+    question_max_tokens,
+)
+from askmevllm.dataset.answers import ANSWER_MAX_TOKENS, ANSWER_PROMPT_TEMPLATE
+from askmevllm.dataset.ratings import RATING_MAX_TOKENS, RATING_PROMPT_TEMPLATE
+
+FILTER_PROMPT_OVERHEAD = 30
+
+
+def _fact_tokens(question) -> int:
+    return paragraph_contexts.fact_tokens(dataset.get_paragraph(question.paragraph_id))
+
+
+# Estimated prompt + max output tokens that one item adds to a stage batch.
+def question_stage_cost(paragraph) -> int:
+    return (
+        estimate_tokens(QUESTION_PROMPT_TEMPLATE)
+        + estimate_tokens(paragraph.text_cleaned)
+        + question_max_tokens()
+    )
+
+
+def filter_stage_cost(question) -> int:
+    # one IC request (question + fact) and one ZS request (question only)
+    question_tokens = estimate_tokens(question.text) + FILTER_PROMPT_OVERHEAD
+    return 2 * (question_tokens + FILTER_MAX_TOKENS) + _fact_tokens(question)
+
+
+def answer_stage_cost(question) -> int:
+    question_tokens = estimate_tokens(ANSWER_PROMPT_TEMPLATE) + estimate_tokens(question.text)
+    return 2 * (question_tokens + ANSWER_MAX_TOKENS) + _fact_tokens(question)
+
+
+def _rating_prompt_tokens(answer) -> int:
+    question = dataset.get_question(answer.question_id)
+    return (
+        estimate_tokens(RATING_PROMPT_TEMPLATE)
+        + estimate_tokens(question.text)
+        + estimate_tokens(answer.text)
+        + _fact_tokens(question)
+    )
+
+
+def rating_stage_cost(answer) -> int:
+    # the score-first modes decode a single token
+    output_tokens = RATING_MAX_TOKENS if RATING_MODE == "free" else 1
+    return _rating_prompt_tokens(answer) + output_tokens
+
+
+def rationale_stage_cost(rating) -> int:
+    return _rating_prompt_tokens(dataset.get_answer(rating.answer_id)) + RATING_MAX_TOKENS
+
+
+STAGE_COSTS: Dict[str, Callable[[Any], int]] = {
+    "stage_1": question_stage_cost,
+    "stage_2": filter_stage_cost,
+    "stage_3": answer_stage_cost,
+    "stage_4": rating_stage_cost,
+    "stage_5": rationale_stage_cost,
+}
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    items: int = 0
+    tokens: int = 0
+    fill_ratios: List[float] = field(default_factory=list)
+
+    def record(self, items: int, tokens: int, budget: Optional[int]):
+        self.batches += 1
+        self.items += items
+        self.tokens += tokens
+        if budget:
+            self.fill_ratios.append(tokens / budget)
+
+    def summary(self) -> Dict[str, float]:
+        fills = self.fill_ratios
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_items": self.items / self.batches if self.batches else 0.0,
+            "mean_tokens": self.tokens / self.batches if self.batches else 0.0,
+            "mean_fill": sum(fills) / len(fills) if fills else 0.0,
+            "min_fill": min(fills) if fills else 0.0,
+        }
+
+
+class CountBatcher:
+    """Fixed item-count batches, the original behaviour."""
+
+    def __init__(self, name: str, batch_size: int):
+        self.name = name
+        self.batch_size = batch_size
+        self.stats = BatchStats()
+
+    def next_batch(self, queue: PendingQueue) -> List[Any]:
+        batch = queue.pop_batch(self.batch_size)
+        if batch:
+            self.stats.record(len(batch), 0, None)
+        return batch
+
+
+class TokenBudgetBatcher:
+    """Forms batches whose estimated prompt + max output tokens fit a budget.
+
+    A lookahead window is popped from the queue; the oldest item anchors the
+    batch, which is then filled with the items closest to it in cost, so a
+    batch holds prompts of similar length and nothing is starved. Items that
+    don't make it are put back at the front of the queue in order.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cost: Callable[[Any], int],
+        max_batch_tokens: int,
+        max_batch_size: int = MAX_BATCH_ITEMS,
+        lookahead: int = 4,
+    ):
+        self.name = name
+        self.cost = cost
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.lookahead = lookahead
+        self.stats = BatchStats()
+        # Items can sit in several windows before being chosen; cost them
+        # once. Only the items put back by the last batch are kept, so items
+        # the queue dropped as done are evicted with the next window.
+        self._costs: Dict[Tuple[str, int], int] = {}
+
+    @staticmethod
+    def _key(item) -> Tuple[str, int]:
+        return (type(item).__name__, item.id)
+
+    def _cost(self, item) -> int:
+        key = self._key(item)
+        cost = self._costs.get(key)
+        if cost is None:
+            cost = self._costs[key] = self.cost(item)
+        return cost
+
+    def next_batch(self, queue: PendingQueue) -> List[Any]:
+        window = queue.pop_batch(self.max_batch_size * self.lookahead)
+        if not window:
+            self._costs.clear()
+            return []
+
+        costs = [self._cost(item) for item in window]
+        anchor = costs[0]
+        order = sorted(range(len(window)), key=lambda i: (abs(costs[i] - anchor), i))
+
+        chosen = set()
+        tokens = 0
+        for i in order:
+            if len(chosen) >= self.max_batch_size:
+                break
+            # The anchor is always taken, even when it alone exceeds the budget.
+            if chosen and tokens + costs[i] > self.max_batch_tokens:
+                continue
+            chosen.add(i)
+            tokens += costs[i]
+
+        leftover = [i for i in range(len(window)) if i not in chosen]
+        queue.push_front([window[i] for i in leftover])
+        self._costs = {self._key(window[i]): costs[i] for i in leftover}
+        batch = [item for i, item in enumerate(window) if i in chosen]
+        self.stats.record(len(batch), tokens, self.max_batch_tokens)
+        metrics.record_fill(self.name, tokens / self.max_batch_tokens)
+        logging.debug(
+            f"{self.name}: batch of {len(batch)} items, ~{tokens} tokens "
+            f"({tokens / self.max_batch_tokens:.0%} of budget)"
+        )
+        return batch
+
+
+def make_batcher(stage: str, batch_size: int):
+    budget = (STAGE_TOKEN_BUDGETS or {}).get(stage)
+    if budget is None:
+        return CountBatcher(stage, batch_size)
+    return TokenBudgetBatcher(stage, STAGE_COSTS[stage], budget)
+
+
+def make_batchers(batch_size: int) -> Dict[str, Any]:
+    return {stage: make_batcher(stage, batch_size) for stage in STAGE_COSTS}
+
+
+def log_batch_stats(batchers: Dict[str, Any]):
+    for stage, batcher in batchers.items():
+        logging.info(f"{stage} batching: {batcher.stats.summary()}")
@@ -0,0 +1,163 @@
+import logging
+import os
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from askmevllm.config import (
+    NUMQUESTIONS,
+    SCREEN_DUPLICATE_TEXT,
+    SCREEN_LIST_LINE_RATIO,
+    SCREEN_MAX_WORDS,
+    SCREEN_MIN_WORDS,
+    SCREEN_PARAGRAPHS,
+    SCREEN_REFERENCE_SECTIONS,
+    SCREEN_TABLE_CELL_RATIO,
+)
+from askmevllm.dedup import llm_calls_per_question
+
+LIST_ITEM = r"(?m)^\s*(?:[-*•]|\d+[.)])\s"
+TABLE_CELL = r"[|\t]"
+SKIPPED_COLUMNS = ["id", "page_name", "section_name"]
+
+
+class ParagraphScreen:
+    """Vectorized load-time checks that keep paragraphs unlikely to yield
+    answerable questions away from stage 1.
+
+    `reasons(frame)` gives each row of a CSV chunk the first check it fails
+    (None when it passes); checks run in the order of the returned
+    categories. Text hashes are carried across chunks so only the first
+    copy of a repeated paragraph is kept, and `counts` tallies the reasons
+    of every row screened so far. With a `skipped_path`, record_skipped
+    writes the skipped rows there for loads that don't keep them.
+    """
+
+    def __init__(
+        self,
+        min_words: int = SCREEN_MIN_WORDS,
+        max_words: Optional[int] = SCREEN_MAX_WORDS,
+        reference_sections: Iterable[str] = SCREEN_REFERENCE_SECTIONS,
+        list_line_ratio: Optional[float] = SCREEN_LIST_LINE_RATIO,
+        table_cell_ratio: Optional[float] = SCREEN_TABLE_CELL_RATIO,
+        duplicate_text: bool = SCREEN_DUPLICATE_TEXT,
+        skipped_path: Optional[str] = None,
+    ):
+        self.min_words = min_words
+        self.max_words = max_words
+        self.reference_sections = {s.lower() for s in reference_sections}
+        self.list_line_ratio = list_line_ratio
+        self.table_cell_ratio = table_cell_ratio
+        self.duplicate_text = duplicate_text
+        self.seen_hashes = set()
+        self.counts: Counter = Counter()
+        self.skipped_path = skipped_path
+        self._skipped_written = False
+
+    def _text(self, frame: pd.DataFrame) -> pd.Series:
+        text = frame["text_cleaned"].fillna(frame["text"]) if "text_cleaned" in frame else frame["text"]
+        return text.fillna("").astype(str)
+
+    def _text_hashes(self, text: pd.Series) -> np.ndarray:
+        normalized = text.str.lower().str.replace(r"\s+", " ", regex=True).str.strip()
+        return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+    def reasons(self, frame: pd.DataFrame) -> pd.Series:
+        text = self._text(frame)
+        words = text.str.count(r"\S+")
+        if "word_count" in frame:
+            words = frame["word_count"].astype("Float64").fillna(words).astype("int64")
+        lines = text.str.count("\n") + 1
+
+        checks = [
+            ("is_bad", frame["is_bad"].fillna(False).astype(bool) if "is_bad" in frame else None),
+            ("too_short", words < self.min_words),
+            ("too_long", words > self.max_words if self.max_words is not None else None),
+        ]
+        sections = [
+            frame[column].fillna("").str.strip().str.lower().isin(self.reference_sections)
+            for column in ("section_name", "subsection_name", "subsubsection_name")
+            if column in frame
+        ]
+        if sections and self.reference_sections:
+            checks.append(("reference_section", np.logical_or.reduce(sections)))
+        if self.list_line_ratio is not None:
+            checks.append(("list", text.str.count(LIST_ITEM) >= self.list_line_ratio * lines))
+        if self.table_cell_ratio is not None:
+            checks.append(
+                ("table", text.str.count(TABLE_CELL) >= self.table_cell_ratio * words.clip(lower=1))
+            )
+
+        reasons = np.full(len(frame), None, dtype=object)
+        for reason, failed in checks:
+            if failed is None:
+                continue
+            failed = np.asarray(failed, dtype=bool)
+            reasons[failed & (reasons == None)] = reason  # noqa: E711
+
+        if self.duplicate_text:
+            # Only rows that passed everything else claim their text.
+            kept = reasons == None  # noqa: E711
+            hashes = self._text_hashes(text)
+            repeated = np.zeros(len(frame), dtype=bool)
+            repeated[kept] = pd.Series(hashes[kept]).duplicated().to_numpy() | np.isin(
+                hashes[kept], np.fromiter(self.seen_hashes, dtype=np.uint64, count=len(self.seen_hashes))
+            )
+            reasons[repeated] = "duplicate_text"
+            self.seen_hashes.update(hashes[kept & ~repeated].tolist())
+
+        self.counts.update(reasons.tolist())
+        return pd.Series(reasons, index=frame.index, dtype=object)
+
+    def record_skipped(self, frame: pd.DataFrame, reasons: pd.Series):
+        """Appends the rows of `frame` with a reason to skipped_path; the
+        first call starts the file, so it always has a header."""
+        if self.skipped_path is None:
+            return
+        if not self._skipped_written:
+            directory = os.path.dirname(self.skipped_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        skipped = reasons.notna()
+        columns = [column for column in SKIPPED_COLUMNS if column in frame]
+        frame.loc[skipped, columns].assign(skip_reason=reasons[skipped]).to_csv(
+            self.skipped_path,
+            index=False,
+            mode="a" if self._skipped_written else "w",
+            header=not self._skipped_written,
+        )
+        self._skipped_written = True
+
+
+def screen_frame(frame: pd.DataFrame, screen: Optional[ParagraphScreen]) -> pd.DataFrame:
+    """Adds the skip_reason column read by paragraphs_from_frame."""
+    if screen is None:
+        return frame
+    return frame.assign(skip_reason=screen.reasons(frame))
+
+
+def make_screen(skipped_path: Optional[str] = None) -> Optional[ParagraphScreen]:
+    return ParagraphScreen(skipped_path=skipped_path) if SCREEN_PARAGRAPHS else None
+
+
+def screening_report(skip_reasons: Iterable[Optional[str]]) -> Dict[str, object]:
+    """Skip counts per reason and the engine calls they save: one stage 1
+    generation per paragraph plus the filtering, answering and rating of
+    the NUMQUESTIONS questions it would have produced."""
+    counts = Counter(skip_reasons)
+    kept = counts.pop(None, 0)
+    skipped = sum(counts.values())
+    return {
+        "paragraphs": kept + skipped,
+        "kept": kept,
+        "skipped": skipped,
+        "reasons": dict(counts.most_common()),
+        "generations_saved": skipped,
+        "llm_calls_saved": skipped * (1 + NUMQUESTIONS * llm_calls_per_question()),
+    }
+
+
+def log_screening_report(skip_reasons: Iterable[Optional[str]]):
+    logging.info(f"Paragraph screening: {screening_report(skip_reasons)}")
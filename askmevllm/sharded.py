@@ -0,0 +1,337 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+from dataclasses import asdict, is_dataclass
+from typing import Any, Dict, List, Optional
+
+from tqdm import tqdm
+
+from askmevllm.cache import CachedBackend, CompletionCache
+from askmevllm.config import (
+    COMPLETION_CACHE_MAX_BYTES,
+    COMPLETION_CACHE_PATH,
+    ENABLE_PREFIX_CACHING,
+    ENGINE,
+    LOGGING_LEVEL,
+    METRICS_JSONL_PATH,
+    METRICS_PROMETHEUS_PATH,
+    MODEL,
+    OUTPUT_FORMAT,
+    OUTPUT_PATH,
+    SEED,
+    SHARD_DEVICES,
+    SHARD_MAX_RESTARTS,
+)
+from askmevllm.dataset.common import paragraph_contexts
+from askmevllm.dedup import log_dedup_summary
+from askmevllm.engine import InferenceBackend, create_backend, create_tokenizer
+from askmevllm.export import export_dataset
+from askmevllm.helpers import load_paragraphs
+from askmevllm.journal import Journal, apply_record, replay_journal
+from askmevllm.metrics import create_metrics_sinks, log_metrics_summary, metrics
+from askmevllm.models import Author, Dataset, IdAllocator, Paragraph, RangeIdReserver, dataset
+from askmevllm.pipeline import build_pipeline_stages, run_pipeline
+from askmevllm.retry import log_retry_summary
+
+
+class StreamingJournal(Journal):
+    """A shard's journal that also forwards every committed batch, numbered,
+    to the coordinator."""
+
+    def __init__(self, directory: str, shard: int, results, **kwargs):
+        super().__init__(directory, **kwargs)
+        self.shard = shard
+        self.results = results
+        self.seq = 0
+
+    def resend(self):
+        # A restarted worker first re-sends what is already on disk; the
+        # coordinator drops the sequence numbers it has already merged.
+        for batch in self.read_batches():
+            self.results.put(("batch", self.shard, self.seq, batch))
+            self.seq += 1
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        super().write_batch(records)
+        self.results.put(("batch", self.shard, self.seq, records))
+        self.seq += 1
+
+
+def paragraph_data(paragraph) -> Dict[str, Any]:
+    # Columnar storage hands out Row views rather than dataclasses.
+    if not is_dataclass(paragraph):
+        paragraph = paragraph.to_object()
+    return asdict(paragraph)
+
+
+def shard_journal_dir(journal_dir: str, shard: int) -> str:
+    return os.path.join(journal_dir, "shards", f"shard-{shard:03d}")
+
+
+def create_worker_backend(shard: int, devices: Optional[str], engine: str) -> InferenceBackend:
+    if engine == "vllm":
+        llm = create_backend(
+            engine,
+            model=MODEL,
+            tensor_parallel_size=len(devices.split(",")) if devices else 1,
+            seed=SEED,
+            enable_prefix_caching=ENABLE_PREFIX_CACHING,
+        )
+    else:
+        llm = create_backend(engine)
+    if COMPLETION_CACHE_PATH:
+        # Shards are fixed per paragraph, so a per-shard cache loses no hits
+        # and avoids SQLite write contention between workers.
+        root, ext = os.path.splitext(COMPLETION_CACHE_PATH)
+        llm = CachedBackend(
+            llm, CompletionCache(f"{root}-shard{shard:03d}{ext}", COMPLETION_CACHE_MAX_BYTES)
+        )
+    return llm
+
+
+def _shard_worker(
+    shard: int,
+    paragraphs: List[Dict[str, Any]],
+    journal_dir: str,
+    devices: Optional[str],
+    engine: str,
+    batch_size: int,
+    results,
+):
+    logging.basicConfig(level=LOGGING_LEVEL, format=f"[shard {shard}] %(message)s")
+    if devices:
+        os.environ["CUDA_VISIBLE_DEVICES"] = devices
+
+    # Workers share the JSON lines file (events carry the shard label) but
+    # each gets its own Prometheus file and no HTTP endpoint.
+    metrics.labels = {"shard": shard}
+    prometheus_path = None
+    if METRICS_PROMETHEUS_PATH:
+        root, ext = os.path.splitext(METRICS_PROMETHEUS_PATH)
+        prometheus_path = f"{root}-shard{shard:03d}{ext}"
+    metrics.sinks = create_metrics_sinks(METRICS_JSONL_PATH, prometheus_path, None)
+
+    dataset.ids = IdAllocator(RangeIdReserver(shard + 1), on_reserve=dataset.log_id_block)
+    journal = StreamingJournal(journal_dir, shard, results)
+    journal.resend()
+    if journal.seq:
+        replay_journal(journal, dataset)
+    dataset.journal = journal
+    if not dataset.paragraphs:
+        load_paragraphs([Paragraph(**p) for p in paragraphs], overwrite=False)
+
+    llm = create_worker_backend(shard, devices, engine)
+    stages = build_pipeline_stages(batch_size)
+    tokenizer = create_tokenizer(engine=engine)
+    paragraph_contexts.tokenizer = tokenizer.encode if tokenizer is not None else None
+    times = run_pipeline(stages, llm, 4 * batch_size, progress=False, tokenizer=tokenizer)
+    logging.info(f"Shard finished in {times}")
+    log_metrics_summary(metrics)
+    log_retry_summary()
+    log_dedup_summary()
+    metrics.close()
+    if isinstance(llm, CachedBackend):
+        llm.cache.close()
+    journal.close()
+    results.put(("done", shard, journal.seq))
+
+
+class ShardMerger:
+    """Applies shard journal batches to the coordinator's dataset.
+
+    Workers mint ids from ranges of their own (see RangeIdReserver), so
+    generated entities keep their shard ids; one that is already taken,
+    e.g. by a journal from another layout, is renumbered and the mapping
+    kept per shard. Authors are matched on their hash so every shard
+    shares one author per template. Paragraphs keep their ids and are
+    already loaded on the coordinator.
+    """
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        self.maps: Dict[int, Dict[str, Dict[int, int]]] = {}
+
+    def _new_id(self, kind: str) -> int:
+        return self.dataset.ids.allocate(kind)
+
+    def _entity_id(self, kind: str, shard_id: int) -> int:
+        if getattr(self.dataset, f"{kind}_dict").get(shard_id) is None:
+            return shard_id
+        return self._new_id(kind)
+
+    def remap(self, shard: int, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        ids = self.maps.setdefault(shard, {"author": {}, "question": {}, "answer": {}, "rating": {}})
+        record_type = record["type"]
+        if record_type in ("paragraph", "id_block", "retry"):
+            # Workers reserve ids in their own ranges, and only the worker
+            # retrying an item needs its attempt count.
+            return None
+        if record_type == "author":
+            data = record["data"]
+            existing = self.dataset.get_author_by_hash(
+                Author.generate_hash(data["model"], data["prompt"])
+            )
+            if existing:
+                ids["author"][data["id"]] = existing.id
+                return None
+            ids["author"][data["id"]] = self._new_id("author")
+            return {**record, "data": {**data, "id": ids["author"][data["id"]]}}
+        if record_type in ("question", "answer", "rating"):
+            data = dict(record["data"])
+            data["author_id"] = ids["author"].get(data["author_id"], data["author_id"])
+            if data.get("duplicate_of") is not None:
+                data["duplicate_of"] = ids["question"][data["duplicate_of"]]
+            if record_type == "answer":
+                data["question_id"] = ids["question"][data["question_id"]]
+            elif record_type == "rating":
+                data["answer_id"] = ids["answer"][data["answer_id"]]
+            new_id = self._entity_id(record_type, data["id"])
+            ids[record_type][data["id"]] = new_id
+            data["id"] = new_id
+            return {**record, "data": data}
+        if record_type == "questions_filtered":
+            return {
+                **record,
+                "verdicts": [
+                    [ids["question"][v[0]], *v[1:]] for v in record["verdicts"]
+                ],
+            }
+        if record_type == "questions_duplicate":
+            return {
+                **record,
+                "pairs": [[ids["question"][i], ids["question"][j]] for i, j in record["pairs"]],
+            }
+        if record_type == "questions_processed":
+            return {**record, "ids": [ids["question"][i] for i in record["ids"]]}
+        if record_type == "answers_processed":
+            return {**record, "ids": [ids["answer"][i] for i in record["ids"]]}
+        if record_type == "dead_letter":
+            if record["kind"] == "paragraph":
+                return record
+            return {**record, "id": ids[record["kind"]][record["id"]]}
+        if record_type == "rating_rationales":
+            return {
+                **record,
+                "rationales": [[ids["rating"][i], text] for i, text in record["rationales"]],
+            }
+        return record
+
+    def apply(self, shard: int, records: List[Dict[str, Any]]) -> int:
+        """Merges one batch; returns how many paragraphs it completed."""
+        completed = 0
+        # Shard journals are the record of merged work, so the merge itself
+        # is not journaled on the coordinator.
+        previous_journal, self.dataset.journal = self.dataset.journal, None
+        try:
+            for record in records:
+                merged = self.remap(shard, record)
+                if merged is None:
+                    continue
+                apply_record(self.dataset, merged)
+                if merged["type"] == "paragraphs_processed":
+                    completed += len(merged["ids"])
+        finally:
+            self.dataset.journal = previous_journal
+        return completed
+
+
+def run_sharded(
+    paragraphs: List[Paragraph],
+    journal_dir: str,
+    batch_size: int,
+    devices: List[Optional[str]] = SHARD_DEVICES,
+    engine: str = ENGINE,
+    max_restarts: int = SHARD_MAX_RESTARTS,
+) -> Dict[str, Any]:
+    """Runs the pipeline on len(devices) worker processes, one engine each.
+
+    Paragraphs that passed screening are dealt round-robin to the shards,
+    so a resumed run assigns them identically and every worker picks up
+    its own journal.
+    A worker that dies is restarted from its journal, up to max_restarts
+    times per shard.
+    """
+    context = mp.get_context("spawn")
+    results = context.Queue()
+    num_shards = len(devices)
+    paragraphs = [p for p in paragraphs if p.skip_reason is None]
+    shards = [[paragraph_data(p) for p in paragraphs[i::num_shards]] for i in range(num_shards)]
+
+    def start(shard: int):
+        process = context.Process(
+            target=_shard_worker,
+            args=(
+                shard,
+                shards[shard],
+                shard_journal_dir(journal_dir, shard),
+                devices[shard],
+                engine,
+                batch_size,
+                results,
+            ),
+            name=f"askme-shard-{shard}",
+        )
+        process.start()
+        return process
+
+    merger = ShardMerger(dataset)
+    processes = {shard: start(shard) for shard in range(num_shards)}
+    applied = [0] * num_shards
+    restarts = [0] * num_shards
+    done = set()
+    bars = [
+        tqdm(desc=f"Shard {shard} paragraphs", total=len(shards[shard]), position=shard)
+        for shard in range(num_shards)
+    ]
+    start_time = time.time()
+
+    while len(done) < num_shards:
+        try:
+            message = results.get(timeout=1.0)
+        except queue.Empty:
+            for shard, process in processes.items():
+                # A clean exit means its "done" message is still in flight.
+                if shard in done or process.is_alive() or process.exitcode == 0:
+                    continue
+                restarts[shard] += 1
+                if restarts[shard] > max_restarts:
+                    raise RuntimeError(
+                        f"Shard {shard} failed {restarts[shard]} times (exit code {process.exitcode})"
+                    )
+                logging.warning(
+                    f"Shard {shard} exited with code {process.exitcode}; restarting "
+                    f"({restarts[shard]}/{max_restarts})"
+                )
+                processes[shard] = start(shard)
+            continue
+
+        kind, shard, *payload = message
+        if kind == "batch":
+            seq, records = payload
+            if seq < applied[shard]:
+                continue
+            bars[shard].update(merger.apply(shard, records))
+            applied[shard] += 1
+        elif kind == "done":
+            done.add(shard)
+            processes[shard].join()
+
+    for bar in bars:
+        bar.close()
+    return {
+        "total_time": time.time() - start_time,
+        "batches": applied,
+        "restarts": restarts,
+    }
+
+
+def process_all_paragraphs_sharded(batch_size, journal_dir: str, devices=SHARD_DEVICES):
+    logging.info(f"Starting sharded generation on {len(devices)} workers")
+    stats = run_sharded(dataset.paragraphs, journal_dir, batch_size, devices)
+    logging.info(f"Process completed in {stats}")
+
+    export_dataset(dataset, OUTPUT_PATH, OUTPUT_FORMAT)
+
+    return stats
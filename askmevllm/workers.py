@@ -0,0 +1,86 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from askmevllm.config import CPU_WORKERS, TOKENIZE_CHUNK_SIZE
+from askmevllm.engine import (
+    GenerationRequest,
+    InferenceBackend,
+    RequestOutput,
+    Tokenizer,
+    generate_requests,
+)
+
+
+class PrepWorkers:
+    """Thread pool tokenizing prompts ahead of the engine call.
+
+    Threads rather than processes: requests are tokenized in place, and
+    fast tokenizers release the GIL while encoding. Building requests and
+    parsing outputs stay on the calling thread since both touch the shared
+    dataset.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Optional[Tokenizer],
+        max_workers: int = CPU_WORKERS,
+        chunk_size: int = TOKENIZE_CHUNK_SIZE,
+    ):
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.pool = (
+            ThreadPoolExecutor(max_workers, thread_name_prefix="askme-prep")
+            if tokenizer is not None and max_workers > 1
+            else None
+        )
+
+    def _encode(self, requests: List[GenerationRequest]):
+        for request in requests:
+            request.prompt_token_ids = self.tokenizer.encode(request.prompt)
+
+    def tokenize(self, requests: List[GenerationRequest]):
+        """Fills in prompt_token_ids of the requests that lack them."""
+        if self.tokenizer is None:
+            return
+        todo = [r for r in requests if r.prompt_token_ids is None]
+        if self.pool is None or len(todo) <= self.chunk_size:
+            self._encode(todo)
+            return
+        chunks = [todo[i : i + self.chunk_size] for i in range(0, len(todo), self.chunk_size)]
+        for _ in self.pool.map(self._encode, chunks):
+            pass
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class EngineWorker:
+    """Runs engine calls on a background thread so the caller can prepare
+    the next batch and parse the previous one while the engine generates."""
+
+    def __init__(self, llm: InferenceBackend):
+        self.llm = llm
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix="askme-engine")
+
+    def _generate(
+        self, requests: List[GenerationRequest]
+    ) -> Tuple[Optional[List[RequestOutput]], float]:
+        start = time.perf_counter()
+        try:
+            outputs = generate_requests(self.llm, requests)
+        except Exception as e:
+            logging.error(f"Engine call for {len(requests)} requests failed: {e}")
+            outputs = None
+        return outputs, time.perf_counter() - start
+
+    def submit(
+        self, requests: List[GenerationRequest]
+    ) -> "Future[Tuple[Optional[List[RequestOutput]], float]]":
+        """Future of the outputs (None when the call raised) and its seconds."""
+        return self.pool.submit(self._generate, requests)
+
+    def close(self):
+        self.pool.shutdown()
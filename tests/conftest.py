@@ -0,0 +1,53 @@
+import importlib
+import pkgutil
+import sys
+
+import pytest
+
+import askmevllm
+from askmevllm import dedup, models
+from askmevllm.dataset import common
+
+# Import every module up front so the fixtures below can find each one that
+# holds a reference to the process-wide singletons.
+for _module in pkgutil.walk_packages(askmevllm.__path__, "askmevllm."):
+    importlib.import_module(_module.name)
+
+
+def _patch_global(monkeypatch, name: str, original, replacement):
+    for module in list(sys.modules.values()):
+        if module is None or not module.__name__.startswith("askmevllm"):
+            continue
+        if getattr(module, name, None) is original:
+            monkeypatch.setattr(module, name, replacement)
+
+
+def _fresh_dataset(monkeypatch, storage: str) -> models.Dataset:
+    fresh = models.create_dataset(storage)
+    _patch_global(monkeypatch, "dataset", models.dataset, fresh)
+    _patch_global(monkeypatch, "paragraph_contexts", common.paragraph_contexts, common.ParagraphContextCache())
+    _patch_global(
+        monkeypatch,
+        "question_deduplicator",
+        dedup.question_deduplicator,
+        dedup.QuestionDeduplicator(dedup.question_deduplicator.scope),
+    )
+    return fresh
+
+
+@pytest.fixture(params=["objects", "columnar"])
+def fresh_dataset(request, monkeypatch) -> models.Dataset:
+    """An empty dataset in place of askmevllm.models.dataset, once per
+    storage backend."""
+    return _fresh_dataset(monkeypatch, request.param)
+
+
+@pytest.fixture
+def object_dataset(monkeypatch) -> models.Dataset:
+    return _fresh_dataset(monkeypatch, "objects")
+
+
+@pytest.fixture
+def use_dataset(monkeypatch):
+    """Installs another empty dataset, e.g. to resume into after a run."""
+    return lambda storage="objects": _fresh_dataset(monkeypatch, storage)
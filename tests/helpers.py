@@ -0,0 +1,46 @@
+import math
+from typing import Dict, Optional
+
+from askmevllm.engine import CompletionOutput, RequestOutput
+from askmevllm.models import Dataset, Paragraph, Question
+
+PARAGRAPH_TEXT = (
+    "The Eiffel Tower is a wrought-iron lattice tower on the Champ de Mars in "
+    "Paris, France. It is named after the engineer Gustave Eiffel, whose "
+    "company designed and built the tower from 1887 to 1889."
+)
+
+
+def make_paragraph(paragraph_id: int = 1, page_name: str = "Eiffel Tower", **kwargs) -> Paragraph:
+    values = dict(
+        id=paragraph_id,
+        page_name=page_name,
+        section_name="History",
+        text=PARAGRAPH_TEXT,
+        text_cleaned=PARAGRAPH_TEXT,
+        word_count=len(PARAGRAPH_TEXT.split()),
+    )
+    values.update(kwargs)
+    return Paragraph(**values)
+
+
+def make_question(dataset: Dataset, paragraph_id: int, text: str, **kwargs) -> Question:
+    values = dict(
+        id=dataset.ids.allocate("question"),
+        paragraph_id=paragraph_id,
+        scope="single-paragraph",
+        context="",
+        text=text,
+        author_id=1,
+        timestamp="2024-01-01 00:00:00",
+    )
+    values.update(kwargs)
+    return Question(**values)
+
+
+def output(text: str = "", logprobs: Optional[Dict[str, float]] = None) -> RequestOutput:
+    """A one-step completion; `logprobs` maps tokens to probabilities."""
+    step = None
+    if logprobs is not None:
+        step = [{token: math.log(p) for token, p in logprobs.items()}]
+    return RequestOutput(prompt="", outputs=[CompletionOutput(text=text, logprobs=step)])
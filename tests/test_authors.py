@@ -0,0 +1,24 @@
+from askmevllm.helpers import create_author_if_not_exists, create_template_author
+from askmevllm.journal import Journal, replay_journal
+from askmevllm.models import create_dataset
+
+
+def test_one_author_per_model_and_template(fresh_dataset):
+    first = create_template_author("Question about {PARAGRAPH}", {"PARAGRAPH": "the tower"}, "m")
+    again = create_template_author("Question about {PARAGRAPH}", {"PARAGRAPH": "the bridge"}, "m")
+    other_model = create_author_if_not_exists("Question about {PARAGRAPH}", "n")
+    other_prompt = create_author_if_not_exists("Answer about {PARAGRAPH}", "m")
+
+    assert first == again
+    assert len({first, other_model, other_prompt}) == 3
+    assert len(fresh_dataset.authors) == 3
+
+
+def test_replayed_authors_are_found_by_hash(object_dataset, tmp_path):
+    object_dataset.journal = Journal(str(tmp_path), fsync=False)
+    author_id = create_author_if_not_exists("Question about {PARAGRAPH}", "m")
+    object_dataset.commit_journal()
+    object_dataset.journal.close()
+
+    replayed = replay_journal(Journal(str(tmp_path)), create_dataset("objects"))
+    assert replayed.get_author_by_hash(object_dataset.authors[0].hash).id == author_id
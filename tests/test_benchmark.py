@@ -0,0 +1,23 @@
+import pandas as pd
+
+from askmevllm.benchmark import run_scale, synthetic_corpus
+
+
+def test_synthetic_corpus_is_reproducible(tmp_path):
+    first = pd.read_csv(synthetic_corpus(str(tmp_path / "a"), 50, seed=7))
+    again = pd.read_csv(synthetic_corpus(str(tmp_path / "b"), 50, seed=7))
+
+    assert len(first) == 50
+    assert first.equals(again)
+    assert first["page_name"].nunique() < 50
+
+
+def test_run_scale_records_every_phase(object_dataset, tmp_path):
+    records = run_scale(60, str(tmp_path), stage_paragraphs=6, batch_size=4)
+
+    phases = {r["phase"] for r in records}
+    assert {"load_csv_data_all", "load_csv_data_rand_n", "stages", "flatten_dataset", "export_dataset"} <= phases
+    assert {"stage_1", "stage_4"} <= phases
+    assert all(r["scale"] == 60 and r["seconds"] >= 0 for r in records)
+    assert len(object_dataset.paragraphs) == 6
+    assert object_dataset.ratings
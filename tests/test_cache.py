@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+from askmevllm.async_engine import BatchingAsyncBackend
+from askmevllm.cache import CachedBackend, CompletionCache
+from askmevllm.engine import FakeBackend, SamplingParams
+
+
+def test_cache_serves_repeats_and_keys_on_sampling_params(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"))
+    llm = CachedBackend(FakeBackend(), cache)
+    prompts = [f"Rate the following answer {i}" for i in range(4)]
+    greedy = SamplingParams(max_tokens=20)
+
+    first = llm.generate(prompts, greedy)
+    again = llm.generate(prompts, greedy)
+    sampled = llm.generate(prompts[:1], SamplingParams(max_tokens=20, temperature=0.7, seed=1))
+
+    assert [o.outputs[0].text for o in again] == [o.outputs[0].text for o in first]
+    stats = cache.stats()
+    assert stats["hits"] == 4
+    assert stats["misses"] == 5
+    assert sampled[0].prompt == prompts[0]
+    cache.close()
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    params = SamplingParams(max_tokens=20)
+    cache = CompletionCache(path)
+    CachedBackend(FakeBackend(), cache).generate(["What is the Eiffel Tower?"], params)
+    cache.close()
+
+    reopened = CompletionCache(path)
+    CachedBackend(FakeBackend(), reopened).generate(["What is the Eiffel Tower?"], params)
+    assert reopened.stats()["hits"] == 1
+    reopened.close()
+
+
+def test_async_lookups_run_off_the_event_loop(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"))
+    llm = CachedBackend(BatchingAsyncBackend(FakeBackend()), cache)
+    params = SamplingParams(max_tokens=20)
+    threads = []
+    get_many = cache.get_many
+
+    def recording_get_many(keys):
+        threads.append(threading.current_thread())
+        return get_many(keys)
+
+    monkeypatch.setattr(cache, "get_many", recording_get_many)
+
+    async def run():
+        first = await llm.generate_one("What is the Eiffel Tower?", params)
+        again = await llm.generate_one("What is the Eiffel Tower?", params)
+        return first, again, threading.current_thread()
+
+    first, again, loop_thread = asyncio.run(run())
+    assert again.outputs[0].text == first.outputs[0].text
+    assert cache.stats()["hits"] == 1
+    assert threads and loop_thread not in threads
+    cache.close()
@@ -0,0 +1,67 @@
+import pytest
+
+from askmevllm.classify import score_labels
+from askmevllm.config import MODEL
+from askmevllm.dataset.questions import (
+    ANSWERABLE_LABEL_ALIASES,
+    ANSWERABLE_LABELS,
+    score_answerable_outputs,
+)
+from askmevllm.dataset.ratings import RATING_LABELS
+
+from helpers import output
+
+# First-step tokens as Llama 3 reports them: decoded text, as vLLM returns
+# it, and the raw byte-level BPE strings of the same vocabulary entries.
+LLAMA3_YES = ["Y", " Y", "Yes", " Yes", "YES", " YES", "ĠY", "ĠYes", "ĠYES"]
+LLAMA3_NO = ["N", " N", "No", " No", "NO", " NO", "ĠN", "ĠNo", "ĠNO"]
+
+
+@pytest.mark.parametrize("token,label", [(t, "Y") for t in LLAMA3_YES] + [(t, "N") for t in LLAMA3_NO])
+def test_answerable_label_variants(token, label):
+    score = score_labels(
+        output(logprobs={token: 0.8, "The": 0.2}), ANSWERABLE_LABELS, ANSWERABLE_LABEL_ALIASES
+    )
+    assert score.label == label
+    assert score.confidence == pytest.approx(1.0)
+
+
+def test_label_variants_are_pooled_and_renormalized():
+    step = {"Y": 0.3, " Yes": 0.2, "N": 0.25, "Sure": 0.25}
+    assert score_answerable_outputs([output(logprobs=step)]) == [pytest.approx(2 / 3)]
+
+
+@pytest.mark.parametrize("token", ["3", " 3", "Ġ3", "▁3"])
+def test_rating_digit_variants(token):
+    score = score_labels(output(logprobs={token: 0.6, "4": 0.3, "<token 3>": 0.1}), RATING_LABELS)
+    assert score.label == "3"
+    assert score.probabilities["4"] == pytest.approx(1 / 3)
+
+
+def test_undecoded_tokens_carry_no_label():
+    assert score_labels(output(logprobs={"<token 3>": 1.0}), RATING_LABELS).label is None
+
+
+def test_text_decides_without_logprobs():
+    assert score_labels(output(" Yes"), ANSWERABLE_LABELS, ANSWERABLE_LABEL_ALIASES).label == "Y"
+
+
+def _first_tokens(tokenizer, text):
+    token_id = tokenizer.encode(text, add_special_tokens=False)[0]
+    return [tokenizer.decode([token_id]), tokenizer.convert_ids_to_tokens(token_id)]
+
+
+def test_real_tokenizer_label_tokens():
+    transformers = pytest.importorskip("transformers")
+    try:
+        tokenizer = transformers.AutoTokenizer.from_pretrained(MODEL, local_files_only=True)
+    except OSError:
+        pytest.skip(f"{MODEL} tokenizer is not available locally")
+
+    for text, label in [("Y", "Y"), (" Yes", "Y"), ("YES", "Y"), ("N", "N"), (" No", "N"), ("NO", "N")]:
+        for token in _first_tokens(tokenizer, text):
+            score = score_labels(output(logprobs={token: 1.0}), ANSWERABLE_LABELS, ANSWERABLE_LABEL_ALIASES)
+            assert score.label == label, token
+    for digit in RATING_LABELS:
+        for token in _first_tokens(tokenizer, digit):
+            assert score_labels(output(logprobs={token: 1.0}), RATING_LABELS).label == digit
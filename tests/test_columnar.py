@@ -0,0 +1,84 @@
+from dataclasses import asdict
+
+from askmevllm.engine import FakeBackend
+from askmevllm.main import run_stages_s2s
+from askmevllm.models import Answer, Rating, flatten_dataset
+from askmevllm.scheduler import make_batchers
+
+from helpers import make_paragraph, make_question
+
+
+def _records(entities):
+    # timestamps differ between two runs of the same work
+    records = []
+    for entity in entities:
+        if not hasattr(entity, "__dataclass_fields__"):
+            entity = entity.to_object()
+        record = asdict(entity)
+        record.pop("timestamp", None)
+        records.append(record)
+    return sorted(records, key=lambda record: record["id"])
+
+
+def _snapshot(dataset):
+    flat = flatten_dataset(dataset)
+    return {
+        "paragraphs": _records(dataset.paragraphs),
+        "authors": _records(dataset.authors),
+        "questions": _records(dataset.questions),
+        "answers": _records(dataset.answers),
+        "ratings": _records(dataset.ratings),
+        "flat": flat.drop(columns=[c for c in flat.columns if "timestamp" in c]),
+    }
+
+
+def test_rows_round_trip_optional_fields(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph(1, subsection_name=None, skip_reason="too_short")])
+    question = make_question(fresh_dataset, 1, "Who built it?", answerable_ic_confidence=0.25)
+    fresh_dataset.add_questions([question])
+    fresh_dataset.add_answers(
+        [Answer(id=1, question_id=question.id, author_id=1, setting="ic", timestamp="t", text="Eiffel")]
+    )
+    fresh_dataset.add_ratings(
+        [Rating(id=1, text=None, value=4, answer_id=1, author_id=1, timestamp="t", confidence=0.5)]
+    )
+
+    assert _records(fresh_dataset.paragraphs) == _records([make_paragraph(1, skip_reason="too_short")])
+    assert _records(fresh_dataset.questions) == _records([question])
+    stored = fresh_dataset.question_dict[question.id]
+    assert stored.answerable_zs_confidence is None
+    assert stored.duplicate_of is None
+    assert fresh_dataset.rating_dict[1].text is None
+    assert fresh_dataset.rating_dict[1].confidence == 0.5
+    assert not fresh_dataset.pending_paragraphs.pop_batch(1)
+    assert [r.id for r in fresh_dataset.pending_rationale.pop_batch(2)] == [1]
+
+
+def test_updates_through_a_view_are_stored(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph(1)])
+    fresh_dataset.add_questions([make_question(fresh_dataset, 1, f"Question {i}?") for i in range(3)])
+
+    for question in fresh_dataset.pending_filter.pop_batch(2):
+        question.filtered = True
+        question.answerable_ic_confidence = 0.75
+
+    stored = fresh_dataset.get_questions_for_paragraph(1)
+    assert [q.filtered for q in stored] == [True, True, False]
+    assert [q.answerable_ic_confidence for q in stored] == [0.75, 0.75, None]
+    assert [q.id for q in fresh_dataset.pending_filter.pop_batch(3)] == [3]
+
+
+def _run(dataset):
+    dataset.add_paragraphs([make_paragraph(i, page_name=f"Page {i}") for i in range(1, 4)])
+    run_stages_s2s(make_batchers(2), FakeBackend())
+    return _snapshot(dataset)
+
+
+def test_both_storages_produce_the_same_run(use_dataset):
+    objects = _run(use_dataset("objects"))
+    columnar = _run(use_dataset("columnar"))
+
+    assert objects["ratings"]
+    for kind in ("paragraphs", "authors", "questions", "answers", "ratings"):
+        assert columnar[kind] == objects[kind], kind
+    assert columnar["flat"].equals(objects["flat"])
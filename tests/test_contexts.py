@@ -0,0 +1,41 @@
+from askmevllm.dataset.common import ParagraphContextCache
+
+from helpers import make_paragraph
+
+
+def test_contexts_are_rendered_once_and_rerendered_on_change():
+    cache = ParagraphContextCache()
+    paragraph = make_paragraph(1)
+
+    entry = cache.get(paragraph)
+    assert cache.get(paragraph) is entry
+    paragraph.text_cleaned = "The tower is 330 metres tall."
+    changed = cache.get(paragraph)
+
+    assert changed is not entry
+    assert "330 metres" in changed.fact
+    assert (cache.hits, cache.misses, cache.invalidations) == (1, 2, 1)
+
+
+def test_least_recently_used_paragraph_is_evicted():
+    cache = ParagraphContextCache(max_paragraphs=2)
+    paragraphs = [make_paragraph(i) for i in range(1, 4)]
+    cache.get(paragraphs[0])
+    cache.get(paragraphs[1])
+    cache.get(paragraphs[0])
+    cache.get(paragraphs[2])
+
+    assert list(cache.entries) == [1, 3]
+
+
+def test_fact_token_ids_are_cached_with_a_tokenizer():
+    calls = []
+
+    def tokenizer(text):
+        calls.append(text)
+        return text.split()
+
+    cache = ParagraphContextCache(tokenizer=tokenizer)
+    paragraph = make_paragraph(1)
+    assert cache.fact_tokens(paragraph) == cache.fact_tokens(paragraph) > 0
+    assert len(calls) == 1
@@ -0,0 +1,78 @@
+import numpy as np
+
+from askmevllm.dedup import QuestionDeduplicator, jaccard, shingle_hashes
+from askmevllm.journal import Journal, replay_journal
+from askmevllm.models import create_dataset
+
+from helpers import make_paragraph, make_question
+
+QUESTIONS = [
+    "When was the Eiffel Tower built?",
+    "When was the Eiffel Tower built ?",
+    "Who designed the Eiffel Tower?",
+]
+
+
+def _add_questions(dataset, paragraph_id, texts):
+    questions = [make_question(dataset, paragraph_id, text) for text in texts]
+    dataset.add_questions(questions)
+    return questions
+
+
+def test_shingles_tell_near_duplicates_from_different_questions():
+    same = jaccard(shingle_hashes(QUESTIONS[0]), shingle_hashes(QUESTIONS[1]))
+    other = jaccard(
+        shingle_hashes("When was the Eiffel Tower built?"),
+        shingle_hashes("When was the Eiffel Tower last painted?"),
+    )
+    assert same == 1.0
+    assert other < 0.85
+    assert np.all(np.diff(shingle_hashes(QUESTIONS[2]).astype(np.int64)) > 0)
+
+
+def test_duplicates_are_marked_on_stored_questions(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph()])
+    questions = _add_questions(fresh_dataset, 1, QUESTIONS)
+
+    canonical = QuestionDeduplicator("page").deduplicate(questions)
+
+    assert [q.id for q in canonical] == [questions[0].id, questions[2].id]
+    duplicate = fresh_dataset.question_dict[questions[1].id]
+    assert duplicate.duplicate_of == questions[0].id
+    assert duplicate.filtered and duplicate.processed
+    assert [q.id for q in fresh_dataset.pending_filter.pop_batch(8)] == [
+        questions[0].id,
+        questions[2].id,
+    ]
+
+
+def test_page_scope_only_compares_questions_about_the_same_page(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph(1), make_paragraph(2, page_name="Paris")])
+    deduplicator = QuestionDeduplicator("page")
+    deduplicator.deduplicate(_add_questions(fresh_dataset, 1, QUESTIONS[:1]))
+    second = _add_questions(fresh_dataset, 2, QUESTIONS[1:2])
+    assert deduplicator.deduplicate(second) != []
+    assert QuestionDeduplicator("global").deduplicate(second) == []
+
+
+def test_replayed_journal_keeps_duplicate_links(fresh_dataset, tmp_path):
+    fresh_dataset.journal = Journal(str(tmp_path), fsync=False)
+    paragraph = make_paragraph()
+    fresh_dataset.add_paragraphs([paragraph])
+    fresh_dataset.commit_journal()
+    questions = _add_questions(fresh_dataset, 1, QUESTIONS)
+    QuestionDeduplicator("page").deduplicate(questions)
+    fresh_dataset.mark_paragraphs_processed(fresh_dataset.pending_paragraphs.pop_batch(1))
+    fresh_dataset.journal.close()
+
+    storage = "columnar" if type(fresh_dataset).__name__ == "ColumnarDataset" else "objects"
+    replayed = replay_journal(Journal(str(tmp_path)), create_dataset(storage))
+
+    def links(dataset):
+        return [(q.id, q.duplicate_of, q.filtered) for q in dataset.questions]
+
+    assert links(replayed) == links(fresh_dataset)
+    assert [q.id for q in replayed.pending_filter.pop_batch(8)] == [
+        questions[0].id,
+        questions[2].id,
+    ]
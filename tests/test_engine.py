@@ -0,0 +1,97 @@
+import sys
+from types import SimpleNamespace
+
+from askmevllm.dataset.questions import build_filter_requests
+from askmevllm.engine import (
+    FakeBackend,
+    GenerationRequest,
+    SamplingParams,
+    VLLMBackend,
+    generate_requests,
+    group_order,
+    retry_sampling_params,
+)
+
+from helpers import make_paragraph, make_question
+
+
+def test_fake_backend_follows_its_rules():
+    llm = FakeBackend(rules=[(r"capital of (\w+)", "The capital of {0} is somewhere. More text")])
+    params = SamplingParams(max_tokens=20, stop=[" More"])
+
+    [matched, unmatched] = llm.generate(["What is the capital of France?", "Hello"], params)
+
+    assert matched.outputs[0].text == "The capital of France is somewhere."
+    assert matched.outputs[0].finish_reason == "stop"
+    assert unmatched.outputs[0].text == ""
+
+
+def test_fake_backend_truncates_at_max_tokens_and_is_deterministic():
+    llm = FakeBackend(rules=[(r".", lambda match, prompt, params, rng: f"{rng.random()} one two three four")])
+    short = SamplingParams(max_tokens=2, temperature=0.7, seed=1)
+
+    first = llm.generate(["prompt"], short)[0].outputs[0]
+    assert first.finish_reason == "length"
+    assert len(first.token_ids) == 2
+    assert llm.generate(["prompt"], short)[0].outputs[0].text == first.text
+    reseeded = retry_sampling_params(short, 1)
+    assert llm.generate(["prompt"], reseeded)[0].outputs[0].text != first.text
+
+
+def test_requests_are_grouped_but_outputs_keep_request_order():
+    groups = [1, 2, None, 1, 2]
+    requests = [
+        GenerationRequest(f"prompt {i}", SamplingParams(), key=i, group=group)
+        for i, group in enumerate(groups)
+    ]
+    seen = []
+
+    class Recording(FakeBackend):
+        def generate(self, prompts, sampling_params, prompt_token_ids=None):
+            seen.extend(prompts)
+            return super().generate(prompts, sampling_params, prompt_token_ids)
+
+    outputs = generate_requests(Recording(), requests, group_by_prefix=True)
+
+    assert group_order(requests) == [0, 3, 1, 4, 2]
+    assert seen == [f"prompt {i}" for i in (0, 3, 1, 4, 2)]
+    assert [o.prompt for o in outputs] == [r.prompt for r in requests]
+
+
+class _VLLMSamplingParams:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _VLLMOutputs:
+    def generate(self, inputs, params, use_tqdm=False):
+        completion = SimpleNamespace(text='{"text": "Y"}', token_ids=[1], logprobs=None, finish_reason="stop")
+        return [SimpleNamespace(prompt=p, prompt_token_ids=[1], outputs=[completion]) for p in inputs]
+
+
+def test_fused_filter_batch_builds_one_guided_processor(object_dataset, monkeypatch):
+    monkeypatch.setitem(sys.modules, "vllm", SimpleNamespace(SamplingParams=_VLLMSamplingParams))
+    object_dataset.add_paragraphs([make_paragraph(1)])
+    questions = [make_question(object_dataset, 1, f"Question {i}?") for i in range(4)]
+    object_dataset.add_questions(questions)
+    # a retried question gets params of its own
+    object_dataset.retries.attempts["stage_2"][questions[0].id] = 1
+
+    backend = VLLMBackend(_VLLMOutputs(), model="m")
+    built, conversions = [], []
+    to_vllm_params = backend.to_vllm_params
+
+    def count_conversions(params, processors=None):
+        conversions.append(params)
+        return to_vllm_params(params, processors)
+
+    monkeypatch.setattr(backend, "to_vllm_params", count_conversions)
+    monkeypatch.setattr(backend, "_json_logits_processor", lambda schema, vocabulary: built.append(schema) or object())
+
+    requests = build_filter_requests(questions)
+    outputs = generate_requests(backend, requests)
+
+    assert len(outputs) == 8
+    # first attempts and the retry share a params object per attempt
+    assert len(conversions) == 2
+    assert len(built) == 1
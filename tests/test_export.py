@@ -0,0 +1,63 @@
+import pandas as pd
+
+from askmevllm.export import export_dataset, iter_flattened_chunks
+from askmevllm.models import Answer, Rating, flatten_dataset
+
+from helpers import make_paragraph, make_question
+
+
+def _populate(dataset):
+    dataset.add_paragraphs([make_paragraph(i, page_name=f"Page {i}") for i in range(1, 4)])
+    # paragraph 1: a question with two rated answers; paragraph 2: an
+    # unanswered question; paragraph 3: nothing generated
+    answered = make_question(dataset, 1, "Who built it?")
+    dataset.add_questions([answered, make_question(dataset, 2, "How tall is it?")])
+    dataset.add_answers(
+        [
+            Answer(id=i, question_id=answered.id, author_id=1, setting=setting, timestamp="t", text=text)
+            for i, (setting, text) in enumerate([("ic", "Eiffel"), ("zs", "Gustave")], 1)
+        ]
+    )
+    dataset.add_ratings(
+        [Rating(id=i, text="ok", value=i + 2, answer_id=i, author_id=1, timestamp="t") for i in (1, 2)]
+    )
+
+
+def test_flatten_left_joins_every_level(fresh_dataset):
+    _populate(fresh_dataset)
+    flat = flatten_dataset(fresh_dataset)
+
+    assert list(flat["paragraph_id"]) == [1, 1, 2, 3]
+    assert list(flat["answer_text"].fillna("-")) == ["Eiffel", "Gustave", "-", "-"]
+    assert list(flat["rating_value"].fillna(0)) == [3, 4, 0, 0]
+    assert flat["question_text"].isna().tolist() == [False, False, False, True]
+
+
+def test_chunks_concatenate_to_the_whole(fresh_dataset):
+    _populate(fresh_dataset)
+    whole = flatten_dataset(fresh_dataset)
+    for chunk_rows in (1, 3, 100):
+        chunks = list(iter_flattened_chunks(fresh_dataset, chunk_rows))
+        assert all(len(chunk) <= chunk_rows for chunk in chunks)
+        assert pd.concat(chunks, ignore_index=True).equals(whole)
+
+
+def test_empty_dataset_exports_a_header(fresh_dataset, tmp_path):
+    path = str(tmp_path / "out" / "empty.csv")
+    assert export_dataset(fresh_dataset, path) == [path]
+    frame = pd.read_csv(path)
+    assert frame.empty
+    assert "question_text" in frame.columns
+
+
+def test_csv_and_jsonl_exports_hold_every_row(fresh_dataset, tmp_path):
+    _populate(fresh_dataset)
+    csv_path = str(tmp_path / "dataset.csv")
+    export_dataset(fresh_dataset, csv_path, chunk_rows=3)
+    shards = export_dataset(fresh_dataset, str(tmp_path / "jsonl"), "jsonl", chunk_rows=3)
+
+    assert len(shards) == 2
+    from_csv = pd.read_csv(csv_path)
+    from_jsonl = pd.concat([pd.read_json(shard, lines=True) for shard in shards], ignore_index=True)
+    assert list(from_csv["rating_id"].fillna(0)) == [1, 2, 0, 0]
+    assert list(from_jsonl["answer_text"].fillna("-")) == ["Eiffel", "Gustave", "-", "-"]
@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from askmevllm.journal import Journal, replay_journal
+from askmevllm.models import IdAllocator, RangeIdReserver, create_dataset
+
+
+def test_blocks_are_reported_and_unused_ids_skipped():
+    blocks = []
+    ids = IdAllocator(block_size=4, on_reserve=lambda kind, last_id: blocks.append((kind, last_id)))
+
+    assert ids.allocate_many("question", 3) == [1, 2, 3]
+    assert ids.allocate_many("question", 3) == [4, 5, 6]
+    assert ids.allocate("answer") == 1
+    assert blocks == [("question", 4), ("question", 8), ("answer", 4)]
+
+    ids.observe("question", 10)
+    assert ids.allocate("question") == 11
+
+
+def test_threads_never_share_an_id():
+    ids = IdAllocator(block_size=8)
+    with ThreadPoolExecutor(8) as pool:
+        batches = list(pool.map(lambda _: ids.allocate_many("rating", 5), range(64)))
+    minted = [i for batch in batches for i in batch]
+    assert len(set(minted)) == len(minted) == 320
+
+
+def test_resumed_dataset_does_not_reissue_reserved_ids(tmp_path):
+    dataset = create_dataset("objects")
+    dataset.ids.block_size = 16
+    dataset.journal = Journal(str(tmp_path), fsync=False)
+    dataset.ids.allocate_many("question", 3)
+    dataset.commit_journal()
+    dataset.journal.close()
+
+    resumed = replay_journal(Journal(str(tmp_path)), create_dataset("objects"))
+    assert resumed.ids.allocate("question") == 17
+
+
+def test_ranges_keep_processes_apart():
+    first = IdAllocator(RangeIdReserver(1, span=100), block_size=8)
+    second = IdAllocator(RangeIdReserver(2, span=100), block_size=8)
+
+    assert first.allocate_many("question", 3) == [101, 102, 103]
+    assert second.allocate_many("question", 3) == [201, 202, 203]
+    first.observe("question", 150)
+    assert first.allocate("question") == 151
+    with pytest.raises(RuntimeError):
+        first.allocate_many("question", 60)
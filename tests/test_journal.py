@@ -0,0 +1,139 @@
+import sys
+
+import pytest
+
+from askmevllm import main
+from askmevllm.columnar import ColumnarDataset
+from askmevllm.engine import FakeBackend
+from askmevllm.journal import Journal, latest_run_dir, new_run_dir, replay_journal
+from askmevllm.main import run_stages_s2s
+from askmevllm.models import create_dataset, flatten_dataset
+from askmevllm.scheduler import make_batchers
+
+from helpers import make_paragraph
+
+
+def _run(dataset, journal_dir, paragraphs=3):
+    dataset.journal = Journal(str(journal_dir), fsync=False)
+    for i in range(1, paragraphs + 1):
+        dataset.add_paragraph(make_paragraph(i, page_name=f"Page {i}"))
+    dataset.commit_journal()
+    run_stages_s2s(make_batchers(2), FakeBackend())
+    dataset.journal.close()
+
+
+def _entities(dataset):
+    return {
+        "paragraphs": sorted((p.id, p.processed) for p in dataset.paragraphs),
+        "questions": sorted(
+            (q.id, q.paragraph_id, q.text, q.filtered, q.rejected, q.processed, q.duplicate_of)
+            for q in dataset.questions
+        ),
+        "answers": sorted((a.id, a.question_id, a.text, a.processed) for a in dataset.answers),
+        "ratings": sorted((r.id, r.answer_id, r.value, r.text) for r in dataset.ratings),
+    }
+
+
+def _pending(dataset):
+    queues = (
+        dataset.pending_paragraphs,
+        dataset.pending_filter,
+        dataset.pending_answer,
+        dataset.pending_rating,
+        dataset.pending_rationale,
+    )
+    return [len(queue.pop_batch(len(queue))) for queue in queues]
+
+
+def _segment_lines(journal_dir):
+    with open(Journal(str(journal_dir)).segments()[-1], encoding="utf-8") as f:
+        return f.readlines()
+
+
+def _write_segment(journal_dir, lines):
+    with open(Journal(str(journal_dir)).segments()[-1], "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def _replay(journal_dir, storage="objects"):
+    return replay_journal(Journal(str(journal_dir)), create_dataset(storage))
+
+
+def test_replay_rebuilds_a_finished_run(fresh_dataset, tmp_path):
+    _run(fresh_dataset, tmp_path)
+    assert fresh_dataset.ratings
+
+    storage = "columnar" if isinstance(fresh_dataset, ColumnarDataset) else "objects"
+    replayed = _replay(tmp_path, storage)
+
+    assert _entities(replayed) == _entities(fresh_dataset)
+    assert flatten_dataset(replayed).equals(flatten_dataset(fresh_dataset))
+    assert _pending(replayed) == [0, 0, 0, 0, 0]
+
+
+def test_torn_last_batch_is_dropped_as_a_whole(object_dataset, tmp_path):
+    _run(object_dataset, tmp_path)
+    lines = _segment_lines(tmp_path)
+
+    # a crash halfway through writing the final batch
+    _write_segment(tmp_path, lines[:-1] + [lines[-1][: len(lines[-1]) // 2]])
+    torn = _replay(tmp_path)
+    _write_segment(tmp_path, lines[:-1])
+
+    assert _entities(torn) == _entities(_replay(tmp_path))
+    assert sum(_pending(torn)) > 0
+
+
+def test_resumed_run_finishes_the_replayed_work(object_dataset, use_dataset, tmp_path):
+    _run(object_dataset, tmp_path)
+    lines = _segment_lines(tmp_path)
+    first_filter = next(i for i, line in enumerate(lines) if '"questions_filtered"' in line)
+    _write_segment(tmp_path, lines[:first_filter])
+
+    resumed = replay_journal(Journal(str(tmp_path)), use_dataset())
+    assert len(resumed.questions) == len(object_dataset.questions)
+    assert not any(q.filtered for q in resumed.questions)
+
+    run_stages_s2s(make_batchers(2), FakeBackend())
+
+    assert _pending(resumed) == [0, 0, 0, 0, 0]
+    for kind in ("questions", "answers", "ratings"):
+        assert len(getattr(resumed, kind)) == len(getattr(object_dataset, kind))
+    assert sorted(r.value for r in resumed.ratings) == sorted(r.value for r in object_dataset.ratings)
+
+
+def test_each_run_gets_its_own_directory_and_resume_finds_the_latest(tmp_path):
+    base = str(tmp_path)
+    assert latest_run_dir(base) is None
+
+    first = new_run_dir(base)
+    Journal(first, fsync=False).write_batch([{"type": "id_block", "kind": "question", "last_id": 4}])
+    second = new_run_dir(base)
+    Journal(second, fsync=False).write_batch([{"type": "id_block", "kind": "question", "last_id": 8}])
+
+    assert first != second
+    assert latest_run_dir(base) == second
+
+
+def test_journals_from_before_run_directories_are_still_resumed(tmp_path):
+    Journal(str(tmp_path), fsync=False).write_batch([{"type": "id_block", "kind": "answer", "last_id": 4}])
+    assert latest_run_dir(str(tmp_path)) == str(tmp_path)
+
+
+def test_main_refuses_to_append_to_a_used_journal_dir(tmp_path, monkeypatch, capsys):
+    Journal(str(tmp_path), fsync=False).write_batch([{"type": "id_block", "kind": "answer", "last_id": 4}])
+    monkeypatch.setattr(sys, "argv", ["askmevllm", "--journal-dir", str(tmp_path)])
+
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+
+    assert exit_info.value.code == 2
+    assert "pass --resume" in capsys.readouterr().err
+
+
+def test_main_cannot_resume_without_a_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "JOURNAL_DIR", str(tmp_path / "journal"))
+    monkeypatch.setattr(sys, "argv", ["askmevllm", "--resume"])
+
+    with pytest.raises(SystemExit):
+        main.main()
@@ -0,0 +1,86 @@
+import pandas as pd
+
+from askmevllm import helpers, screening
+from askmevllm.screening import ParagraphScreen
+
+LONG_TEXT = "The Eiffel Tower was built for the 1889 World's Fair in Paris and was the tallest structure in the world for four decades after it opened {}."
+
+
+def _write_corpus(path, rows: int = 60):
+    texts = [LONG_TEXT.format(i) if i % 3 else "Too short." for i in range(rows)]
+    pd.DataFrame(
+        {
+            "id": range(rows),
+            "page_name": [f"Page {i % 7}" for i in range(rows)],
+            "section_name": "History",
+            "subsection_name": None,
+            "subsubsection_name": None,
+            "text": texts,
+            "section_hierarchy": "History",
+            "text_cleaned": texts,
+            "word_count": [len(t.split()) for t in texts],
+            "is_bad": False,
+        }
+    ).to_csv(path, index=False)
+    return str(path)
+
+
+def test_sample_is_screened_while_sampling(object_dataset, tmp_path, monkeypatch):
+    path = _write_corpus(tmp_path / "wiki.csv")
+    skipped_path = str(tmp_path / "screen" / "skipped.csv")
+    monkeypatch.setattr(screening, "SCREEN_PARAGRAPHS", True)
+    monkeypatch.setattr(helpers, "SCREEN_SKIPPED_PATH", skipped_path)
+
+    helpers.load_csv_data_rand_n(path, 30, chunksize=7)
+
+    assert len(object_dataset.paragraphs) == 30
+    assert all(p.id % 3 for p in object_dataset.paragraphs)
+    assert len(object_dataset.pending_paragraphs) == 30
+    skipped = pd.read_csv(skipped_path)
+    assert list(skipped.columns) == ["id", "page_name", "section_name", "skip_reason"]
+    assert list(skipped["id"]) == list(range(0, 60, 3))
+    assert set(skipped["skip_reason"]) == {"too_short"}
+
+
+def test_nothing_skipped_still_writes_a_header(tmp_path):
+    path = _write_corpus(tmp_path / "wiki.csv", rows=6)
+    screen = ParagraphScreen(min_words=1, duplicate_text=False, skipped_path=str(tmp_path / "skipped.csv"))
+    helpers.reservoir_sample_csv(path, 3, chunksize=4, screen=screen)
+    assert pd.read_csv(tmp_path / "skipped.csv").empty
+
+
+def test_screen_counts_every_row(tmp_path):
+    path = _write_corpus(tmp_path / "wiki.csv")
+    screen = ParagraphScreen()
+    sample, eligible = helpers.reservoir_sample_csv(path, 10, chunksize=7, screen=screen)
+
+    assert eligible == 40
+    assert len(sample) == 10
+    assert screen.counts == {None: 40, "too_short": 20}
+
+
+def test_default_seed_draws_the_same_sample(tmp_path):
+    path = _write_corpus(tmp_path / "wiki.csv")
+    first, _ = helpers.reservoir_sample_csv(path, 10, chunksize=7)
+    again, _ = helpers.reservoir_sample_csv(path, 10, chunksize=7)
+    assert sorted(first["id"]) == sorted(again["id"])
+
+
+def test_chunk_size_does_not_change_what_is_loaded(object_dataset, tmp_path):
+    path = _write_corpus(tmp_path / "wiki.csv", rows=30)
+    loaded = []
+    for chunksize in (4, 1000):
+        helpers.load_csv_data_all(path, overwrite=True, chunksize=chunksize)
+        loaded.append([(p.id, p.page_name, p.text, p.word_count) for p in object_dataset.paragraphs])
+
+    assert loaded[0] == loaded[1]
+    assert len(loaded[0]) == 30
+    lengths = [len(text) for _, _, text, _ in loaded[0]]
+    assert lengths == sorted(lengths, reverse=True)
+
+
+def test_sample_larger_than_the_file_keeps_every_row(tmp_path):
+    path = _write_corpus(tmp_path / "wiki.csv", rows=12)
+    sample, eligible = helpers.reservoir_sample_csv(path, 50, chunksize=5)
+    assert eligible == 12
+    assert sorted(sample["id"]) == list(range(12))
@@ -0,0 +1,51 @@
+import json
+
+from askmevllm.engine import FakeBackend, SamplingParams
+from askmevllm.metrics import JsonlMetricsSink, MetricsRecorder, PrometheusFileSink
+
+
+def _record(recorder, stage="stage_3", prompts=("Who designed the tower?", "Where is it?")):
+    with recorder.batch(stage, items=1) as timer:
+        with timer.phase("generate"):
+            timer.outputs = FakeBackend().generate(list(prompts), SamplingParams(max_tokens=20))
+    return timer.outputs
+
+
+def test_summary_counts_tokens_requests_and_failures():
+    recorder = MetricsRecorder(flush_seconds=3600)
+    outputs = _record(recorder) + _record(recorder)
+    recorder.parse_failure("stage_3", "empty_answer")
+    recorder.record_fill("stage_3", 0.5)
+
+    summary = recorder.summary()["stage_3"]
+    assert (summary["batches"], summary["items"], summary["requests"]) == (2, 2, 4)
+    assert summary["prompt_tokens"] == sum(len(o.prompt_token_ids) for o in outputs)
+    assert summary["generated_tokens"] == sum(len(o.outputs[0].token_ids) for o in outputs)
+    assert summary["parse_failures"] == {"empty_answer": 1}
+    assert summary["mean_fill"] == 0.5
+    assert summary["latency_seconds"]["0.5"] is not None
+    assert summary["latency_count"] == 4
+    assert summary["latency_seconds_sum"] >= summary["latency_seconds"]["0.5"]
+
+
+def test_sinks_get_labelled_events_and_summaries(tmp_path):
+    jsonl_path = tmp_path / "metrics.jsonl"
+    prometheus_path = tmp_path / "metrics.prom"
+    recorder = MetricsRecorder(
+        [JsonlMetricsSink(str(jsonl_path)), PrometheusFileSink(str(prometheus_path))],
+        labels={"shard": 1},
+        flush_seconds=3600,
+    )
+    _record(recorder)
+    recorder.close()
+
+    events = [json.loads(line) for line in jsonl_path.read_text().splitlines()]
+    assert [e["event"] for e in events] == ["batch", "summary"]
+    assert all(e["shard"] == 1 for e in events)
+    assert events[1]["stages"]["stage_3"]["requests"] == 2
+    text = prometheus_path.read_text()
+    assert 'askme_stage_requests_total{shard="1",stage="stage_3"} 2' in text
+    # scrapers need _sum and _count next to the quantiles to compute rates
+    assert 'askme_stage_request_latency_seconds{shard="1",stage="stage_3",quantile="0.5"}' in text
+    assert 'askme_stage_request_latency_seconds_sum{shard="1",stage="stage_3"}' in text
+    assert 'askme_stage_request_latency_seconds_count{shard="1",stage="stage_3"} 2' in text
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from askmevllm.async_engine import BatchingAsyncBackend, create_async_backend
+from askmevllm.async_pipeline import run_async_pipeline
+from askmevllm.engine import FakeBackend, FakeTokenizer, GenerationRequest, SamplingParams
+from askmevllm.main import run_stages_s2s
+from askmevllm.pipeline import build_pipeline_stages, run_pipeline
+from askmevllm.scheduler import make_batchers
+from askmevllm.workers import PrepWorkers
+
+from helpers import make_paragraph
+
+
+def load_paragraphs(dataset, count=4):
+    dataset.add_paragraphs([make_paragraph(i, page_name=f"Page {i}") for i in range(1, count + 1)])
+
+
+def contents(dataset):
+    """The generated entities, without the ids and timestamps that depend on
+    the order batches happen to run in."""
+    questions = {q.id: q for q in dataset.questions}
+    answers = {a.id: a for a in dataset.answers}
+    return {
+        "questions": sorted(
+            (q.paragraph_id, q.text, q.filtered, q.rejected, q.processed) for q in dataset.questions
+        ),
+        "answers": sorted(
+            (questions[a.question_id].text, a.setting, a.text, a.processed) for a in dataset.answers
+        ),
+        "ratings": sorted(
+            (answers[r.answer_id].text, r.value, r.text) for r in dataset.ratings
+        ),
+    }
+
+
+def s2s_contents(dataset):
+    load_paragraphs(dataset)
+    run_stages_s2s(make_batchers(2), FakeBackend())
+    return contents(dataset)
+
+
+@pytest.mark.parametrize("overlap", [False, True])
+def test_pipelined_run_matches_stage_by_stage(use_dataset, overlap):
+    expected = s2s_contents(use_dataset())
+    assert expected["ratings"]
+
+    dataset = use_dataset()
+    load_paragraphs(dataset)
+    times = run_pipeline(build_pipeline_stages(2), FakeBackend(), 8, progress=False, overlap=overlap)
+
+    assert contents(dataset) == expected
+    assert all(p.processed for p in dataset.paragraphs)
+    assert set(times) >= {"stage_1_time", "stage_4_time", "total_time"}
+
+
+class RecordingBackend(FakeBackend):
+    def __init__(self):
+        super().__init__()
+        self.pretokenized = []
+
+    def generate(self, prompts, sampling_params, prompt_token_ids=None):
+        self.pretokenized.extend(ids is not None for ids in prompt_token_ids or [None] * len(prompts))
+        return super().generate(prompts, sampling_params, prompt_token_ids=prompt_token_ids)
+
+
+def test_prep_workers_tokenize_every_prompt_in_order():
+    tokenizer = FakeTokenizer()
+    requests = [GenerationRequest(f"Question number {i} about the tower", SamplingParams()) for i in range(50)]
+    workers = PrepWorkers(tokenizer, max_workers=4, chunk_size=8)
+    workers.tokenize(requests)
+    workers.close()
+
+    assert [r.prompt_token_ids for r in requests] == [tokenizer.encode(r.prompt) for r in requests]
+
+
+def test_pretokenized_pipeline_matches_stage_by_stage(use_dataset):
+    expected = s2s_contents(use_dataset())
+
+    dataset = use_dataset()
+    load_paragraphs(dataset)
+    llm = RecordingBackend()
+    run_pipeline(build_pipeline_stages(2), llm, 8, progress=False, overlap=True, tokenizer=FakeTokenizer())
+
+    assert contents(dataset) == expected
+    assert llm.pretokenized and all(llm.pretokenized)
+
+
+def test_async_pipeline_matches_stage_by_stage(use_dataset):
+    expected = s2s_contents(use_dataset())
+
+    dataset = use_dataset()
+    load_paragraphs(dataset)
+    llm = BatchingAsyncBackend(FakeBackend(), max_batch_size=8)
+    asyncio.run(run_async_pipeline(build_pipeline_stages(2), llm, 8, max_in_flight=4))
+
+    assert contents(dataset) == expected
+    # requests awaited together share an engine call
+    assert llm.calls < sum(len(rows) for rows in expected.values())
+
+
+def test_fake_async_backend_batches_the_fake_engine():
+    llm = create_async_backend("fake")
+    assert isinstance(llm, BatchingAsyncBackend)
+    with pytest.raises(ValueError):
+        create_async_backend("unknown")
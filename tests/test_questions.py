@@ -0,0 +1,97 @@
+from askmevllm.dataset.questions import (
+    build_question_requests,
+    extract_questions,
+    filter_questions,
+    parse_numbered_list,
+    parse_question_list_json,
+    question_sampling_params,
+)
+from askmevllm.engine import FakeBackend
+
+from helpers import make_paragraph, make_question
+
+QUESTIONS = [
+    "When was the Eiffel Tower built?",
+    "Who designed the Eiffel Tower?",
+    "Where is the Eiffel Tower?",
+    "What is the Eiffel Tower made of?",
+]
+
+
+def _completion(lines):
+    # the completion of a stop-mode prompt that was prefilled with "1."
+    return " " + "\n".join(lines)
+
+
+def test_stop_mode_reads_the_prefilled_first_item():
+    text = _completion([QUESTIONS[0]] + [f"{i}. {q}" for i, q in enumerate(QUESTIONS[1:], 2)])
+    assert extract_questions(text, "stop", 4) == QUESTIONS
+
+
+def test_stop_mode_drops_closing_remarks():
+    lines = [QUESTIONS[0]] + [f"{i}. {q}" for i, q in enumerate(QUESTIONS[1:], 2)]
+    for remark in (["", "I hope these questions help!"], ["Let me know if you need more."]):
+        assert extract_questions(_completion(lines + remark), "stop", 4) == QUESTIONS
+
+
+def test_stop_mode_drops_a_preamble_after_the_prefill():
+    for preamble in ("Here are four questions about the paragraph:", "Sure! Here you go."):
+        lines = [preamble, ""] + [f"{i}. {q}" for i, q in enumerate(QUESTIONS, 1)]
+        assert extract_questions(_completion(lines), "stop", 4) == QUESTIONS
+
+
+def test_wrapped_items_are_joined_until_they_close():
+    text = "1. When was the Eiffel\nTower built?\n2) Who designed\n  it?\nThat is all."
+    assert parse_numbered_list(text) == ["When was the Eiffel Tower built?", "Who designed it?"]
+
+
+def test_blank_line_ends_an_item():
+    assert parse_numbered_list("1. Name the engineer\n\nThanks!") == ["Name the engineer"]
+
+
+def test_free_mode_keeps_only_numbered_lines():
+    text = "Sure, here they are:\n1. " + QUESTIONS[0] + "\nwrapped\n2. " + QUESTIONS[1]
+    assert extract_questions(text, "free", 4) == QUESTIONS[:2]
+
+
+def test_free_mode_parses_as_the_original_pipeline():
+    # single-digit "N." at the very start of a line only
+    text = "\n".join(["1. " + QUESTIONS[0], " 2. Indented?", "3) Parenthesis?", "10. Two digits?", "4.Tight?"])
+    assert extract_questions(text, "free", 4) == [QUESTIONS[0], "Tight?"]
+
+
+def test_guided_mode_recovers_closed_strings_of_a_cut_off_list():
+    text = '{"questions": ["' + QUESTIONS[0] + '", "' + QUESTIONS[1] + '", "When was'
+    assert parse_question_list_json(text) == QUESTIONS[:2]
+    assert extract_questions('{"questions": ["a", "b", "c"]}', "guided", 2) == ["a", "b"]
+
+
+def test_stop_mode_stops_before_the_next_item():
+    assert question_sampling_params(4, "stop").stop == ["\n5."]
+
+
+def test_filter_sends_ic_and_zs_in_one_engine_call(object_dataset):
+    object_dataset.add_paragraphs([make_paragraph(1)])
+    questions = [make_question(object_dataset, 1, text) for text in QUESTIONS[:3]]
+    object_dataset.add_questions(questions)
+    calls = []
+
+    class Counting(FakeBackend):
+        def generate(self, prompts, sampling_params, prompt_token_ids=None):
+            calls.append(len(prompts))
+            return super().generate(prompts, sampling_params, prompt_token_ids)
+
+    updated = filter_questions(questions, Counting())
+
+    assert calls == [6]
+    assert [q.id for q in updated] == [q.id for q in questions]
+    for q in updated:
+        assert q.answerable_ic_confidence is not None
+        assert q.answerable_zs_confidence is not None
+
+
+def test_question_author_keeps_the_original_model_name(object_dataset):
+    object_dataset.add_paragraphs([make_paragraph(1)])
+    [request] = build_question_requests(object_dataset.paragraphs)
+    author_id = request.key[2]
+    assert object_dataset.author_dict[author_id].model == "llama3-70B-instruct"
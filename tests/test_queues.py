@@ -0,0 +1,29 @@
+from askmevllm.models import PendingQueue
+
+from helpers import make_paragraph, make_question
+
+
+def test_done_items_are_dropped_when_popped():
+    done = set()
+    queue = PendingQueue(lambda item: item in done)
+    queue.extend(range(6))
+    done.update({1, 2})
+
+    assert queue.pop_batch(2) == [0, 3]
+    queue.push_front([0, 3])
+    assert queue.pop_batch(10) == [0, 3, 4, 5]
+    assert len(queue) == 0
+
+
+def test_queues_follow_each_stage(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph(1), make_paragraph(2, skip_reason="too_short")])
+    fresh_dataset.add_questions([make_question(fresh_dataset, 1, f"Question {i}?") for i in range(3)])
+
+    assert [p.id for p in fresh_dataset.pending_paragraphs.pop_batch(10)] == [1]
+    [first, second, third] = fresh_dataset.pending_filter.pop_batch(10)
+    first.filtered = second.filtered = True
+    second.processed = True
+
+    fresh_dataset.build_pending_queues()
+    assert [q.id for q in fresh_dataset.pending_filter.pop_batch(10)] == [third.id]
+    assert [q.id for q in fresh_dataset.pending_answer.pop_batch(10)] == [first.id]
@@ -0,0 +1,73 @@
+import pytest
+
+from askmevllm.dataset.ratings import (
+    SCORE_PREFILL,
+    build_rating_requests,
+    build_rationale_requests,
+    parse_rating_outputs,
+    parse_rationale_outputs,
+)
+from askmevllm.engine import FakeBackend, generate_requests
+from askmevllm.models import Answer
+
+from helpers import make_paragraph, make_question, output
+
+
+@pytest.fixture
+def answers(object_dataset):
+    object_dataset.add_paragraphs([make_paragraph(1)])
+    question = make_question(object_dataset, 1, "Who designed the Eiffel Tower?")
+    object_dataset.add_questions([question])
+    answers = [
+        Answer(id=i, question_id=question.id, author_id=1, setting=setting, timestamp="t", text="Gustave Eiffel")
+        for i, setting in enumerate(["ic", "zs"], 1)
+    ]
+    object_dataset.add_answers(answers)
+    return answers
+
+
+def _rate(answers, mode):
+    requests = build_rating_requests(answers, mode)
+    return requests, parse_rating_outputs(requests, generate_requests(FakeBackend(), requests))
+
+
+def test_score_first_decodes_one_token_and_queues_rationales(object_dataset, answers):
+    requests, ratings = _rate(answers, "score_first")
+
+    assert all(r.prompt.endswith(SCORE_PREFILL) for r in requests)
+    assert all(r.sampling_params.max_tokens == 1 for r in requests)
+    assert [r.answer_id for r in ratings] == [1, 2]
+    assert all(r.text is None and r.value in range(6) and 0 < r.confidence <= 1 for r in ratings)
+
+    object_dataset.add_ratings(ratings)
+    queued = object_dataset.pending_rationale.pop_batch(10)
+    rationale_requests = build_rationale_requests(queued)
+    # the continuation extends the scored prompt, so its prefix stays cached
+    for rating, scored, continued in zip(ratings, requests, rationale_requests):
+        assert continued.prompt.startswith(f"{scored.prompt} {rating.value}")
+    parse_rationale_outputs(rationale_requests, generate_requests(FakeBackend(), rationale_requests))
+    assert all(object_dataset.rating_dict[r.id].text for r in ratings)
+
+
+def test_score_only_needs_no_rationale(object_dataset, answers):
+    _, ratings = _rate(answers, "score_only")
+    object_dataset.add_ratings(ratings)
+
+    assert [r.text for r in ratings] == ["", ""]
+    assert not object_dataset.pending_rationale.pop_batch(10)
+
+
+def test_free_mode_reads_score_and_rationale(answers):
+    requests = build_rating_requests(answers[:1], "free")
+    text = " Answer: 4 \n Rationale: Names the engineer."
+    [rating] = parse_rating_outputs(requests, [output(text)])
+    assert (rating.value, rating.text, rating.confidence) == (4, "Names the engineer.", None)
+
+
+def test_empty_rationale_is_left_pending(object_dataset, answers):
+    _, ratings = _rate(answers[:1], "score_first")
+    object_dataset.add_ratings(ratings)
+    requests = build_rationale_requests(ratings)
+
+    assert parse_rationale_outputs(requests, [output("  ")]) == []
+    assert object_dataset.pending_rationale.pop_batch(10) == ratings
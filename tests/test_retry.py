@@ -0,0 +1,59 @@
+from askmevllm.dataset.questions import apply_filter_outputs, build_filter_requests
+from askmevllm.retry import settle_batch
+
+from helpers import make_paragraph, make_question, output
+
+YES = {"Y": 0.9, "N": 0.1}
+NO_LABEL = {"Maybe": 1.0}
+
+
+def _filter(questions, verdicts):
+    """Runs stage 2 on `questions`; `verdicts` gives the IC and ZS
+    logprobs of each question in turn."""
+    requests = build_filter_requests(questions)
+    outputs = [output(logprobs=verdicts[(request.key[0].id, request.key[1])]) for request in requests]
+    apply_filter_outputs(questions, requests, outputs)
+    return settle_batch("stage_2", questions)
+
+
+def _add_question(dataset, text="When was the Eiffel Tower built?"):
+    dataset.add_paragraphs([make_paragraph()])
+    dataset.add_questions([make_question(dataset, 1, text)])
+    return dataset.pending_filter.pop_batch(1)
+
+
+def test_filter_retry_that_succeeds_clears_rejection(fresh_dataset):
+    questions = _add_question(fresh_dataset)
+    qid = questions[0].id
+
+    assert _filter(questions, {(qid, "ic"): YES, (qid, "zs"): NO_LABEL}) == []
+    assert fresh_dataset.retries.attempt("stage_2", qid) == 1
+
+    retried = fresh_dataset.pending_filter.pop_batch(8)
+    assert [q.id for q in retried] == [qid]
+    assert _filter(retried, {(qid, "ic"): YES, (qid, "zs"): YES}) == retried
+
+    question = fresh_dataset.question_dict[qid]
+    assert question.filtered
+    assert question.is_answerable_ic and question.is_answerable_zs
+    assert not question.rejected
+    assert fresh_dataset.retries.attempt("stage_2", qid) == 0
+    assert [q.id for q in fresh_dataset.pending_answer.pop_batch(8)] == [qid]
+
+
+def test_filter_failures_become_dead_letters(fresh_dataset):
+    fresh_dataset.retries.max_attempts = 2
+    questions = _add_question(fresh_dataset)
+    qid = questions[0].id
+    verdicts = {(qid, "ic"): NO_LABEL, (qid, "zs"): NO_LABEL}
+
+    assert _filter(questions, verdicts) == []
+    retried = fresh_dataset.pending_filter.pop_batch(8)
+    assert _filter(retried, verdicts) == retried
+
+    assert fresh_dataset.question_dict[qid].filtered
+    assert fresh_dataset.question_dict[qid].rejected
+    assert len(fresh_dataset.pending_filter) == 0
+    assert [(d["stage"], d["id"], d["reason"]) for d in fresh_dataset.retries.dead_letters] == [
+        ("stage_2", qid, "no_verdict")
+    ]
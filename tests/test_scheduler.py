@@ -0,0 +1,62 @@
+from dataclasses import dataclass
+
+from askmevllm.models import PendingQueue
+from askmevllm.scheduler import TokenBudgetBatcher
+
+
+@dataclass
+class Item:
+    id: int
+    tokens: int
+    done: bool = False
+
+
+def _batcher(costed=None, **kwargs):
+    def cost(item):
+        if costed is not None:
+            costed.append(item.id)
+        return item.tokens
+
+    kwargs.setdefault("max_batch_size", 4)
+    kwargs.setdefault("lookahead", 2)
+    return TokenBudgetBatcher("stage_test", cost, **kwargs)
+
+
+def _queue(items):
+    queue = PendingQueue(lambda item: item.done)
+    queue.extend(items)
+    return queue
+
+
+def test_batches_fit_the_budget_around_the_oldest_item():
+    queue = _queue([Item(i, tokens) for i, tokens in enumerate([40, 50, 45, 10, 500, 60], 1)])
+    batcher = _batcher(max_batch_tokens=100)
+
+    batches = [[item.id for item in batcher.next_batch(queue)] for _ in range(4)]
+
+    assert batches == [[1, 3, 4], [2], [5], [6]]
+    assert batcher.next_batch(queue) == []
+
+
+def test_put_back_items_are_costed_once():
+    costed = []
+    queue = _queue([Item(i, 60) for i in range(1, 5)])
+    batcher = _batcher(costed, max_batch_tokens=100)
+
+    while batcher.next_batch(queue):
+        pass
+
+    assert costed == [1, 2, 3, 4]
+
+
+def test_dropped_items_are_evicted():
+    items = [Item(i, 60) for i in range(1, 5)]
+    queue = _queue(items)
+    batcher = _batcher(max_batch_tokens=100)
+
+    batcher.next_batch(queue)
+    assert set(batcher._costs) == {("Item", 2), ("Item", 3), ("Item", 4)}
+    items[1].done = items[2].done = True
+    assert [item.id for item in batcher.next_batch(queue)] == [4]
+    assert batcher._costs == {}
+
@@ -0,0 +1,77 @@
+from askmevllm.config import SHARD_ID_SPAN
+from askmevllm.journal import Journal
+from askmevllm.models import Author
+from askmevllm.sharded import ShardMerger, paragraph_data, run_sharded, shard_journal_dir
+
+from helpers import make_paragraph
+
+
+def _stage_1_batch(question_ids, duplicate=None):
+    author = {"id": 1, "model": "m", "prompt": "template", "username": None}
+    records = [{"type": "author", "data": author}]
+    for question_id in question_ids:
+        records.append(
+            {
+                "type": "question",
+                "data": dict(
+                    id=question_id,
+                    paragraph_id=1,
+                    scope="single-paragraph",
+                    context="",
+                    text=f"Question {question_id}?",
+                    author_id=1,
+                    timestamp="2024-01-01 00:00:00",
+                ),
+            }
+        )
+    if duplicate is not None:
+        records.append({"type": "questions_duplicate", "pairs": [list(duplicate)]})
+    records.append({"type": "paragraphs_processed", "ids": [1]})
+    return records
+
+
+def test_merger_gives_each_shard_its_own_ids(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph(1)])
+    merger = ShardMerger(fresh_dataset)
+
+    assert merger.apply(0, _stage_1_batch([1, 2], duplicate=(2, 1))) == 1
+    merger.apply(1, _stage_1_batch([1, 2]))
+
+    assert len({q.id for q in fresh_dataset.questions}) == 4
+    assert len(fresh_dataset.authors) == 1
+    assert fresh_dataset.authors[0].hash == Author.generate_hash("m", "template")
+    shard_0 = merger.maps[0]["question"]
+    assert fresh_dataset.question_dict[shard_0[2]].duplicate_of == shard_0[1]
+    shard_1 = merger.maps[1]["question"]
+    assert fresh_dataset.question_dict[shard_1[2]].duplicate_of is None
+    assert set(shard_0.values()).isdisjoint(shard_1.values())
+    # shard 0's ids were free, so they are kept; shard 1's collide
+    assert shard_0 == {1: 1, 2: 2}
+
+
+def test_paragraph_data_serializes_either_storage(fresh_dataset):
+    fresh_dataset.add_paragraphs([make_paragraph(7)])
+    assert paragraph_data(fresh_dataset.paragraphs[0]) == paragraph_data(make_paragraph(7))
+
+
+def test_run_sharded_merges_every_shard(fresh_dataset, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fresh_dataset.add_paragraphs([make_paragraph(i, page_name=f"Page {i}") for i in range(1, 5)])
+
+    stats = run_sharded(
+        fresh_dataset.paragraphs, str(tmp_path / "journal"), 4, devices=[None, None], engine="fake"
+    )
+
+    assert stats["restarts"] == [0, 0]
+    assert all(p.processed for p in fresh_dataset.paragraphs)
+    assert len(fresh_dataset.questions) > 0
+    assert len({q.id for q in fresh_dataset.questions}) == len(fresh_dataset.questions)
+    assert {q.paragraph_id for q in fresh_dataset.questions} <= {1, 2, 3, 4}
+    # each worker mints from its own range, and the merge keeps those ids
+    shard_ids = set()
+    for shard in (0, 1):
+        journal = Journal(shard_journal_dir(str(tmp_path / "journal"), shard))
+        ids = {r["data"]["id"] for batch in journal.read_batches() for r in batch if r["type"] == "question"}
+        assert all((shard + 1) * SHARD_ID_SPAN < i <= (shard + 2) * SHARD_ID_SPAN for i in ids)
+        shard_ids |= ids
+    assert shard_ids == {q.id for q in fresh_dataset.questions}